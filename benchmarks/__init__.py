@@ -0,0 +1,7 @@
+"""
+Benchmarks for the churlish middleware and the URL tree API.
+
+Driven by ``runbenchmarks.py`` at the root of the repository, which
+configures a standalone project, generates a synthetic URL tree and emits
+the results as JSON so that two runs may be compared.
+"""
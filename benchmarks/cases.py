@@ -0,0 +1,134 @@
+"""
+The individual measurements. Each returns plain dictionaries, so that the
+runner can serialise them without further ado.
+"""
+from timeit import default_timer
+from django.http import Http404
+from django.test.client import RequestFactory
+from django.contrib.auth.models import AnonymousUser
+from churlish.middleware import ChurlishMiddleware
+from churlish.models import URL
+from churlish.querycount import QueryCounter
+from .urls import benchmark_view
+
+
+def summarise(timings):
+    """
+    Reduces a list of durations (in seconds) to the statistics worth
+    comparing between runs, in milliseconds.
+    """
+    if not timings:
+        return {}
+    ordered = sorted(timings)
+    count = len(ordered)
+
+    def percentile(pct):
+        index = min(count - 1, int(round(pct / 100.0 * (count - 1))))
+        return ordered[index] * 1000.0
+
+    return {
+        'count': count,
+        'min': ordered[0] * 1000.0,
+        'mean': (sum(ordered) / count) * 1000.0,
+        'p50': percentile(50),
+        'p95': percentile(95),
+        'p99': percentile(99),
+        'max': ordered[-1] * 1000.0,
+    }
+
+
+def _run_middleware(middleware, request):
+    """
+    As a request would go through it, so redirects issued early by
+    `process_request` are measured as such.
+    """
+    try:
+        response = middleware.process_request(request)
+        if response is None:
+            response = middleware.process_view(request, benchmark_view, (),
+                                               {})
+    except Http404:
+        return 'failed'
+    if response is None:
+        return 'passed'
+    if response.status_code in (301, 302):
+        return 'redirected'
+    return 'responded'
+
+
+def bench_process_view(paths_by_depth, users, iterations):
+    """
+    Measures `ChurlishMiddleware.process_request` & `process_view` for
+    each depth, for both an anonymous and an authenticated user, recording
+    the latency, the number of queries per request and the outcomes seen.
+    """
+    factory = RequestFactory()
+    middleware = ChurlishMiddleware()
+    identities = (('anonymous', AnonymousUser()),
+                  ('authenticated', users[0]))
+    results = {}
+    for depth in sorted(paths_by_depth):
+        paths = paths_by_depth[depth]
+        for identity, user in identities:
+            requests = []
+            for path in paths:
+                request = factory.get(path)
+                request.user = user
+                requests.append(request)
+            timings = []
+            outcomes = {}
+            for _ in range(iterations):
+                for request in requests:
+                    started = default_timer()
+                    outcome = _run_middleware(middleware, request)
+                    timings.append(default_timer() - started)
+                    outcomes[outcome] = outcomes.get(outcome, 0) + 1
+            queries = []
+            for request in requests:
+                with QueryCounter() as counter:
+                    _run_middleware(middleware, request)
+                queries.append(counter.count)
+            key = '{depth:d}:{identity!s}'.format(depth=depth,
+                                                  identity=identity)
+            results[key] = {
+                'depth': depth,
+                'identity': identity,
+                'latency_ms': summarise(timings),
+                'queries': {
+                    'min': min(queries) if queries else 0,
+                    'max': max(queries) if queries else 0,
+                    'mean': (float(sum(queries)) / len(queries)
+                             if queries else 0),
+                },
+                'outcomes': outcomes,
+            }
+    return results
+
+
+def bench_tree_api(paths, iterations):
+    """
+    Measures the throughput of the treebeard-ish API on `URL`, evaluating
+    each queryset fully, as a caller would.
+    """
+    instances = tuple(URL(path=path) for path in paths)
+    operations = (
+        ('get_ancestors', lambda url: url.get_ancestors(include_self=True)),
+        ('get_descendants', lambda url: url.get_descendants()),
+        ('get_children', lambda url: url.get_children()),
+    )
+    results = {}
+    for name, operation in operations:
+        timings = []
+        rows = 0
+        for _ in range(iterations):
+            for instance in instances:
+                started = default_timer()
+                rows += len(tuple(operation(instance).iterator()))
+                timings.append(default_timer() - started)
+        total = sum(timings)
+        results[name] = {
+            'latency_ms': summarise(timings),
+            'ops_per_second': (len(timings) / total) if total else None,
+            'rows': rows,
+        }
+    return results
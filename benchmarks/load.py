@@ -0,0 +1,241 @@
+"""
+Replays a stream of requests against the project through a real (if
+local) WSGI server, from many client threads at once, so that contention
+on the snapshots, caches and database connections shows up in the numbers
+in a way that calling the middleware directly never does.
+
+Paths are drawn from a Zipf distribution over the generated tree, as real
+traffic favours a handful of pages over the long tail.
+"""
+import random
+import threading
+from bisect import bisect_left
+from timeit import default_timer
+from wsgiref.simple_server import (make_server, WSGIServer,
+                                   WSGIRequestHandler)
+from churlish.models import PATH_SEP
+from churlish.querycount import QueryCounter
+from .cases import summarise
+
+try:
+    from socketserver import ThreadingMixIn
+except ImportError:  # pragma: no cover ... Python 2.
+    from SocketServer import ThreadingMixIn
+
+try:
+    from http.client import HTTPConnection
+except ImportError:  # pragma: no cover ... Python 2.
+    from httplib import HTTPConnection
+
+try:
+    from django.core.wsgi import get_wsgi_application
+except ImportError:  # pragma: no cover ... Django < 1.4
+    def get_wsgi_application():
+        from django.core.handlers.wsgi import WSGIHandler
+        return WSGIHandler()
+
+
+# the settings each configuration is run under; anything not mentioned
+# keeps its default.
+CONFIGURATIONS = {
+    'reference': {},
+    'reference-cache-headers': {'CHURLISH_CACHE_HEADERS': True},
+    'reference-authorization-cache': {'CHURLISH_AUTHORIZATION_CACHE': True},
+    'snapshot': {'CHURLISH_ENGINE': 'snapshot'},
+    'snapshot-cache-headers': {'CHURLISH_ENGINE': 'snapshot',
+                               'CHURLISH_CACHE_HEADERS': True},
+    'redirect-fast-path': {'CHURLISH_REDIRECT_FAST_PATH': True},
+    # the cost of deciding every request twice.
+    'shadow-snapshot': {'CHURLISH_SHADOW_ENGINE': 'snapshot',
+                        'CHURLISH_SHADOW_SAMPLE_RATE': 1},
+}
+
+
+class ZipfSampler(object):
+    """
+    Picks from `items` with the probability of the item at rank `k`
+    proportional to 1 / k ** exponent. Which item gets which rank is
+    shuffled by `seed`, so the most popular paths aren't simply the
+    shallowest.
+    """
+    __slots__ = ('ranked', 'cumulative', 'total')
+
+    def __init__(self, items, exponent, seed):
+        self.ranked = list(items)
+        random.Random(seed).shuffle(self.ranked)
+        self.cumulative = []
+        total = 0.0
+        for rank in range(1, len(self.ranked) + 1):
+            total += 1.0 / (rank ** exponent)
+            self.cumulative.append(total)
+        self.total = total
+
+    def sample(self, rng):
+        position = bisect_left(self.cumulative, rng.random() * self.total)
+        return self.ranked[min(position, len(self.ranked) - 1)]
+
+
+def get_candidates(paths):
+    """
+    Each configured path, and a path beneath it which isn't configured,
+    as real traffic mostly hits views below the configured URLs.
+    """
+    for path in paths:
+        yield path
+        yield '{0!s}page{1!s}'.format(path, PATH_SEP)
+
+
+def zipf_streams(paths, count, threads, exponent, seed):
+    """
+    `threads` lists of paths, `count` in total, each drawn independently
+    (but repeatably) from the same distribution.
+    """
+    sampler = ZipfSampler(items=get_candidates(paths), exponent=exponent,
+                          seed=seed)
+    streams = []
+    for index in range(threads):
+        rng = random.Random(seed + index + 1)
+        size = count // threads + (1 if index < count % threads else 0)
+        streams.append([sampler.sample(rng) for _ in range(size)])
+    return streams
+
+
+class ThreadedWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args, **kwargs):
+        return None
+
+
+class CountingApplication(object):
+    """
+    Wraps the WSGI application, counting the queries every request issues
+    on the thread serving it.
+    """
+    __slots__ = ('application', 'lock', 'requests', 'queries')
+
+    def __init__(self, application):
+        self.application = application
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.requests = 0
+            self.queries = 0
+
+    def __call__(self, environ, start_response):
+        with QueryCounter() as counter:
+            response = self.application(environ, start_response)
+            # the body may be lazy, and may query the database as it's read.
+            body = b''.join(response)
+            if hasattr(response, 'close'):
+                response.close()
+        with self.lock:
+            self.requests += 1
+            self.queries += counter.count
+        return [body]
+
+
+class LoadServer(object):
+    """
+    The project, served on an unused port of the loopback interface from a
+    background thread, a thread per request.
+    """
+    __slots__ = ('application', 'server', 'thread')
+
+    def __init__(self):
+        self.application = CountingApplication(get_wsgi_application())
+        self.server = make_server('127.0.0.1', 0, self.application,
+                                  server_class=ThreadedWSGIServer,
+                                  handler_class=QuietHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        return None
+
+
+class Client(threading.Thread):
+    """
+    Requests each path in its stream in turn, one connection per request,
+    recording how long each took and the status it got.
+    """
+
+    def __init__(self, port, paths, cookie=None):
+        super(Client, self).__init__()
+        self.daemon = True
+        self.port = port
+        self.paths = paths
+        self.headers = {}
+        if cookie is not None:
+            self.headers['Cookie'] = cookie
+        self.timings = []
+        self.statuses = {}
+        self.errors = 0
+
+    def run(self):
+        for path in self.paths:
+            started = default_timer()
+            try:
+                connection = HTTPConnection('127.0.0.1', self.port,
+                                            timeout=30)
+                connection.request('GET', path, headers=self.headers)
+                response = connection.getresponse()
+                response.read()
+                connection.close()
+            except (IOError, OSError):
+                self.errors += 1
+                continue
+            self.timings.append(default_timer() - started)
+            status = str(response.status)
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+
+
+def replay(server, streams, cookie=None):
+    """
+    Runs a Client for each stream at once, returning the latency, the
+    throughput and the queries issued across all of them.
+    """
+    server.application.reset()
+    clients = [Client(port=server.port, paths=stream, cookie=cookie)
+               for stream in streams]
+    started = default_timer()
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    elapsed = default_timer() - started
+
+    timings = []
+    statuses = {}
+    for client in clients:
+        timings.extend(client.timings)
+        for status, count in client.statuses.items():
+            statuses[status] = statuses.get(status, 0) + count
+    served = server.application.requests
+    queries = server.application.queries
+    return {
+        'threads': len(clients),
+        'elapsed': elapsed,
+        'latency_ms': summarise(timings),
+        'requests_per_second': len(timings) / elapsed if elapsed else 0.0,
+        'queries_per_request': (float(queries) / served) if served else 0.0,
+        'queries_per_second': queries / elapsed if elapsed else 0.0,
+        'statuses': statuses,
+        'errors': sum(x.errors for x in clients),
+    }
@@ -0,0 +1,144 @@
+"""
+Generates synthetic URL trees, along with a mixture of the rules which
+may be attached to each URL.
+"""
+import random
+from collections import namedtuple
+from django.contrib.auth.models import Group
+from churlish.models import (URL, URLRedirect, URLVisible,
+                             SimpleAccessRestriction, GroupAccessRestriction,
+                             UserAccessRestriction, PATH_SEP)
+
+try:
+    from django.contrib.auth import get_user_model
+except ImportError:  # pragma: no cover ... Django < 1.5
+    from django.contrib.auth.models import User
+
+    def get_user_model():
+        return User
+
+try:
+    from django.utils.timezone import now
+except ImportError:
+    from datetime import datetime
+    now = datetime.now
+
+
+TreeSpec = namedtuple('TreeSpec', 'size depth fanout seed')
+RuleMix = namedtuple('RuleMix', 'redirect visible access group user')
+GeneratedTree = namedtuple('GeneratedTree', 'spec mix paths users groups '
+                                            'counts')
+
+DEFAULT_MIX = RuleMix(redirect=0.02, visible=0.05, access=0.03, group=0.02,
+                      user=0.01)
+
+
+def generate_paths(spec):
+    """
+    Breadth first, so that every level of the tree up to `depth` is filled
+    (subject to `fanout`) before the next one is started, and every path
+    has all of its ancestors present.
+    """
+    yield PATH_SEP
+    produced = 1
+    level = [PATH_SEP]
+    for depth in range(1, spec.depth + 1):
+        next_level = []
+        for parent in level:
+            for index in range(spec.fanout):
+                if produced >= spec.size:
+                    return
+                path = '{parent!s}s{depth:d}n{index:d}{sep!s}'.format(
+                    parent=parent, depth=depth, index=index, sep=PATH_SEP)
+                next_level.append(path)
+                produced += 1
+                yield path
+        level = next_level
+
+
+def _chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def populate(site, spec, mix=DEFAULT_MIX, batch_size=2000):
+    """
+    Fills the database with `spec.size` URLs for the given `site`, and
+    then sprinkles rules over them according to `mix`, a set of ratios
+    between 0 and 1. The same `spec` always generates the same tree.
+    """
+    rng = random.Random(spec.seed)
+    user_model = get_user_model()
+    groups = tuple(Group.objects.create(name='benchmark-{0:d}'.format(x))
+                   for x in range(5))
+    users = []
+    for index in range(5):
+        user = user_model.objects.create(
+            username='benchmark-{0:d}'.format(index))
+        user.groups.add(groups[index])
+        users.append(user)
+
+    paths = tuple(generate_paths(spec))
+    for chunk in _chunked(paths, batch_size):
+        URL.objects.bulk_create(URL(site=site, path=path) for path in chunk)
+
+    counts = dict.fromkeys(RuleMix._fields, 0)
+    current = now()
+    for chunk in _chunked(paths, batch_size):
+        ids = URL.objects.filter(site=site, path__in=chunk).values_list(
+            'pk', flat=True)
+        redirects, visibles, access, by_group, by_user = [], [], [], [], []
+        for pk in ids:
+            if rng.random() < mix.redirect:
+                redirects.append(URLRedirect(url_id=pk, target='/'))
+            if rng.random() < mix.visible:
+                visibles.append(URLVisible(url_id=pk, publish_on=current))
+            if rng.random() < mix.access:
+                access.append(SimpleAccessRestriction(
+                    url_id=pk, is_authenticated=True,
+                    is_staff=rng.random() < 0.5))
+            if rng.random() < mix.group:
+                by_group.append(GroupAccessRestriction(
+                    url_id=pk, group=rng.choice(groups)))
+            if rng.random() < mix.user:
+                by_user.append(UserAccessRestriction(
+                    url_id=pk, user=rng.choice(users)))
+        for model, rows, name in ((URLRedirect, redirects, 'redirect'),
+                                  (URLVisible, visibles, 'visible'),
+                                  (SimpleAccessRestriction, access, 'access'),
+                                  (GroupAccessRestriction, by_group, 'group'),
+                                  (UserAccessRestriction, by_user, 'user')):
+            if rows:
+                model.objects.bulk_create(rows)
+                counts[name] += len(rows)
+
+    return GeneratedTree(spec=spec, mix=mix, paths=paths, users=tuple(users),
+                         groups=groups, counts=counts)
+
+
+def sample_by_depth(paths, per_depth, seed):
+    """
+    Groups the generated paths by their depth, picking up to `per_depth`
+    of them for each, and adding a path which doesn't exist in the tree
+    beneath each one, as real traffic mostly hits views below the
+    configured URLs.
+    """
+    rng = random.Random(seed)
+    by_depth = {}
+    for path in paths:
+        depth = len(tuple(x for x in path.split(PATH_SEP) if x))
+        by_depth.setdefault(depth, []).append(path)
+    sampled = {}
+    for depth, candidates in by_depth.items():
+        count = min(per_depth, len(candidates))
+        chosen = rng.sample(candidates, count)
+        sampled[depth] = sampled.get(depth, ()) + tuple(chosen)
+        sampled[depth + 1] = sampled.get(depth + 1, ()) + tuple(
+            '{0!s}unconfigured{1!s}'.format(x, PATH_SEP) for x in chosen)
+    return sampled
@@ -0,0 +1,13 @@
+from django.conf.urls import patterns, include, url
+from django.contrib import admin
+from django.http import HttpResponse
+
+
+def benchmark_view(request, *args, **kwargs):
+    return HttpResponse('')
+
+
+urlpatterns = patterns('',
+    url(r'^admin/', include(admin.site.urls)),
+    url(r'^', benchmark_view),
+)
@@ -6,3 +6,6 @@ version = '0.1.0'  # pragma: no cover
 
 def get_version():
     return '0.1.0'
+
+
+default_app_config = 'churlish.apps.ChurlishConfig'
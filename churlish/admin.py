@@ -8,6 +8,8 @@ except ImportError:  # pragma: no-cover ... Python 3.
 
 from django.contrib import admin
 from .models import URL
+from .partials import admin_installed
+from .budgets import budgets_enforced, query_budget
 from .admin_inlines import (VisibleInline, RedirectInline,
                             SimpleAccessInline, GroupAccessInline,
                             UserAccessInline)
@@ -18,7 +20,7 @@ InlineRelation = namedtuple('InlineRelation', 'inline relation')
 
 
 class URLAdmin(admin.ModelAdmin):
-    list_display = ('site', 'path', 'modified')
+    list_display = ('site', 'path', 'kind', 'modified')
     list_display_links = ('site', 'path', 'modified')
     date_hierarchy = 'modified'
     actions = None
@@ -73,7 +75,22 @@ class URLAdmin(admin.ModelAdmin):
     def get_queryset(self, *args, **kwargs):
         relations = tuple(self.get_runtime_relations())
         qs = super(URLAdmin, self).get_queryset(*args, **kwargs)
-        return qs.select_related(*relations)
+        # the site is one of the list_display columns.
+        return (qs.select_related('site', *relations)
+                .prefetch_related(*relations))
+
+    def changelist_view(self, request, extra_context=None):
+        parent = super(URLAdmin, self).changelist_view
+        if not budgets_enforced():
+            return parent(request, extra_context=extra_context)
+        relations = len(tuple(self.get_runtime_relations()))
+        with query_budget('admin_changelist', relations=relations):
+            response = parent(request, extra_context=extra_context)
+            # the list_display callables only run when rendering, so the
+            # response has to be rendered within the budget.
+            if hasattr(response, 'render'):
+                response.render()
+        return response
 
     def get_list_display(self, *args, **kwargs):
         instantiated = (
@@ -99,4 +116,9 @@ class URLAdmin(admin.ModelAdmin):
 
     # def lookup_allowed(self, lookup, value):
     #     return True
-admin.site.register(URL, URLAdmin)
+
+
+# importing this module (eg: for URLAdmin) shouldn't register anything with
+# an admin site which isn't installed.
+if admin_installed():
+    admin.site.register(URL, URLAdmin)
@@ -88,7 +88,8 @@ class GroupAccessInline(URLInline):
         related_instance = getattr(obj, relation_name, None)
         if related_instance is None:
             return False
-        return related_instance.exists()
+        # uses the prefetched rows, rather than a query per changelist row.
+        return len(related_instance.all()) > 0
     get_urladmin_display.short_description = _("Group Restricted")
     get_urladmin_display.boolean = True
 
@@ -106,7 +107,8 @@ class UserAccessInline(URLInline):
         related_instance = getattr(obj, relation_name, None)
         if related_instance is None:
             return False
-        return related_instance.exists()
+        # uses the prefetched rows, rather than a query per changelist row.
+        return len(related_instance.all()) > 0
     get_urladmin_display.short_description = _("User Restricted")
     get_urladmin_display.boolean = True
 
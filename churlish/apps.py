@@ -0,0 +1,10 @@
+from django.apps import AppConfig
+
+
+class ChurlishConfig(AppConfig):
+    name = 'churlish'
+    verbose_name = 'churlish'
+
+    def ready(self):
+        from .warmup import warmup_on_ready
+        warmup_on_ready()
@@ -0,0 +1,93 @@
+"""
+Opt-in caching, between requests, of what an authenticated user may
+access: their groups, and which of a site's URLs restricted to particular
+users or groups they're allowed through to.
+
+Enabled by setting CHURLISH_AUTHORIZATION_CACHE = True. The facts for each
+user & site are kept in the default cache for up to
+CHURLISH_AUTHORIZATION_CACHE_TIMEOUT seconds, and are stale as soon as the
+site's rules change (including the group & user restrictions) or the
+user's groups do, so repeat visits to restricted URLs by the same user
+don't query for any of it.
+"""
+from uuid import uuid4
+from collections import namedtuple
+from django.conf import settings
+from django.core.cache import cache
+from .models import GroupAccessRestriction, UserAccessRestriction
+from .invalidation import (get_generation, get_generation_key,
+                           get_user_generation_key)
+from .sites import get_site_id
+from .middleware_filters import is_authenticated
+
+AuthorizationFacts = namedtuple('AuthorizationFacts',
+                                'groups user_urls group_urls')
+
+
+def authorization_cache_enabled():
+    return getattr(settings, 'CHURLISH_AUTHORIZATION_CACHE', False)
+
+
+def get_timeout():
+    return getattr(settings, 'CHURLISH_AUTHORIZATION_CACHE_TIMEOUT', 3600)
+
+
+def get_facts_key(site_id, user_id):
+    return 'churlish:authorization:{site_id!s}:{user_id!s}'.format(
+        site_id=site_id, user_id=user_id)
+
+
+def build_facts(site_id, user):
+    groups = frozenset(user.groups.values_list('pk', flat=True))
+    user_urls = frozenset(UserAccessRestriction.objects.filter(
+        url__site=site_id, user=user.pk).values_list('url_id', flat=True))
+    group_urls = frozenset()
+    if groups:
+        group_urls = frozenset(GroupAccessRestriction.objects.filter(
+            url__site=site_id, group__in=groups).values_list('url_id',
+                                                             flat=True))
+    return AuthorizationFacts(groups=groups, user_urls=user_urls,
+                              group_urls=group_urls)
+
+
+def get_versions(site_id, user_id):
+    """
+    The generations of the site's rules & the user's groups, along with
+    whatever's cached for the user, in one trip to the cache.
+    """
+    generation_key = get_generation_key(site_id=site_id)
+    user_key = get_user_generation_key(user_id=user_id)
+    facts_key = get_facts_key(site_id=site_id, user_id=user_id)
+    found = cache.get_many([generation_key, user_key, facts_key])
+    generation = found.get(generation_key)
+    if generation is None:
+        generation = get_generation(site_id=site_id)
+    user_generation = found.get(user_key)
+    if user_generation is None:
+        cache.add(user_key, uuid4().hex, None)
+        user_generation = cache.get(user_key)
+    return (generation, user_generation), found.get(facts_key)
+
+
+def get_facts(request):
+    """
+    The AuthorizationFacts for the request's user, or None if they're not
+    logged in, or caching them isn't enabled.
+    """
+    try:
+        return request._churlish_authorization
+    except AttributeError:
+        pass
+    facts = None
+    user = getattr(request, 'user', None)
+    if authorization_cache_enabled() and is_authenticated(user):
+        site_id = get_site_id(request=request)
+        version, cached = get_versions(site_id=site_id, user_id=user.pk)
+        if cached is not None and cached[0] == version:
+            facts = cached[1]
+        else:
+            facts = build_facts(site_id=site_id, user=user)
+            cache.set(get_facts_key(site_id=site_id, user_id=user.pk),
+                      (version, facts), get_timeout())
+    request._churlish_authorization = facts
+    return facts
@@ -0,0 +1,109 @@
+"""
+Maximum query counts for the hot paths, expressed in terms of the things
+they legitimately scale with, so that N+1 patterns (eg: a partial which
+issues a query per ancestor) fail loudly rather than quietly.
+"""
+import logging
+from collections import namedtuple
+from django.conf import settings
+from django.http import Http404
+from .querycount import QueryCounter
+
+
+logger = logging.getLogger(__name__)
+
+
+QueryBudget = namedtuple('QueryBudget', 'fixed per_relation')
+
+DEFAULT_BUDGETS = {
+    # the ancestry query, the site's patterns (only when they may have
+    # changed), and a prefetch per relation.
+    'get_url_data': QueryBudget(fixed=2, per_relation=1),
+    # as above, plus looking up the user's groups once.
+    'process_view': QueryBudget(fixed=3, per_relation=1),
+    # session, user, counts, the page itself, date hierarchy and the
+    # group & user filter lookups, plus a prefetch per relation.
+    'admin_changelist': QueryBudget(fixed=9, per_relation=1),
+    # count & page, plus the ancestor & descendant counts for the page.
+    'drf_list': QueryBudget(fixed=4, per_relation=0),
+}
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def get_budget(name):
+    configured = getattr(settings, 'CHURLISH_QUERY_BUDGETS', {})
+    if name in configured:
+        return QueryBudget(*configured[name])
+    return DEFAULT_BUDGETS[name]
+
+
+def get_limit(name, relations=0):
+    budget = get_budget(name)
+    return budget.fixed + (budget.per_relation * relations)
+
+
+def budgets_enforced():
+    return getattr(settings, 'CHURLISH_ENFORCE_QUERY_BUDGETS', False)
+
+
+class query_budget(object):
+    """
+    Counts the queries issued in the block, raising QueryBudgetExceeded if
+    they exceed the named budget. The number of queries which were `exempt`
+    from it may be assigned to the context manager within the block.
+
+        with query_budget('process_view', relations=5) as budget:
+            ...
+            budget.exempt = 1
+    """
+    __slots__ = ('name', 'relations', 'using', 'counter', 'exempt')
+
+    def __init__(self, name, relations=0, using=None):
+        self.name = name
+        self.relations = relations
+        self.using = using
+        self.counter = None
+        self.exempt = 0
+
+    @property
+    def limit(self):
+        return get_limit(self.name, relations=self.relations)
+
+    def __enter__(self):
+        if self.using is None:
+            self.counter = QueryCounter()
+        else:
+            self.counter = QueryCounter(using=self.using)
+        self.counter.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.counter.__exit__(exc_type, exc_value, traceback)
+        used = self.counter.count - self.exempt
+        limit = self.limit
+        if used <= limit:
+            return None
+        msg = ("{name!s} issued {used:d} queries, but the budget for "
+               "{relations:d} relations is {limit:d}".format(
+                   name=self.name, used=used, relations=self.relations,
+                   limit=limit))
+        # never mask a real error with a budget one; a 404 is a
+        # legitimate outcome though, so it's still held to the budget.
+        if exc_type is None or issubclass(exc_type, Http404):
+            raise QueryBudgetExceeded(msg)
+        logger.error(msg)
+        return None
+
+
+class QueryBudgetTestMixin(object):
+    """
+    For TestCase subclasses:
+
+        with self.assertWithinQueryBudget('get_url_data', relations=5):
+            RequestURL().get_url_data(request=request)
+    """
+    def assertWithinQueryBudget(self, name, **kwargs):
+        return query_budget(name, **kwargs)
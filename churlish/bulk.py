@@ -0,0 +1,410 @@
+"""
+Creating, updating and deleting many URLs, and the rules attached to them,
+at once, as a publishing pipeline would.
+
+Each item of a batch is a dictionary like:
+
+    {"path": "/a/", "kind": "literal",
+     "redirect": {"target": "/b/", "permanent": false},
+     "visible": {"publish_on": "2015-01-01T00:00:00",
+                 "unpublish_on": null},
+     "access": {"is_authenticated": true, "is_staff": false,
+                "is_superuser": false},
+     "groups": [1, 2], "users": [3]}
+
+Only `path` is required. When updating, a rule which is given replaces
+the URL's current one (null, or an empty list, removes it) and a rule which
+isn't given is left alone.
+
+The whole batch is validated before anything is written, and then written
+in one transaction, with the copies of the rules held elsewhere (see
+churlish.invalidation) invalidated once, at the end.
+"""
+from collections import namedtuple
+from django.conf import settings
+from django.contrib.auth.models import Group
+from django.core.exceptions import ValidationError
+from .models import (URL, URLRedirect, URLVisible, SimpleAccessRestriction,
+                     GroupAccessRestriction, UserAccessRestriction, LITERAL,
+                     KIND_CHOICES, validate_redirect_target)
+from .invalidation import deferred_invalidation
+from .changelog import record_changes
+from .chains import collapsing_enabled, resolve, find_loops
+from .paths import normalise_path
+from .routing import rules_written
+
+try:
+    from django.db.transaction import atomic
+except ImportError:  # pragma: no cover ... Django < 1.6
+    from django.db.transaction import commit_on_success as atomic
+
+try:
+    from django.utils.timezone import now, is_naive, make_aware, \
+        get_default_timezone
+except ImportError:  # pragma: no cover ... Django < 1.4
+    from datetime import datetime
+    now = datetime.now
+    is_naive = None
+
+try:
+    from django.utils.dateparse import parse_datetime
+except ImportError:  # pragma: no cover ... Django < 1.4
+    parse_datetime = None
+
+try:
+    from django.contrib.auth import get_user_model
+except ImportError:  # pragma: no cover ... Django < 1.5
+    def get_user_model():
+        from django.contrib.auth.models import User
+        return User
+
+
+Change = namedtuple('Change', 'path kind redirect visible access groups '
+                              'users given')
+# the models replaced by each rule of a Change.
+RULES = (('redirect', URLRedirect), ('visible', URLVisible),
+         ('access', SimpleAccessRestriction),
+         ('groups', GroupAccessRestriction),
+         ('users', UserAccessRestriction))
+KINDS = frozenset(x[0] for x in KIND_CHOICES)
+# comfortably inside the number of parameters any backend allows.
+CHUNK_SIZE = 500
+
+
+class BulkValidationError(ValueError):
+    """
+    `errors` has an entry for every item of the batch, in the same order,
+    which is empty for those without problems.
+    """
+    def __init__(self, errors):
+        self.errors = errors
+        super(BulkValidationError, self).__init__(
+            "{0:d} of {1:d} items are invalid".format(
+                sum(1 for x in errors if x), len(errors)))
+
+
+def chunked(values):
+    values = tuple(values)
+    for start in range(0, len(values), CHUNK_SIZE):
+        yield values[start:start + CHUNK_SIZE]
+
+
+def get_messages(error):
+    return list(getattr(error, 'messages', None) or [str(error)])
+
+
+def clean_datetime(value, field):
+    if value is None:
+        return None
+    parsed = value
+    if not hasattr(value, 'tzinfo'):
+        try:
+            parsed = parse_datetime(value) if parse_datetime else None
+        except (TypeError, ValueError):
+            parsed = None
+    if parsed is None:
+        raise ValidationError("{0!s} isn't a date and time".format(field))
+    if getattr(settings, 'USE_TZ', False) and is_naive and is_naive(parsed):
+        parsed = make_aware(parsed, get_default_timezone())
+    return parsed
+
+
+def clean_flag(data, key):
+    value = data.get(key, False)
+    if not isinstance(value, bool):
+        raise ValidationError("{0!s} must be true or false".format(key))
+    return value
+
+
+def clean_ids(value, field):
+    if value is None:
+        return frozenset()
+    if not isinstance(value, (list, tuple)):
+        raise ValidationError("{0!s} must be a list of ids".format(field))
+    try:
+        return frozenset(int(x) for x in value)
+    except (TypeError, ValueError):
+        raise ValidationError("{0!s} must be a list of ids".format(field))
+
+
+def clean_redirect(value):
+    if value is None:
+        return None
+    target = (value.get('target') or '').strip()
+    if not target:
+        raise ValidationError("Invalid target")
+    validate_redirect_target(target)
+    return URLRedirect(target=target,
+                       permanent=clean_flag(value, 'permanent'))
+
+
+def clean_visible(value):
+    if value is None:
+        return None
+    publish_on = clean_datetime(value.get('publish_on'), 'publish_on')
+    return URLVisible(publish_on=publish_on or now(),
+                      unpublish_on=clean_datetime(value.get('unpublish_on'),
+                                                  'unpublish_on'))
+
+
+def clean_access(value):
+    if value is None:
+        return None
+    return SimpleAccessRestriction(
+        is_authenticated=clean_flag(value, 'is_authenticated'),
+        is_staff=clean_flag(value, 'is_staff'),
+        is_superuser=clean_flag(value, 'is_superuser'))
+
+
+CLEANERS = (('redirect', clean_redirect), ('visible', clean_visible),
+            ('access', clean_access),
+            ('groups', lambda x: clean_ids(x, 'groups')),
+            ('users', lambda x: clean_ids(x, 'users')))
+
+
+def clean_item(item, site_id, creating, errors):
+    if not isinstance(item, dict):
+        errors['non_field_errors'] = ["Expected an object"]
+        return None
+    kind = item.get('kind', LITERAL if creating else None)
+    if kind is not None and kind not in KINDS:
+        errors['kind'] = ["{0!s} isn't one of {1!s}".format(
+            kind, ', '.join(sorted(KINDS)))]
+    url = URL(site_id=site_id, path=(item.get('path') or '').strip(),
+              kind=kind or LITERAL)
+    if not url.path:
+        errors['path'] = ["This field is required."]
+    elif kind is not None:
+        # otherwise it's whatever the URL being updated already is.
+        try:
+            url.clean()
+        except ValidationError as e:
+            errors['path'] = get_messages(e)
+    cleaned = {}
+    for field, cleaner in CLEANERS:
+        if field not in item:
+            continue
+        value = item[field]
+        if value is not None and field in ('redirect', 'visible', 'access') \
+                and not isinstance(value, dict):
+            errors[field] = ["Expected an object or null"]
+            continue
+        try:
+            cleaned[field] = cleaner(value)
+        except ValidationError as e:
+            errors[field] = get_messages(e)
+    if errors:
+        return None
+    return Change(path=url.path, kind=kind, redirect=cleaned.get('redirect'),
+                  visible=cleaned.get('visible'),
+                  access=cleaned.get('access'),
+                  groups=cleaned.get('groups', frozenset()),
+                  users=cleaned.get('users', frozenset()),
+                  given=frozenset(cleaned))
+
+
+def find_missing(model, ids):
+    found = set()
+    for chunk in chunked(ids):
+        found.update(model.objects.filter(pk__in=chunk).values_list(
+            'pk', flat=True))
+    return frozenset(ids) - found
+
+
+def get_url_ids(site_id, paths):
+    found = {}
+    for chunk in chunked(paths):
+        found.update(URL.objects.filter(site=site_id, path__in=chunk)
+                     .values_list('path', 'pk'))
+    return found
+
+
+def find_urls(site_id, paths):
+    """
+    Patterns are saved as they were given, and literal URLs under their
+    normalised path, so either may name an existing URL.
+    """
+    candidates = set(paths)
+    candidates.update(normalise_path(x) for x in paths)
+    return get_url_ids(site_id=site_id, paths=candidates)
+
+
+def resolve_path(path, url_ids):
+    if path in url_ids:
+        return path
+    return normalise_path(path)
+
+
+def validate(items, site_id, creating):
+    """
+    The Changes for every item, or a BulkValidationError covering every
+    problem with any of them. A handful of queries, however many items.
+    """
+    items = list(items)
+    errors = [{} for _ in items]
+    changes = [clean_item(item=x, site_id=site_id, creating=creating,
+                          errors=errors[index])
+               for index, x in enumerate(items)]
+    existing = find_urls(site_id=site_id, paths=set(
+        x.path for x in changes if x is not None))
+    changes = [x._replace(path=resolve_path(x.path, existing))
+               if x is not None and x.kind is None else x for x in changes]
+
+    seen = {}
+    for index, change in enumerate(changes):
+        if change is None:
+            continue
+        if change.path in seen:
+            errors[index]['path'] = ["Repeats item {0:d}".format(
+                seen[change.path])]
+        seen.setdefault(change.path, index)
+
+    missing_groups = find_missing(Group, set(
+        y for x in changes if x is not None for y in x.groups))
+    missing_users = find_missing(get_user_model(), set(
+        y for x in changes if x is not None for y in x.users))
+    for index, change in enumerate(changes):
+        if change is None:
+            continue
+        if creating and change.path in existing:
+            errors[index]['path'] = ["Already exists"]
+        elif not creating and change.path not in existing:
+            errors[index]['path'] = ["Doesn't exist"]
+        for field, missing in (('groups', missing_groups),
+                               ('users', missing_users)):
+            unknown = getattr(change, field) & missing
+            if unknown:
+                errors[index][field] = ["Unknown ids: {0!s}".format(
+                    ', '.join(str(x) for x in sorted(unknown)))]
+    if any(errors):
+        raise BulkValidationError(errors=errors)
+    return changes
+
+
+def get_rule_rows(change, url_id):
+    rows = []
+    for field, model in RULES:
+        if field not in change.given:
+            continue
+        value = getattr(change, field)
+        if field == 'groups':
+            rows.extend(GroupAccessRestriction(url_id=url_id, group_id=x)
+                        for x in sorted(value))
+        elif field == 'users':
+            rows.extend(UserAccessRestriction(url_id=url_id, user_id=x)
+                        for x in sorted(value))
+        elif value is not None:
+            value.url_id = url_id
+            rows.append(value)
+    return rows
+
+
+def create_rules(changes, url_ids):
+    by_model = {}
+    for change in changes:
+        for row in get_rule_rows(change=change, url_id=url_ids[change.path]):
+            by_model.setdefault(row.__class__, []).append(row)
+    for model, rows in by_model.items():
+        for chunk in chunked(rows):
+            model.objects.bulk_create(chunk)
+
+
+def check_loops(site_id, paths):
+    """
+    Redirects in the batch may only make a loop between them, so they're
+    checked once all of them are written, raising a BulkValidationError for
+    the items (given by `paths`, in order) whose redirects lead to one.
+    """
+    loops = find_loops(site_id=site_id, paths=paths)
+    if not loops:
+        return None
+    raise BulkValidationError(errors=[
+        {'redirect': ["This redirect would loop: {0!s}".format(
+            ' -> '.join(loops[x]))]} if x in loops else {} for x in paths])
+
+
+def finish(site_id, paths, redirected=()):
+    """
+    The one invalidation for the whole batch. `redirected` are the paths of
+    the items, in order, if any of them were given a redirect.
+    """
+    if redirected:
+        check_loops(site_id=site_id, paths=redirected)
+    paths = set(paths)
+    if collapsing_enabled():
+        paths.update(resolve(site_id=site_id))
+    record_changes(site_id=site_id, paths=paths)
+    rules_written(sender=URL, instance=None)
+
+
+def get_redirected(changes):
+    if not any(x.redirect is not None for x in changes):
+        return ()
+    return tuple(x.path for x in changes)
+
+
+def create(items, site_id):
+    changes = validate(items=items, site_id=site_id, creating=True)
+    paths = tuple(x.path for x in changes)
+    with atomic():
+        with deferred_invalidation():
+            for chunk in chunked(changes):
+                URL.objects.bulk_create(URL(site_id=site_id, path=x.path,
+                                            kind=x.kind) for x in chunk)
+            create_rules(changes=changes,
+                         url_ids=get_url_ids(site_id=site_id, paths=paths))
+        finish(site_id=site_id, paths=paths,
+               redirected=get_redirected(changes=changes))
+    return len(changes)
+
+
+def update(items, site_id):
+    changes = validate(items=items, site_id=site_id, creating=False)
+    paths = tuple(x.path for x in changes)
+    with atomic():
+        with deferred_invalidation():
+            url_ids = get_url_ids(site_id=site_id, paths=paths)
+            current = now()
+            by_kind = {}
+            for change in changes:
+                if change.kind is not None:
+                    by_kind.setdefault(change.kind, []).append(
+                        url_ids[change.path])
+            for kind, ids in by_kind.items():
+                for chunk in chunked(ids):
+                    URL.objects.filter(pk__in=chunk).update(kind=kind)
+            for field, model in RULES:
+                ids = tuple(url_ids[x.path] for x in changes
+                            if field in x.given)
+                for chunk in chunked(ids):
+                    model.objects.filter(url__in=chunk).delete()
+            create_rules(changes=changes, url_ids=url_ids)
+            # replaced rules leave no modification time behind, so each URL
+            # takes it instead, as churlish.invalidation.rule_deleted does.
+            for chunk in chunked(url_ids.values()):
+                URL.objects.filter(pk__in=chunk).update(modified=current)
+        finish(site_id=site_id, paths=paths,
+               redirected=get_redirected(changes=changes))
+    return len(changes)
+
+
+def delete(paths, site_id):
+    # either the paths themselves, or items with a path.
+    paths = [x.get('path') if isinstance(x, dict) else x for x in paths]
+    errors = [{} for _ in paths]
+    found = find_urls(site_id=site_id, paths=set(x for x in paths if x))
+    url_ids = {}
+    for index, path in enumerate(paths):
+        resolved = resolve_path(path, found) if path else None
+        if resolved not in found:
+            errors[index]['path'] = ["Doesn't exist"]
+        else:
+            url_ids[resolved] = found[resolved]
+    if any(errors):
+        raise BulkValidationError(errors=errors)
+    with atomic():
+        with deferred_invalidation():
+            for chunk in chunked(url_ids.values()):
+                URL.objects.filter(pk__in=chunk).delete()
+        finish(site_id=site_id, paths=tuple(url_ids))
+    return len(url_ids)
@@ -0,0 +1,164 @@
+"""
+HTTP caching headers derived from the rules which let a request through,
+so that pages under churlish can be cached by browsers & CDNs, and stop
+being served from them when the rules change.
+
+Enabled by setting CHURLISH_CACHE_HEADERS = True. Successful responses are
+then given:
+
+    - a Last-Modified of the most recent change to any of the URLs (or
+      their rules) which applied, and an ETag of which ones they were;
+    - a Cache-Control max-age of at most CHURLISH_CACHE_MAX_AGE seconds,
+      and never past the next time one of them is published or
+      unpublished;
+    - Cache-Control private and Vary: Cookie, if access to any of them is
+      restricted, or the response varies on Cookie, or the session was
+      used; otherwise public.
+
+Responses setting cookies are only given the validators, as a shared cache
+would hand those cookies to everyone.
+
+Validators the view set itself are combined with these, rather than
+replaced, as are max-ages, and a view which said the response was private
+or uncacheable is left that way.
+"""
+import hashlib
+from calendar import timegm
+from collections import namedtuple
+from django.conf import settings
+from django.utils.cache import (patch_cache_control, patch_vary_headers,
+                                get_max_age)
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+from .snapshot import get_ruleset
+
+try:
+    from django.utils.timezone import now
+except ImportError:
+    from datetime import datetime
+    now = datetime.now
+
+
+CacheState = namedtuple('CacheState', 'last_modified etag max_age '
+                                      'restricted')
+
+UNCACHEABLE = ('private', 'no-cache', 'no-store')
+CACHEABLE_METHODS = ('GET', 'HEAD')
+
+
+def cache_headers_enabled():
+    return getattr(settings, 'CHURLISH_CACHE_HEADERS', False)
+
+
+def get_default_max_age():
+    return getattr(settings, 'CHURLISH_CACHE_MAX_AGE', 300)
+
+
+def to_timestamp(value):
+    # naive datetimes are taken to already be in UTC, as they are when
+    # Django's USE_TZ is off and TIME_ZONE is UTC.
+    return timegm(value.utctimetuple())
+
+
+def is_restricted(rules):
+    access = rules.access
+    if access is not None and (access.is_authenticated or access.is_staff or
+                               access.is_superuser):
+        return True
+    return len(rules.groups) > 0 or len(rules.users) > 0
+
+
+def get_boundaries(rules, current):
+    """
+    When the URL's visibility next changes, if it's going to.
+    """
+    if rules.visible is None:
+        return ()
+    boundaries = (rules.visible.publish_on, rules.visible.unpublish_on)
+    return tuple(x for x in boundaries if x is not None and x > current)
+
+
+def get_cache_state(rulesets, current):
+    last_modified = max(x.modified for x in rulesets)
+    fingerprint = ';'.join('{0!s}:{1!s}'.format(x.pk, x.modified.isoformat())
+                           for x in rulesets)
+    etag = hashlib.md5(fingerprint.encode('utf-8')).hexdigest()
+    max_age = get_default_max_age()
+    boundaries = []
+    for rules in rulesets:
+        boundaries.extend(get_boundaries(rules=rules, current=current))
+    if boundaries:
+        until = min(boundaries) - current
+        seconds = (until.days * 86400) + until.seconds
+        max_age = min(max_age, seconds)
+    return CacheState(last_modified=last_modified, etag=etag,
+                      max_age=max_age,
+                      restricted=any(is_restricted(x) for x in rulesets))
+
+
+def varies_by_user(request, response):
+    """
+    Whether the view (or the session, which may yet add the header) made
+    the response depend on who asked for it.
+    """
+    vary = response.get('Vary', '').lower()
+    if 'cookie' in vary or 'authorization' in vary:
+        return True
+    session = getattr(request, 'session', None)
+    return getattr(session, 'accessed', False)
+
+
+def combine_etag(existing, etag):
+    if not existing:
+        return quote_etag(etag)
+    combined = hashlib.md5('{0!s};{1!s}'.format(existing, etag).encode(
+        'utf-8')).hexdigest()
+    return quote_etag(combined)
+
+
+def combine_last_modified(existing, last_modified):
+    timestamp = to_timestamp(last_modified)
+    if existing:
+        parsed = parse_http_date_safe(existing)
+        if parsed is not None:
+            timestamp = max(timestamp, parsed)
+    return http_date(timestamp)
+
+
+def patch_response(response, state, private=False):
+    response['ETag'] = combine_etag(existing=response.get('ETag'),
+                                    etag=state.etag)
+    response['Last-Modified'] = combine_last_modified(
+        existing=response.get('Last-Modified'),
+        last_modified=state.last_modified)
+    cache_control = response.get('Cache-Control', '').lower()
+    if any(x in cache_control for x in UNCACHEABLE) or response.cookies:
+        return response
+    max_age = state.max_age
+    existing = get_max_age(response)
+    if existing is not None:
+        max_age = min(max_age, existing)
+    if state.restricted or private:
+        patch_cache_control(response, private=True, max_age=max_age)
+        patch_vary_headers(response, ('Cookie',))
+    else:
+        patch_cache_control(response, public=True, max_age=max_age)
+    return response
+
+
+def apply_cache_headers(request, response):
+    """
+    Only responses to requests which passed every rule of at least one URL
+    are changed.
+    """
+    if request.method not in CACHEABLE_METHODS:
+        return response
+    if response.status_code != 200:
+        return response
+    url_data = getattr(request, 'churlish', None)
+    if url_data is None or not url_data.all:
+        return response
+    rulesets = tuple(get_ruleset(x) for x in url_data.all)
+    state = get_cache_state(rulesets=rulesets, current=now())
+    return patch_response(response=response, state=state,
+                          private=varies_by_user(request=request,
+                                                 response=response))
@@ -0,0 +1,288 @@
+"""
+A redirect whose target is another URL with a redirect of its own sends
+the client on several hops; each URLRedirect's `final_target` is where the
+client would end up, so the middleware sends it there in one.
+
+A hop is only skipped if its redirect is certain: it's on the exact path
+(not inherited), and that URL has no publishing window or access
+restriction which might come first. A permanent redirect only skips
+permanent hops, so nothing temporary gets cached.
+
+Final targets are recomputed (unless CHURLISH_COLLAPSE_REDIRECTS is False)
+when something a chain depends on changes: a redirect is added or removed,
+or its target or permanence changes; a publishing window or access
+restriction is added to, or removed from, a URL with a redirect; or a URL
+with a redirect moves. Only the chains which pass through the changed
+path are followed again; the whole site is left to a batch (see
+churlish.bulk) and the ``churlish_audit_redirects`` command.
+
+Redirects leading to a loop are refused when saved through a form (or
+anything else calling `full_clean`), or in a batch (see churlish.bulk),
+and reported by the ``churlish_audit_redirects`` management command.
+"""
+from collections import namedtuple
+from django.conf import settings
+from django.db.models.signals import pre_save, post_save, post_delete
+from .models import (URL, URLRedirect, URLVisible, SimpleAccessRestriction,
+                     GroupAccessRestriction, UserAccessRestriction, LITERAL)
+from .paths import PATH_SEP, normalise_path
+from .invalidation import invalidation_deferred
+from .changelog import record_changes
+
+try:
+    from urllib.parse import urlsplit
+except ImportError:  # pragma: no cover ... Python 2.
+    from urlparse import urlsplit
+
+
+Hop = namedtuple('Hop', 'pk path target permanent final_target conditional')
+Chain = namedtuple('Chain', 'path target final_target hops loop')
+
+# whose presence makes a hop conditional.
+CONDITIONS = (URLVisible, SimpleAccessRestriction, GroupAccessRestriction,
+              UserAccessRestriction)
+# what the chains depend on of each URL and URLRedirect.
+CHAIN_FIELDS = {URL: ('site_id', 'path', 'kind'),
+                URLRedirect: ('target', 'permanent')}
+
+
+def collapsing_enabled():
+    return getattr(settings, 'CHURLISH_COLLAPSE_REDIRECTS', True)
+
+
+def get_local_path(target):
+    """
+    The normalised path a target leads to on the same site, if it does.
+    """
+    if not target.startswith(PATH_SEP) or target.startswith('//'):
+        return None
+    path = urlsplit(target).path
+    if not path:
+        return None
+    return normalise_path(path)
+
+
+def get_hops(site_id, paths=None):
+    """
+    Every redirect on an exact path of the site, or only those on `paths`,
+    by path.
+    """
+    conditional = set()
+    for model in CONDITIONS:
+        found = model.objects.filter(url__site=site_id)
+        if paths is not None:
+            found = found.filter(url__path__in=paths)
+        conditional.update(found.values_list('url_id', flat=True))
+    rows = URLRedirect.objects.filter(url__site=site_id, url__kind=LITERAL)
+    if paths is not None:
+        rows = rows.filter(url__path__in=paths)
+    rows = rows.values_list('pk', 'url_id', 'url__path', 'target',
+                            'permanent', 'final_target')
+    return dict((path, Hop(pk=pk, path=path, target=target,
+                           permanent=permanent, final_target=final_target,
+                           conditional=url_id in conditional))
+                for pk, url_id, path, target, permanent, final_target
+                in rows.iterator())
+
+
+def follow(path, target, permanent, hops, certain=True):
+    """
+    Follows the redirect from `path` to `target` through `hops`. With
+    `certain` False, every redirect is followed, as when looking for loops.
+    """
+    visited = [path]
+    current = target
+    while True:
+        next_path = get_local_path(current)
+        if next_path is None:
+            break
+        if next_path in visited:
+            # the hops end with the path visited again.
+            return Chain(path=path, target=target, final_target=None,
+                         hops=tuple(visited[1:]) + (next_path,), loop=True)
+        hop = hops.get(next_path)
+        if hop is None:
+            break
+        if certain and (hop.conditional or (permanent and
+                                            not hop.permanent)):
+            break
+        visited.append(next_path)
+        current = hop.target
+    final_target = current if current != target else None
+    return Chain(path=path, target=target, final_target=final_target,
+                 hops=tuple(visited[1:]), loop=False)
+
+
+def find_loop(site_id, path, target):
+    """
+    The paths of the loop a redirect from `path` to `target` would make,
+    or None.
+    """
+    hops = get_hops(site_id=site_id)
+    hops.pop(path, None)
+    chain = follow(path=path, target=target, permanent=False, hops=hops,
+                   certain=False)
+    if not chain.loop:
+        return None
+    return (path,) + chain.hops
+
+
+def find_loops(site_id, paths):
+    """
+    The loop each redirect from one of `paths` leads to, by path.
+    """
+    hops = get_hops(site_id=site_id)
+    loops = {}
+    for path in paths:
+        hop = hops.get(path)
+        if hop is None:
+            continue
+        chain = follow(path=path, target=hop.target, permanent=False,
+                       hops=hops, certain=False)
+        if chain.loop:
+            loops[path] = (path,) + chain.hops
+    return loops
+
+
+def get_passing_through(site_id, paths):
+    """
+    The paths of the redirects whose chains may pass through any of
+    `paths`, and of those the chains may go on through, from only the path
+    & target of each redirect on the site.
+    """
+    rows = URLRedirect.objects.filter(
+        url__site=site_id, url__kind=LITERAL).values_list('url__path',
+                                                          'target')
+    leads_to = dict((path, get_local_path(target))
+                    for path, target in rows.iterator())
+    led_from = {}
+    for path, next_path in leads_to.items():
+        led_from.setdefault(next_path, set()).add(path)
+    passing = set(x for x in paths if x in leads_to)
+    pending = list(paths)
+    while pending:
+        for path in led_from.get(pending.pop(), ()):
+            if path not in passing:
+                passing.add(path)
+                pending.append(path)
+    pending = list(passing)
+    while pending:
+        next_path = leads_to[pending.pop()]
+        if next_path in leads_to and next_path not in passing:
+            passing.add(next_path)
+            pending.append(next_path)
+    return passing
+
+
+def get_chains(site_id, hops=None):
+    if hops is None:
+        hops = get_hops(site_id=site_id)
+    return tuple(follow(path=x.path, target=x.target, permanent=x.permanent,
+                        hops=hops) for x in sorted(hops.values()))
+
+
+def resolve(site_id, paths=None):
+    """
+    Stores the final target of every redirect on the site, or only of those
+    whose chains pass through one of `paths`, returning the paths of those
+    which changed.
+    """
+    if paths is not None:
+        paths = get_passing_through(site_id=site_id, paths=paths)
+        if not paths:
+            return ()
+    hops = get_hops(site_id=site_id, paths=paths)
+    by_target = {}
+    for chain in get_chains(site_id=site_id, hops=hops):
+        if hops[chain.path].final_target != chain.final_target:
+            by_target.setdefault(chain.final_target, []).append(chain.path)
+    for final_target, paths in by_target.items():
+        pks = [hops[x].pk for x in paths]
+        URLRedirect.objects.filter(pk__in=pks).update(
+            final_target=final_target)
+    return tuple(path for paths in by_target.values() for path in paths)
+
+
+def get_changed_paths(instance):
+    """
+    The site & path of each URL whose chains a change to `instance` affects;
+    for a URL which moved, both where it was and where it is.
+    """
+    if isinstance(instance, URL):
+        changed = [(instance.site_id, instance.path)]
+        previous = getattr(instance, '_churlish_chains_previous', None)
+        if previous is not None:
+            site_id, path, kind = previous
+            changed.append((site_id, path))
+        return changed
+    return tuple(URL.objects.filter(pk=instance.url_id).values_list(
+        'site_id', 'path'))
+
+
+def get_current(instance):
+    return tuple(getattr(instance, x)
+                 for x in CHAIN_FIELDS[instance.__class__])
+
+
+def chains_saving(sender, instance, **kwargs):
+    if not collapsing_enabled() or invalidation_deferred():
+        return None
+    previous = None
+    if instance.pk is not None:
+        found = tuple(sender.objects.filter(pk=instance.pk).values_list(
+            *CHAIN_FIELDS[sender])[:1])
+        previous = found[0] if found else None
+    instance._churlish_chains_previous = previous
+    return None
+
+
+def affects_chains(instance, created=False, deleted=False):
+    if isinstance(instance, URLRedirect):
+        previous = getattr(instance, '_churlish_chains_previous', None)
+        return (created or deleted or
+                previous != get_current(instance=instance))
+    if isinstance(instance, URL):
+        # deleting one deletes its redirect, which is a change itself.
+        previous = getattr(instance, '_churlish_chains_previous', None)
+        if deleted or created or previous == get_current(instance):
+            return False
+        return URLRedirect.objects.filter(url=instance.pk).exists()
+    # only whether there's any condition matters, not what it is.
+    if not (created or deleted):
+        return False
+    return URLRedirect.objects.filter(url=instance.url_id).exists()
+
+
+def resolve_for(instance):
+    by_site = {}
+    for site_id, path in get_changed_paths(instance=instance):
+        by_site.setdefault(site_id, set()).add(path)
+    for site_id, paths in by_site.items():
+        record_changes(site_id=site_id,
+                       paths=resolve(site_id=site_id, paths=paths))
+    return None
+
+
+def chains_saved(sender, instance, created=False, **kwargs):
+    if not collapsing_enabled() or invalidation_deferred():
+        return None
+    if affects_chains(instance=instance, created=created):
+        resolve_for(instance=instance)
+    return None
+
+
+def chains_deleted(sender, instance, **kwargs):
+    if not collapsing_enabled() or invalidation_deferred():
+        return None
+    if affects_chains(instance=instance, deleted=True):
+        resolve_for(instance=instance)
+    return None
+
+
+for model in (URL, URLRedirect):
+    uid = 'churlish_chains_saving_{0!s}'.format(model._meta.db_table)
+    pre_save.connect(chains_saving, sender=model, dispatch_uid=uid)
+for model in (URL, URLRedirect) + CONDITIONS:
+    uid = 'churlish_chains_changed_{0!s}'.format(model._meta.db_table)
+    post_save.connect(chains_saved, sender=model, dispatch_uid=uid)
+    post_delete.connect(chains_deleted, sender=model, dispatch_uid=uid)
@@ -0,0 +1,227 @@
+"""
+A feed of which paths' rules changed, kept in the database, so that every
+process (on every host) learns of changes without sharing a cache or
+running a message broker.
+
+With CHURLISH_CHANGELOG = True, saving or deleting a URL or any of its
+rules writes a RuleChange row, in the same transaction. Bulk `update()`s
+and `delete()`s don't send signals, so must call `record_changes_for` with
+the queryset (before deleting it), or `record_changes` with the paths.
+
+Each process polls for new rows at most every
+CHURLISH_CHANGELOG_POLL_INTERVAL seconds (default: 1), and snapshots of
+the rules are then brought up to date by rebuilding only the changed
+paths, however many times each was changed since the last poll. Old rows
+can be removed with the ``churlish_prune_changes`` management command.
+"""
+import os
+import threading
+from time import time
+from datetime import timedelta
+from collections import deque
+from django.conf import settings
+from django.db.models.signals import pre_save, post_save, post_delete
+from .models import URL, RuleChange
+from .invalidation import (RULE_MODELS, bump_generation,
+                           invalidation_deferred)
+
+try:
+    from django.utils.timezone import now
+except ImportError:
+    from datetime import datetime
+    now = datetime.now
+
+
+def changelog_enabled():
+    return getattr(settings, 'CHURLISH_CHANGELOG', False)
+
+
+def get_poll_interval():
+    return getattr(settings, 'CHURLISH_CHANGELOG_POLL_INTERVAL', 1)
+
+
+def get_batch_size():
+    return getattr(settings, 'CHURLISH_CHANGELOG_BATCH', 1000)
+
+
+def get_retained():
+    """
+    How many changes each process remembers; a snapshot older than all of
+    them is rebuilt entirely.
+    """
+    return getattr(settings, 'CHURLISH_CHANGELOG_RETAINED', 10000)
+
+
+def get_max_paths():
+    """
+    Beyond this many changed paths, rebuilding everything is cheaper.
+    """
+    return getattr(settings, 'CHURLISH_CHANGELOG_MAX_PATHS', 500)
+
+
+# a transaction may commit after one which started later, so rows with
+# sequences up to this far behind the newest seen are looked for again.
+OVERLAP = 100
+
+
+def record_changes(site_id, paths):
+    paths = frozenset(paths)
+    if not paths:
+        return 0
+    if changelog_enabled():
+        RuleChange.objects.bulk_create(
+            RuleChange(site_id=site_id, path=x) for x in paths)
+    bump_generation(site_id=site_id)
+    # imported here, as churlish.effective needs the snapshot machinery,
+    # which needs this.
+    from .effective import effective_rules_enabled, refresh_paths
+    if effective_rules_enabled():
+        refresh_paths(site_id=site_id, paths=paths)
+    return len(paths)
+
+
+def record_changes_for(queryset):
+    """
+    For a queryset of URLs, or any of the rule models, which is about to
+    be (or has just been) bulk updated, or is about to be bulk deleted.
+    """
+    if queryset.model is URL:
+        rows = queryset.values_list('site_id', 'path')
+    else:
+        rows = queryset.values_list('url__site_id', 'url__path')
+    by_site = {}
+    for site_id, path in rows.iterator():
+        by_site.setdefault(site_id, set()).add(path)
+    return sum(record_changes(site_id=site_id, paths=paths)
+               for site_id, paths in by_site.items())
+
+
+def get_changed_paths(instance):
+    if isinstance(instance, URL):
+        changed = [(instance.site_id, instance.path)]
+        previous = getattr(instance, '_churlish_previous', None)
+        if previous is not None:
+            changed.append(previous)
+        return changed
+    return list(URL.objects.filter(pk=instance.url_id)
+                .values_list('site_id', 'path'))
+
+
+def url_saving(sender, instance, **kwargs):
+    """
+    A URL whose path (or site) changes leaves its old path stale, too.
+    """
+    if not changelog_enabled() or instance.pk is None:
+        return None
+    if invalidation_deferred():
+        return None
+    previous = tuple(URL.objects.filter(pk=instance.pk)
+                     .values_list('site_id', 'path')[:1])
+    instance._churlish_previous = previous[0] if previous else None
+    return None
+
+
+def rule_changed(sender, instance, **kwargs):
+    if not changelog_enabled() or invalidation_deferred():
+        return None
+    RuleChange.objects.bulk_create(
+        RuleChange(site_id=site_id, path=path)
+        for site_id, path in set(get_changed_paths(instance=instance)))
+    return None
+
+
+def prune(days):
+    older = now() - timedelta(days=days)
+    deleted = RuleChange.objects.filter(created__lt=older)
+    count = deleted.count()
+    deleted.delete()
+    return count
+
+
+class ChangeFeed(object):
+    """
+    The changes seen by this process. Its `version` goes up each time new
+    changes are seen, and snapshots are versioned by it, rather than by the
+    rows' sequence, because rows don't necessarily become visible in the
+    order of their sequence.
+    """
+    __slots__ = ('sequence', 'version', 'floor', 'checked', 'changes',
+                 'seen', 'lock')
+
+    def __init__(self):
+        self.sequence = None
+        self.version = 0
+        self.floor = 0
+        self.checked = 0
+        self.changes = deque()
+        self.seen = set()
+        self.lock = threading.Lock()
+
+    def get_version(self):
+        if time() - self.checked < get_poll_interval():
+            return self.version
+        with self.lock:
+            if time() - self.checked >= get_poll_interval():
+                self.poll()
+                self.checked = time()
+        return self.version
+
+    def poll(self):
+        if self.sequence is None:
+            # rows already written when the process started aren't changes
+            # to anything it holds, including those looked for again.
+            recent = tuple(RuleChange.objects.order_by('-pk').values_list(
+                'pk', flat=True)[:OVERLAP])
+            self.sequence = recent[0] if recent else 0
+            self.seen = set(recent)
+            return None
+        rows = tuple(RuleChange.objects.filter(
+            pk__gt=self.sequence - OVERLAP).order_by('pk').values_list(
+            'pk', 'site_id', 'path')[:get_batch_size() + OVERLAP])
+        unseen = tuple(x for x in rows
+                       if x[0] > self.sequence or x[0] not in self.seen)
+        if not unseen:
+            return None
+        self.version += 1
+        retained = get_retained()
+        for pk, site_id, path in unseen:
+            self.seen.add(pk)
+            self.changes.append((self.version, site_id, path))
+        while len(self.changes) > retained:
+            # anything at or before this version may not be remembered.
+            self.floor = self.changes.popleft()[0]
+        self.sequence = max(self.sequence, rows[-1][0])
+        self.seen = set(x for x in self.seen if x > self.sequence - OVERLAP)
+        return None
+
+    def get_changed_paths(self, site_id, since):
+        """
+        The paths on the site changed after the `since` version, or None if
+        that's not known, or there are so many that rebuilding everything
+        would be quicker.
+        """
+        if since < self.floor:
+            return None
+        paths = set(path for version, changed_site_id, path in self.changes
+                    if version > since and changed_site_id == site_id)
+        if len(paths) > get_max_paths():
+            return None
+        return paths
+
+
+feed = ChangeFeed()
+
+
+for model in RULE_MODELS:
+    uid = 'churlish_changelog_{0!s}'.format(model._meta.db_table)
+    post_save.connect(rule_changed, sender=model, dispatch_uid=uid)
+    post_delete.connect(rule_changed, sender=model, dispatch_uid=uid)
+pre_save.connect(url_saving, sender=URL, dispatch_uid='churlish_url_saving')
+
+
+def _reset_lock_after_fork():
+    feed.lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_lock_after_fork)
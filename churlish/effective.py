@@ -0,0 +1,343 @@
+"""
+A row per URL holding every rule which applies to it, inherited or not, so
+that deciding a request needs a single indexed lookup (for the deepest
+URL above the path) however deep the tree is.
+
+Enabled by setting CHURLISH_ENGINE = 'effective', after filling the table
+with the ``churlish_rebuild_effective`` management command. Saving or
+deleting a URL, or any of the rules attached to one, recomputes the rows
+for that URL and everything beneath it, in the same transaction; bulk
+updates must call `churlish.changelog.record_changes` as usual. With more
+than CHURLISH_EFFECTIVE_SYNC_LIMIT (default: 500) URLs beneath it, only
+the URL's own row is recomputed, and the rest are marked stale, to be
+decided from the rules themselves until ``churlish_rebuild_effective
+--stale`` recomputes them.
+
+Each site's rows are recomputed while holding a lock on its Site row, so
+concurrent changes wait for each other rather than writing rows computed
+from older rules, or colliding.
+
+Which partial fails first decides the response, so each row keeps its
+URL's and its ancestors' rules in order, alongside the combined
+restrictions, publishing window and nearest redirect.
+"""
+import json
+import threading
+from django.conf import settings
+from django.contrib.sites.models import Site
+from django.db.models.signals import (pre_save, post_save, pre_delete,
+                                      post_delete)
+from .models import URL, LITERAL, EffectiveRules
+from .paths import PATH_SEP, get_ancestry
+from .snapshot import (RuleSet, Redirect, Visible, Access, EFFECTIVE,
+                       build_rules, get_engine_name)
+from .invalidation import RULE_MODELS, invalidation_deferred
+from .index import to_timestamp, from_timestamp
+from .shadow import get_shadow_engine_name
+
+try:
+    from django.db.transaction import atomic
+except ImportError:  # pragma: no cover ... Django < 1.6
+    from django.db.transaction import commit_on_success as atomic
+
+
+BATCH_SIZE = 500
+# the pks of the URLs this thread is deleting, whose rules are deleted
+# first, and mustn't be recomputed.
+deleting = threading.local()
+
+
+def get_sync_limit():
+    return getattr(settings, 'CHURLISH_EFFECTIVE_SYNC_LIMIT', 500)
+
+
+def effective_rules_enabled():
+    # being shadowed (see churlish.shadow), the rows must be kept current
+    # for the comparison to mean anything.
+    return EFFECTIVE in (get_engine_name(), get_shadow_engine_name())
+
+
+def encode_ruleset(rules):
+    redirect = visible = access = None
+    if rules.redirect is not None:
+        redirect = [rules.redirect.target, rules.redirect.permanent]
+    if rules.visible is not None:
+        unpublish_on = rules.visible.unpublish_on
+        if unpublish_on is not None:
+            unpublish_on = to_timestamp(unpublish_on)
+        visible = [to_timestamp(rules.visible.publish_on), unpublish_on]
+    if rules.access is not None:
+        access = list(rules.access)
+    return [rules.pk, rules.path, to_timestamp(rules.modified), redirect,
+            visible, access, sorted(rules.groups), sorted(rules.users)]
+
+
+def decode_ruleset(data):
+    pk, path, modified, redirect, visible, access, groups, users = data
+    if redirect is not None:
+        redirect = Redirect(*redirect)
+    if visible is not None:
+        publish_on, unpublish_on = visible
+        if unpublish_on is not None:
+            unpublish_on = from_timestamp(unpublish_on)
+        visible = Visible(publish_on=from_timestamp(publish_on),
+                          unpublish_on=unpublish_on)
+    if access is not None:
+        access = Access(*access)
+    return RuleSet(pk=pk, path=path, modified=from_timestamp(modified),
+                   redirect=redirect, visible=visible, access=access,
+                   groups=frozenset(groups), users=frozenset(users))
+
+
+def make_row(site_id, rules, chain):
+    """
+    The EffectiveRules for `rules`, given the RuleSets of it and its
+    ancestors, nearest first.
+    """
+    row = EffectiveRules(url_id=rules.pk, site_id=site_id, path=rules.path,
+                         depth=len(get_ancestry(rules.path)),
+                         modified=max(x.modified for x in chain),
+                         rules=json.dumps([encode_ruleset(x) for x in chain],
+                                          separators=(',', ':')))
+    redirects = tuple(x.redirect for x in chain if x.redirect is not None)
+    if redirects:
+        row.redirect_target = redirects[0].target
+        row.redirect_permanent = redirects[0].permanent
+    # every window must be open for the URL to be, so the combined window
+    # is where they all overlap.
+    windows = tuple(x.visible for x in chain if x.visible is not None)
+    if windows:
+        row.publish_on = max(x.publish_on for x in windows)
+        closing = tuple(x.unpublish_on for x in windows
+                        if x.unpublish_on is not None)
+        row.unpublish_on = min(closing) if closing else None
+    access = tuple(x.access for x in chain if x.access is not None)
+    row.is_authenticated = any(x.is_authenticated for x in access)
+    row.is_staff = any(x.is_staff for x in access)
+    row.is_superuser = any(x.is_superuser for x in access)
+    row.restricted = bool(access) or any(x.groups or x.users for x in chain)
+    return row
+
+
+def get_chain(rules, path):
+    """
+    The RuleSets of `path` and its ancestors, nearest first.
+    """
+    return tuple(rules[x] for x in reversed(get_ancestry(path))
+                 if x in rules)
+
+
+def build_effective(site_id, within):
+    """
+    The EffectiveRules for the URL at `within`, and every URL beneath it.
+    """
+    rules = build_rules(site_id=site_id, within=within)
+    rules.update(build_rules(site_id=site_id, paths=get_ancestry(within)))
+    return [make_row(site_id=site_id, rules=rules[x],
+                     chain=get_chain(rules=rules, path=x))
+            for x in rules if x.startswith(within)]
+
+
+def lock_site(site_id):
+    """
+    Held until the transaction ends, so the rules are read after any other
+    refresh of the site has committed. Databases without row locks (such as
+    SQLite) serialise writes anyway.
+    """
+    return tuple(Site.objects.select_for_update().filter(pk=site_id)
+                 .values_list('pk', flat=True))
+
+
+def refresh(site_id, path):
+    """
+    Recomputes the rows for `path` and everything beneath it, returning how
+    many there now are.
+    """
+    with atomic():
+        lock_site(site_id=site_id)
+        rows = build_effective(site_id=site_id, within=path)
+        EffectiveRules.objects.filter(site=site_id,
+                                      path__startswith=path).delete()
+        for start in range(0, len(rows), BATCH_SIZE):
+            EffectiveRules.objects.bulk_create(rows[start:start + BATCH_SIZE])
+    return len(rows)
+
+
+def update(site_id, path):
+    """
+    As `refresh`, unless there are more than CHURLISH_EFFECTIVE_SYNC_LIMIT
+    rows beneath `path`, in which case only its own row is recomputed, and
+    theirs are marked stale.
+    """
+    with atomic():
+        lock_site(site_id=site_id)
+        beneath = (EffectiveRules.objects
+                   .filter(site=site_id, path__startswith=path)
+                   .exclude(path=path))
+        if beneath.count() <= get_sync_limit():
+            return refresh(site_id=site_id, path=path)
+        rules = build_rules(site_id=site_id, paths=get_ancestry(path))
+        EffectiveRules.objects.filter(site=site_id, path=path).delete()
+        if path in rules:
+            make_row(site_id=site_id, rules=rules[path],
+                     chain=get_chain(rules=rules, path=path)).save()
+        beneath.update(stale=True)
+    return 1
+
+
+def outermost(paths):
+    """
+    The paths which aren't beneath any of the others.
+    """
+    done = []
+    for path in sorted(paths, key=len):
+        if not any(path.startswith(x) for x in done):
+            done.append(path)
+    return done
+
+
+def refresh_paths(site_id, paths):
+    """
+    Paths beneath others being updated are skipped, having been done (or
+    marked stale) along with them.
+    """
+    done = outermost(paths)
+    for path in done:
+        update(site_id=site_id, path=path)
+    return len(done)
+
+
+def refresh_stale(site_id):
+    stale = EffectiveRules.objects.filter(site=site_id, stale=True)
+    done = outermost(stale.values_list('path', flat=True))
+    return sum(refresh(site_id=site_id, path=x) for x in done)
+
+
+def rebuild(site_id):
+    return refresh(site_id=site_id, path=PATH_SEP)
+
+
+class EffectiveLookup(object):
+    """
+    Looks like a Snapshot to the SnapshotEngine, but asks the database for
+    each path, remembering the answers for the rest of the request.
+    """
+    __slots__ = ('site_id', 'found')
+
+    def __init__(self, site_id):
+        self.site_id = site_id
+        self.found = {}
+
+    def get_ancestry(self, path):
+        found = self.found.get(path)
+        if found is None:
+            rows = tuple(
+                EffectiveRules.objects
+                .filter(site=self.site_id, path__in=get_ancestry(path))
+                .order_by('-depth').values_list('path', 'rules', 'stale')[:1])
+            found = ()
+            if rows:
+                found_path, rules, stale = rows[0]
+                if stale:
+                    # an ancestor changed since the row was computed.
+                    ancestry = build_rules(site_id=self.site_id,
+                                           paths=get_ancestry(found_path))
+                    found = get_chain(rules=ancestry, path=found_path)
+                else:
+                    found = tuple(decode_ruleset(x)
+                                  for x in json.loads(rules))
+            self.found[path] = found
+        return found
+
+    def get(self, path):
+        ancestry = self.get_ancestry(path)
+        if ancestry and ancestry[0].path == path:
+            return ancestry[0]
+        return None
+
+
+class EffectiveStore(object):
+    """
+    There's nothing to hold between requests, as each one is looked up.
+    """
+    __slots__ = ()
+
+    def peek(self, site_id):
+        return None
+
+    def get(self, site_id):
+        return EffectiveLookup(site_id=site_id)
+
+    def clear(self):
+        return None
+
+
+effective = EffectiveStore()
+
+
+def url_saving(sender, instance, **kwargs):
+    """
+    A URL moving elsewhere leaves what was beneath it needing recomputing.
+    """
+    if not effective_rules_enabled() or instance.pk is None:
+        return None
+    if invalidation_deferred():
+        return None
+    previous = tuple(URL.objects.filter(pk=instance.pk, kind=LITERAL)
+                     .values_list('site_id', 'path')[:1])
+    instance._churlish_effective_previous = previous[0] if previous else None
+    return None
+
+
+def get_deleting():
+    if not hasattr(deleting, 'pks'):
+        deleting.pks = set()
+    return deleting.pks
+
+
+def url_deleting(sender, instance, **kwargs):
+    if effective_rules_enabled():
+        get_deleting().add(instance.pk)
+    return None
+
+
+def url_changed(sender, instance, **kwargs):
+    get_deleting().discard(instance.pk)
+    if not effective_rules_enabled() or invalidation_deferred():
+        return None
+    previous = getattr(instance, '_churlish_effective_previous', None)
+    instance._churlish_effective_previous = None
+    if previous is not None and previous != (instance.site_id,
+                                             instance.path):
+        update(site_id=previous[0], path=previous[1])
+    if not instance.is_pattern():
+        update(site_id=instance.site_id, path=instance.path)
+    return None
+
+
+def rule_changed(sender, instance, **kwargs):
+    if not effective_rules_enabled() or invalidation_deferred():
+        return None
+    if instance.url_id in get_deleting():
+        return None
+    found = URL.objects.filter(pk=instance.url_id, kind=LITERAL).values_list(
+        'site_id', 'path')
+    for site_id, path in found:
+        update(site_id=site_id, path=path)
+    return None
+
+
+pre_save.connect(url_saving, sender=URL,
+                 dispatch_uid='churlish_effective_url_saving')
+post_save.connect(url_changed, sender=URL,
+                  dispatch_uid='churlish_effective_url_changed')
+pre_delete.connect(url_deleting, sender=URL,
+                   dispatch_uid='churlish_effective_url_deleting')
+post_delete.connect(url_changed, sender=URL,
+                    dispatch_uid='churlish_effective_url_changed')
+for model in RULE_MODELS:
+    if model is URL:
+        continue
+    uid = 'churlish_effective_changed_{0!s}'.format(model._meta.db_table)
+    post_save.connect(rule_changed, sender=model, dispatch_uid=uid)
+    post_delete.connect(rule_changed, sender=model, dispatch_uid=uid)
@@ -0,0 +1,188 @@
+"""
+Writes every redirect for a site into a static map for the web server in
+front of Django, so that most redirects never reach a worker at all.
+
+A redirect can only be served statically if it'd be the same for every
+request, forever: that of a literal URL whose partials are in the usual
+order (see churlish.redirects.fast_path_applies), which is published now
+and has no end to being published. Anything else is left to the
+middleware, and may be listed separately, with the reason why.
+
+Files are only replaced if their contents would change, and then
+atomically, so that regenerating them from cron is cheap, and whatever
+reloads the web server can check the modification time.
+"""
+# paths & targets may be non-ASCII, which formatting byte strings with
+# fails on Python 2.
+from __future__ import unicode_literals
+import os
+import hashlib
+import tempfile
+from collections import namedtuple
+from .models import URLRedirect, LITERAL
+from .middleware import RequestURL, RequestTesters
+from .redirects import fast_path_applies
+from .paths import PATH_SEP
+
+try:
+    from django.utils.timezone import now
+except ImportError:
+    from datetime import datetime
+    now = datetime.now
+
+try:
+    text_type = unicode  # noqa ... Python 2.
+except NameError:
+    text_type = str
+
+
+StaticRedirect = namedtuple('StaticRedirect', 'path target status')
+DynamicRedirect = namedtuple('DynamicRedirect', 'path target status reason')
+
+NGINX = 'nginx'
+TSV = 'tsv'
+FORMATS = (NGINX, TSV)
+# would need quoting, or mean something else, in an nginx map.
+UNSAFE = frozenset(' \t\r\n"\';{}$\\#')
+
+
+def is_ascii(value):
+    # nginx compares the bytes of the decoded request path, in whatever
+    # encoding the client used.
+    return all(ord(x) < 128 for x in value)
+
+
+def is_safe(value):
+    return (is_ascii(value) and not (UNSAFE & set(value)) and
+            not value.startswith('~'))
+
+
+def get_reason(kind, path, target, publish_on, unpublish_on, current,
+               exclusions):
+    """
+    Why the redirect can't be served statically, or None if it can.
+    """
+    if kind != LITERAL:
+        return 'pattern'
+    if any(x.search(path) for x in exclusions):
+        return 'excluded'
+    if publish_on is not None and (publish_on > current or
+                                   unpublish_on is not None):
+        return 'scheduled'
+    if not is_safe(path) or not is_safe(target):
+        return 'unsafe characters'
+    return None
+
+
+def collect(site_id):
+    """
+    The (static, dynamic) redirects for the site, each sorted by path.
+    """
+    partial_classes = RequestTesters().get_test_classes()
+    ordered = fast_path_applies(partial_classes=partial_classes)
+    exclusions = RequestURL().get_compiled_exclusions()
+    current = now()
+    rows = URLRedirect.objects.filter(url__site=site_id).values_list(
+        'url__path', 'url__kind', 'target', 'permanent', 'final_target',
+        'url__urlvisible__publish_on', 'url__urlvisible__unpublish_on')
+    static = []
+    dynamic = []
+    for path, kind, target, permanent, final_target, publish_on, \
+            unpublish_on in rows:
+        target = final_target or target
+        status = 301 if permanent else 302
+        reason = 'partial order'
+        if ordered:
+            reason = get_reason(kind=kind, path=path, target=target,
+                                publish_on=publish_on,
+                                unpublish_on=unpublish_on, current=current,
+                                exclusions=exclusions)
+        if reason is None:
+            static.append(StaticRedirect(path=path, target=target,
+                                         status=status))
+        else:
+            dynamic.append(DynamicRedirect(path=path, target=target,
+                                           status=status, reason=reason))
+    return sorted(static), sorted(dynamic)
+
+
+def get_spellings(path):
+    """
+    The web server sees the path as requested, so the spelling without a
+    trailing separator is mapped too; any other spelling reaches Django.
+    """
+    if path == PATH_SEP:
+        return (path,)
+    return (path, path.rstrip(PATH_SEP))
+
+
+def format_nginx(redirects, site_id):
+    lines = ['# churlish redirects for site {0!s}; generated by '
+             'churlish_export_redirects, so do not edit.'.format(site_id),
+             'map $uri $churlish_redirect {', '    default "";']
+    for redirect in redirects:
+        lines.extend('    "{0!s}" "{1!s}";'.format(x, redirect.target)
+                     for x in get_spellings(redirect.path))
+    lines.extend(['}', 'map $uri $churlish_redirect_status {',
+                  '    default 0;'])
+    for redirect in redirects:
+        lines.extend('    "{0!s}" {1:d};'.format(x, redirect.status)
+                     for x in get_spellings(redirect.path))
+    lines.append('}')
+    return '\n'.join(lines) + '\n'
+
+
+def format_tsv(redirects):
+    return ''.join('\t'.join(text_type(x) for x in redirect) + '\n'
+                   for redirect in redirects)
+
+
+def get_checksum(content):
+    return hashlib.sha1(content).hexdigest()
+
+
+def write_if_changed(path, content):
+    """
+    Whether the file at `path` was replaced; it's left alone if it already
+    has exactly this content.
+    """
+    content = content.encode('utf-8')
+    try:
+        with open(path, 'rb') as f:
+            if get_checksum(f.read()) == get_checksum(content):
+                return False
+    except (IOError, OSError):
+        pass
+    directory = os.path.dirname(os.path.abspath(path))
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    handle, temporary = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(handle, 'wb') as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(temporary, 0o644)
+        os.rename(temporary, path)
+    except Exception:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+    return True
+
+
+def export(site_id, path, output_format=NGINX, dynamic_path=None):
+    """
+    Returns the static & dynamic redirects, and whether each file changed.
+    """
+    static, dynamic = collect(site_id=site_id)
+    if output_format == NGINX:
+        content = format_nginx(static, site_id=site_id)
+    else:
+        content = format_tsv(static)
+    changed = write_if_changed(path=path, content=content)
+    dynamic_changed = False
+    if dynamic_path is not None:
+        dynamic_changed = write_if_changed(path=dynamic_path,
+                                           content=format_tsv(dynamic))
+    return static, dynamic, changed, dynamic_changed
@@ -0,0 +1,343 @@
+"""
+A compact binary file holding every URL and rule for a site, which each
+process reads through ``mmap``, so that however many workers a host runs,
+there's only ever one copy of the rules in memory.
+
+Enabled by setting CHURLISH_ENGINE = 'index', after building the files
+into CHURLISH_INDEX_DIR with the ``churlish_build_index`` management
+command. Publishing a new file is an atomic rename over the old one, and
+each process notices (and maps the new file) within
+CHURLISH_SNAPSHOT_CHECK_INTERVAL seconds.
+
+The layout, all little-endian, is:
+
+    header:   magic, format version, site id, sequence, count, records offset
+    entries:  `count` of (path hash, record offset), sorted by hash
+    records:  pk, modified, flags, publish_on, unpublish_on, the lengths
+              of the path & redirect target, the number of groups & users,
+              then the path, target, group ids & user ids themselves.
+
+Datetimes are stored as seconds since the epoch, in UTC.
+"""
+import os
+import mmap
+import struct
+import hashlib
+import logging
+import tempfile
+import threading
+from time import time
+from calendar import timegm
+from datetime import datetime
+from django.conf import settings
+from .snapshot import (RuleSet, Redirect, Visible, Access, build_rules,
+                       get_check_interval, get_ancestry_from, snapshots)
+from .metrics import get_metrics
+
+try:
+    from django.utils.timezone import utc, is_aware
+except ImportError:  # pragma: no cover ... Django < 1.4
+    utc = None
+
+    def is_aware(value):
+        return False
+
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'CHRL'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<4sHHIQII')
+ENTRY = struct.Struct('<QI')
+RECORD = struct.Struct('<QdBddHHHH')
+ID = struct.Struct('<Q')
+
+HAS_REDIRECT = 1
+HAS_VISIBLE = 2
+HAS_UNPUBLISH = 4
+HAS_ACCESS = 8
+IS_AUTHENTICATED = 16
+IS_STAFF = 32
+IS_SUPERUSER = 64
+IS_PERMANENT = 128
+
+
+class IndexFormatError(ValueError):
+    pass
+
+
+def get_index_dir():
+    default = os.path.join(tempfile.gettempdir(), 'churlish-index')
+    return getattr(settings, 'CHURLISH_INDEX_DIR', default)
+
+
+def get_index_path(site_id, directory=None):
+    if directory is None:
+        directory = get_index_dir()
+    return os.path.join(directory, 'site-{0!s}.idx'.format(site_id))
+
+
+def hash_path(path):
+    digest = hashlib.md5(path.encode('utf-8')).digest()
+    return ID.unpack(digest[:8])[0]
+
+
+def to_timestamp(value):
+    if value is None:
+        return 0.0
+    if is_aware(value):
+        value = value.astimezone(utc)
+    return timegm(value.timetuple()) + (value.microsecond / 1000000.0)
+
+
+def from_timestamp(value):
+    converted = datetime.utcfromtimestamp(value)
+    if getattr(settings, 'USE_TZ', False) and utc is not None:
+        return converted.replace(tzinfo=utc)
+    return converted
+
+
+def encode_record(rules):
+    flags = 0
+    publish_on = unpublish_on = 0.0
+    target = b''
+    if rules.redirect is not None:
+        flags |= HAS_REDIRECT
+        if rules.redirect.permanent:
+            flags |= IS_PERMANENT
+        target = rules.redirect.target.encode('utf-8')
+    if rules.visible is not None:
+        flags |= HAS_VISIBLE
+        publish_on = to_timestamp(rules.visible.publish_on)
+        if rules.visible.unpublish_on is not None:
+            flags |= HAS_UNPUBLISH
+            unpublish_on = to_timestamp(rules.visible.unpublish_on)
+    if rules.access is not None:
+        flags |= HAS_ACCESS
+        if rules.access.is_authenticated:
+            flags |= IS_AUTHENTICATED
+        if rules.access.is_staff:
+            flags |= IS_STAFF
+        if rules.access.is_superuser:
+            flags |= IS_SUPERUSER
+    path = rules.path.encode('utf-8')
+    groups = sorted(rules.groups)
+    users = sorted(rules.users)
+    parts = [RECORD.pack(rules.pk, to_timestamp(rules.modified), flags,
+                         publish_on, unpublish_on, len(path), len(target),
+                         len(groups), len(users)), path, target]
+    parts.extend(ID.pack(x) for x in groups)
+    parts.extend(ID.pack(x) for x in users)
+    return b''.join(parts)
+
+
+def write_index(site_id, directory=None):
+    """
+    Writes the index for the site beside the current one, then renames it
+    over the top, so readers only ever see a complete file.
+    """
+    path = get_index_path(site_id=site_id, directory=directory)
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    rules = build_rules(site_id=site_id)
+    sequence = int(time() * 1000000)
+    count = len(rules)
+    records_offset = HEADER.size + (ENTRY.size * count)
+    entries = []
+    records = []
+    offset = records_offset
+    for key in sorted(rules):
+        record = encode_record(rules[key])
+        entries.append((hash_path(key), offset))
+        records.append(record)
+        offset += len(record)
+    entries.sort()
+
+    handle, temporary = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(handle, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, FORMAT_VERSION, 0, site_id, sequence,
+                                count, records_offset))
+            for path_hash, record_offset in entries:
+                f.write(ENTRY.pack(path_hash, record_offset))
+            for record in records:
+                f.write(record)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(temporary, path)
+    except Exception:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+    return path, count
+
+
+class MappedIndex(object):
+    """
+    Looks like a Snapshot to the SnapshotEngine, but decodes each record
+    from the mapped file as it's asked for.
+    """
+    __slots__ = ('site_id', 'generation', 'buffer', 'count', 'stat',
+                 'checked')
+
+    def __init__(self, site_id, path):
+        with open(path, 'rb') as f:
+            self.stat = os.fstat(f.fileno())
+            # the mapping outlives the file being closed, and being renamed
+            # over, so a newer file never pulls the rug from under this one.
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, file_site_id, sequence, count, _ = \
+            HEADER.unpack_from(self.buffer, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise IndexFormatError("{0!s} isn't a churlish index of format "
+                                   "{1:d}".format(path, FORMAT_VERSION))
+        if file_site_id != site_id:
+            raise IndexFormatError("{0!s} is for site {1:d}, not "
+                                   "{2!s}".format(path, file_site_id, site_id))
+        self.site_id = site_id
+        self.generation = sequence
+        self.count = count
+        self.checked = time()
+
+    def _find(self, path_hash):
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            found = ENTRY.unpack_from(self.buffer,
+                                      HEADER.size + (middle * ENTRY.size))[0]
+            if found < path_hash:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def get(self, path):
+        encoded = path.encode('utf-8')
+        path_hash = hash_path(path)
+        position = self._find(path_hash)
+        # there may (very rarely) be more than one path with the same hash.
+        while position < self.count:
+            found, offset = ENTRY.unpack_from(
+                self.buffer, HEADER.size + (position * ENTRY.size))
+            if found != path_hash:
+                return None
+            start = offset + RECORD.size
+            path_length = RECORD.unpack_from(self.buffer, offset)[5]
+            if self.buffer[start:start + path_length] == encoded:
+                return self.decode(offset)
+            position += 1
+        return None
+
+    def decode(self, offset):
+        (pk, modified, flags, publish_on, unpublish_on, path_length,
+         target_length, group_count, user_count) = RECORD.unpack_from(
+            self.buffer, offset)
+        position = offset + RECORD.size
+        path = self.buffer[position:position + path_length].decode('utf-8')
+        position += path_length
+        redirect = None
+        if flags & HAS_REDIRECT:
+            target = self.buffer[position:position + target_length]
+            redirect = Redirect(target=target.decode('utf-8'),
+                                permanent=bool(flags & IS_PERMANENT))
+        position += target_length
+        groups = frozenset(ID.unpack_from(self.buffer,
+                                          position + (x * ID.size))[0]
+                           for x in range(group_count))
+        position += group_count * ID.size
+        users = frozenset(ID.unpack_from(self.buffer,
+                                         position + (x * ID.size))[0]
+                          for x in range(user_count))
+        visible = None
+        if flags & HAS_VISIBLE:
+            unpublished = None
+            if flags & HAS_UNPUBLISH:
+                unpublished = from_timestamp(unpublish_on)
+            visible = Visible(publish_on=from_timestamp(publish_on),
+                              unpublish_on=unpublished)
+        access = None
+        if flags & HAS_ACCESS:
+            access = Access(is_authenticated=bool(flags & IS_AUTHENTICATED),
+                            is_staff=bool(flags & IS_STAFF),
+                            is_superuser=bool(flags & IS_SUPERUSER))
+        return RuleSet(pk=pk, path=path, modified=from_timestamp(modified),
+                       redirect=redirect, visible=visible, access=access,
+                       groups=groups, users=users)
+
+    def get_ancestry(self, path):
+        return get_ancestry_from(lookup=self.get, path=path)
+
+    def __len__(self):
+        return self.count
+
+
+class IndexStore(object):
+    """
+    Holds the MappedIndex for each site in this process, swapping to a new
+    one when the file is replaced.
+
+    A missing file is only looked for again every check interval, and only
+    logged the first time it's found missing.
+    """
+    __slots__ = ('indexes', 'missing', 'lock')
+
+    def __init__(self):
+        self.indexes = {}
+        # when each site's file was last found missing.
+        self.missing = {}
+        self.lock = threading.Lock()
+
+    def peek(self, site_id):
+        index = self.indexes.get(site_id)
+        if index is None:
+            return None
+        if time() - index.checked >= get_check_interval():
+            return None
+        get_metrics().cache_hit('index')
+        return index
+
+    def get(self, site_id):
+        index = self.peek(site_id=site_id)
+        if index is not None:
+            return index
+        missing = self.missing.get(site_id)
+        if missing is not None and time() - missing < get_check_interval():
+            return snapshots.get(site_id=site_id)
+        path = get_index_path(site_id=site_id)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            if missing is None:
+                logger.error("No churlish index at {0!s}, so using a "
+                             "snapshot instead".format(path))
+            self.missing[site_id] = time()
+            return snapshots.get(site_id=site_id)
+        self.missing.pop(site_id, None)
+        index = self.indexes.get(site_id)
+        if index is not None and (index.stat.st_ino, index.stat.st_mtime) \
+                == (stat.st_ino, stat.st_mtime):
+            index.checked = time()
+            get_metrics().cache_hit('index')
+            return index
+        get_metrics().cache_miss('index')
+        with self.lock:
+            index = MappedIndex(site_id=site_id, path=path)
+            self.indexes[site_id] = index
+        return index
+
+    def clear(self):
+        with self.lock:
+            self.indexes = {}
+            self.missing = {}
+
+
+indexes = IndexStore()
+
+
+def _reset_lock_after_fork():
+    indexes.lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_lock_after_fork)
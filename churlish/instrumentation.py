@@ -0,0 +1,133 @@
+"""
+Optional timing of each phase of the middleware, and of each partial,
+enabled by setting CHURLISH_INSTRUMENTATION = True.
+
+When disabled, the middleware is given the NULL_INSTRUMENT, whose phases
+do nothing at all.
+"""
+from collections import namedtuple
+from timeit import default_timer
+from django.conf import settings
+from .querycount import QueryCounter
+
+
+Timing = namedtuple('Timing', 'name duration queries calls')
+
+
+class NullPhase(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return None
+
+
+class NullInstrument(object):
+    __slots__ = ()
+    _phase = NullPhase()
+
+    def phase(self, name):
+        return self._phase
+
+    def timings(self):
+        return ()
+
+    def __bool__(self):
+        return False
+    __nonzero__ = __bool__
+
+
+NULL_INSTRUMENT = NullInstrument()
+
+
+class Phase(object):
+    __slots__ = ('instrument', 'name', 'counter', 'started')
+
+    def __init__(self, instrument, name):
+        self.instrument = instrument
+        self.name = name
+        self.counter = QueryCounter()
+
+    def __enter__(self):
+        self.counter.__enter__()
+        self.started = default_timer()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        duration = default_timer() - self.started
+        self.counter.__exit__(exc_type, exc_value, traceback)
+        self.instrument.record(name=self.name, duration=duration,
+                               queries=self.counter.count)
+        return None
+
+
+class Instrument(object):
+    """
+    Accumulates the wall time (in seconds) and queries for each named
+    phase, so that a partial which runs against every ancestor is reported
+    once, with the number of times it was called.
+    """
+    __slots__ = ('order', 'totals')
+
+    def __init__(self):
+        self.order = []
+        self.totals = {}
+
+    def phase(self, name):
+        return Phase(instrument=self, name=name)
+
+    def record(self, name, duration, queries):
+        if name not in self.totals:
+            self.order.append(name)
+            self.totals[name] = [0.0, 0, 0]
+        total = self.totals[name]
+        total[0] += duration
+        total[1] += queries
+        total[2] += 1
+
+    def timings(self):
+        return tuple(Timing(name=name, duration=self.totals[name][0],
+                            queries=self.totals[name][1],
+                            calls=self.totals[name][2])
+                     for name in self.order)
+
+    def __bool__(self):
+        return True
+    __nonzero__ = __bool__
+
+
+def instrumentation_enabled():
+    return getattr(settings, 'CHURLISH_INSTRUMENTATION', False)
+
+
+def server_timing_enabled():
+    return getattr(settings, 'CHURLISH_SERVER_TIMING', False)
+
+
+def get_instrument(request):
+    """
+    Gets (or creates) the Instrument for this request, or the
+    NULL_INSTRUMENT if instrumentation isn't turned on.
+    """
+    if not instrumentation_enabled():
+        return NULL_INSTRUMENT
+    try:
+        return request._churlish_instrument
+    except AttributeError:
+        instrument = Instrument()
+        request._churlish_instrument = instrument
+        return instrument
+
+
+def format_server_timing(timings):
+    """
+    https://www.w3.org/TR/server-timing/ ... durations are milliseconds.
+    """
+    metrics = ('churlish-{name!s};dur={duration:.3f};'
+               'desc="{calls:d} calls, {queries:d} queries"'.format(
+                   name=timing.name, duration=timing.duration * 1000.0,
+                   calls=timing.calls, queries=timing.queries)
+               for timing in timings)
+    return ', '.join(metrics)
@@ -0,0 +1,171 @@
+"""
+Every process holding a copy of the rules needs to know when they've
+changed. Saving or deleting a URL, or any of the rules attached to one,
+replaces the generation for that URL's site in the default cache, and a
+copy built against a different generation is stale.
+
+The cache must be shared between processes (eg: memcached) for changes
+made in one to be seen by the others.
+
+Within `deferred_invalidation()`, the signal handlers here (and those
+keeping other copies of the rules up to date) do nothing, leaving the
+writer to call `churlish.changelog.record_changes` once it's done.
+"""
+import threading
+from uuid import uuid4
+from contextlib import contextmanager
+from django.core.cache import cache
+from django.db.models.signals import (post_save, post_delete, pre_delete,
+                                      m2m_changed)
+from django.contrib.sites.models import Site
+from django.contrib.auth.models import Group
+from .models import (URL, URLRedirect, URLVisible, SimpleAccessRestriction,
+                     GroupAccessRestriction, UserAccessRestriction)
+
+try:
+    from django.utils.timezone import now
+except ImportError:
+    from datetime import datetime
+    now = datetime.now
+
+try:
+    from django.contrib.auth import get_user_model
+except ImportError:  # pragma: no cover ... Django < 1.5
+    def get_user_model():
+        from django.contrib.auth.models import User
+        return User
+
+
+RULE_MODELS = (URL, URLRedirect, URLVisible, SimpleAccessRestriction,
+               GroupAccessRestriction, UserAccessRestriction)
+deferred = threading.local()
+# the generation of the map of hosts to sites, rather than of a site.
+HOSTS = 'hosts'
+
+
+def get_generation_key(site_id):
+    return 'churlish:generation:{site_id!s}'.format(site_id=site_id)
+
+
+def get_generation(site_id):
+    key = get_generation_key(site_id=site_id)
+    generation = cache.get(key)
+    if generation is None:
+        # never set, or evicted; either way, anything built before now
+        # can't be trusted.
+        cache.add(key, uuid4().hex, None)
+        generation = cache.get(key)
+    return generation
+
+
+def bump_generation(site_id):
+    generation = uuid4().hex
+    cache.set(get_generation_key(site_id=site_id), generation, None)
+    return generation
+
+
+def get_user_generation_key(user_id):
+    return 'churlish:user-generation:{user_id!s}'.format(user_id=user_id)
+
+
+def bump_user_generations(user_ids):
+    generation = uuid4().hex
+    cache.set_many(dict((get_user_generation_key(user_id=x), generation)
+                        for x in user_ids), None)
+    return generation
+
+
+def invalidation_deferred():
+    return getattr(deferred, 'depth', 0) > 0
+
+
+@contextmanager
+def deferred_invalidation():
+    deferred.depth = getattr(deferred, 'depth', 0) + 1
+    try:
+        yield
+    finally:
+        deferred.depth -= 1
+
+
+def get_site_ids(instance):
+    if isinstance(instance, URL):
+        return (instance.site_id,)
+    return tuple(URL.objects.filter(pk=instance.url_id)
+                 .values_list('site_id', flat=True))
+
+
+def rules_changed(sender, instance, **kwargs):
+    if invalidation_deferred():
+        return None
+    for site_id in get_site_ids(instance=instance):
+        bump_generation(site_id=site_id)
+
+
+def sites_changed(sender, instance, **kwargs):
+    bump_generation(site_id=HOSTS)
+
+
+def user_groups_changed(sender, instance, action, reverse, pk_set,
+                        **kwargs):
+    """
+    Anything cached about what a user may access depends on their groups.
+    """
+    if sender is not get_user_model().groups.through:
+        return None
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            bump_user_generations(user_ids=(instance.pk,))
+        return None
+    # the users of a group being cleared are only known beforehand.
+    if action == 'pre_clear':
+        instance._churlish_user_ids = tuple(
+            instance.user_set.values_list('pk', flat=True))
+    elif action == 'post_clear':
+        bump_user_generations(
+            user_ids=getattr(instance, '_churlish_user_ids', ()))
+    elif action in ('post_add', 'post_remove'):
+        bump_user_generations(user_ids=pk_set or ())
+    return None
+
+
+def group_deleting(sender, instance, **kwargs):
+    instance._churlish_user_ids = tuple(
+        instance.user_set.values_list('pk', flat=True))
+
+
+def group_deleted(sender, instance, **kwargs):
+    bump_user_generations(user_ids=getattr(instance, '_churlish_user_ids',
+                                           ()))
+
+
+def rule_deleted(sender, instance, **kwargs):
+    """
+    A deleted rule leaves no modification time behind, so the URL it was
+    attached to takes it instead, for anything (eg: HTTP caching headers)
+    relying on the most recent modification changing.
+    """
+    if invalidation_deferred():
+        return None
+    URL.objects.filter(pk=instance.url_id).update(modified=now())
+
+
+for model in RULE_MODELS:
+    uid = 'churlish_rules_changed_{0!s}'.format(model._meta.db_table)
+    post_save.connect(rules_changed, sender=model, dispatch_uid=uid)
+    post_delete.connect(rules_changed, sender=model, dispatch_uid=uid)
+    if model is not URL:
+        post_delete.connect(rule_deleted, sender=model,
+                            dispatch_uid='churlish_rule_deleted_{0!s}'.format(
+                                model._meta.db_table))
+
+post_save.connect(sites_changed, sender=Site,
+                  dispatch_uid='churlish_sites_changed')
+post_delete.connect(sites_changed, sender=Site,
+                    dispatch_uid='churlish_sites_changed')
+m2m_changed.connect(user_groups_changed,
+                    dispatch_uid='churlish_user_groups_changed')
+pre_delete.connect(group_deleting, sender=Group,
+                   dispatch_uid='churlish_group_deleting')
+post_delete.connect(group_deleted, sender=Group,
+                    dispatch_uid='churlish_group_deleted')
@@ -0,0 +1,49 @@
+from optparse import make_option
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.contrib.sites.models import Site
+from churlish.chains import get_hops, get_chains, resolve
+from churlish.changelog import record_changes
+
+
+class Command(BaseCommand):
+    args = '[site id ...]'
+    help = ("Lists the redirects of each site which lead to further "
+            "redirects, or to a loop, and whether their final targets are "
+            "up to date.")
+    option_list = BaseCommand.option_list + (
+        make_option('--all', action='store_true', dest='all', default=False,
+                    help="Audit the redirects of every site."),
+        make_option('--fix', action='store_true', dest='fix', default=False,
+                    help="Store any final targets which are out of date."),
+    )
+
+    def handle(self, *args, **options):
+        if options['all']:
+            site_ids = tuple(Site.objects.values_list('pk', flat=True))
+        else:
+            site_ids = tuple(int(x) for x in args) or (settings.SITE_ID,)
+        for site_id in site_ids:
+            hops = get_hops(site_id=site_id)
+            chains = get_chains(site_id=site_id, hops=hops)
+            loops = 0
+            stale = 0
+            for chain in chains:
+                route = ' -> '.join((chain.path,) + chain.hops)
+                if chain.loop:
+                    loops += 1
+                    self.stdout.write("Loop: {0!s}\n".format(route))
+                elif chain.hops:
+                    self.stdout.write("Chain: {0!s} -> {1!s}\n".format(
+                        route, chain.final_target))
+                if hops[chain.path].final_target != chain.final_target:
+                    stale += 1
+            self.stdout.write("Site {site!s}: {count:d} redirects, {loops:d} "
+                              "loops, {stale:d} out of date\n".format(
+                                  site=site_id, count=len(chains),
+                                  loops=loops, stale=stale))
+            if options['fix'] and stale:
+                changed = resolve(site_id=site_id)
+                record_changes(site_id=site_id, paths=changed)
+                self.stdout.write("Updated {0:d} final targets\n".format(
+                    len(changed)))
@@ -0,0 +1,30 @@
+from optparse import make_option
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.contrib.sites.models import Site
+from churlish.index import write_index, get_index_dir
+
+
+class Command(BaseCommand):
+    args = '[site id ...]'
+    help = ("Compiles the URLs and rules for each site into the binary "
+            "index files read by CHURLISH_ENGINE = 'index'.")
+    option_list = BaseCommand.option_list + (
+        make_option('--all', action='store_true', dest='all', default=False,
+                    help="Build an index for every site."),
+        make_option('--directory', dest='directory', default=None,
+                    help="Write to this directory, rather than "
+                         "CHURLISH_INDEX_DIR."),
+    )
+
+    def handle(self, *args, **options):
+        if options['all']:
+            site_ids = tuple(Site.objects.values_list('pk', flat=True))
+        else:
+            site_ids = tuple(int(x) for x in args) or (settings.SITE_ID,)
+        directory = options['directory'] or get_index_dir()
+        for site_id in site_ids:
+            path, count = write_index(site_id=site_id, directory=directory)
+            self.stdout.write("Wrote {count:d} URLs for site {site!s} to "
+                              "{path!s}\n".format(count=count, site=site_id,
+                                                  path=path))
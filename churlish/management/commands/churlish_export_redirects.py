@@ -0,0 +1,52 @@
+from optparse import make_option
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.sites.models import Site
+from churlish.export import export, FORMATS, NGINX
+
+
+class Command(BaseCommand):
+    args = '[site id ...]'
+    help = ("Writes the redirects of each site which can be served by the "
+            "web server into a static map, leaving the files untouched if "
+            "nothing changed.")
+    option_list = BaseCommand.option_list + (
+        make_option('--all', action='store_true', dest='all', default=False,
+                    help="Export the redirects of every site."),
+        make_option('--format', dest='format', default=NGINX,
+                    help="One of: {0!s}".format(', '.join(FORMATS))),
+        make_option('--output', dest='output', default=None,
+                    help="Where to write the map; {site} is replaced with "
+                         "the site id."),
+        make_option('--dynamic', dest='dynamic', default=None,
+                    help="Where to list, as TSV, the redirects which can't "
+                         "be served statically; {site} is replaced with "
+                         "the site id."),
+    )
+
+    def handle(self, *args, **options):
+        if options['format'] not in FORMATS:
+            raise CommandError("--format must be one of: {0!s}".format(
+                ', '.join(FORMATS)))
+        if not options['output']:
+            raise CommandError("--output is required")
+        if options['all']:
+            site_ids = tuple(Site.objects.values_list('pk', flat=True))
+        else:
+            site_ids = tuple(int(x) for x in args) or (settings.SITE_ID,)
+        if len(site_ids) > 1 and '{site}' not in options['output']:
+            raise CommandError("--output must include {site} when "
+                               "exporting more than one site")
+        for site_id in site_ids:
+            path = options['output'].format(site=site_id)
+            dynamic_path = None
+            if options['dynamic']:
+                dynamic_path = options['dynamic'].format(site=site_id)
+            static, dynamic, changed, _ = export(
+                site_id=site_id, path=path, output_format=options['format'],
+                dynamic_path=dynamic_path)
+            self.stdout.write("{state!s} {path!s}: {static:d} static, "
+                              "{dynamic:d} left to churlish\n".format(
+                                  state='Wrote' if changed else 'Unchanged',
+                                  path=path, static=len(static),
+                                  dynamic=len(dynamic)))
@@ -0,0 +1,56 @@
+import json
+from optparse import make_option
+from django.core.management.base import BaseCommand
+from churlish.metrics import get_published, get_report, request_reset
+
+
+class Command(BaseCommand):
+    help = ("Reports the churlish middleware counters most recently "
+            "published by each process, or asks them all to reset.")
+    option_list = BaseCommand.option_list + (
+        make_option('--reset', action='store_true', dest='reset',
+                    default=False,
+                    help="Reset the counters in every process."),
+        make_option('--json', action='store_true', dest='json',
+                    default=False,
+                    help="Output the report as JSON."),
+    )
+
+    def handle(self, *args, **options):
+        if options['reset']:
+            request_reset()
+            self.stdout.write("Every process will reset its counters the "
+                              "next time it publishes them.\n")
+            return None
+        counters, processes = get_published()
+        report = get_report(counters)
+        report['processes'] = processes
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2, sort_keys=True))
+            self.stdout.write('\n')
+            return None
+
+        self.stdout.write("{count:d} processes, {requests:d} requests\n".format(
+            count=processes, requests=report['requests']))
+        for name, value in sorted(report['decisions'].items()):
+            self.stdout.write("  {name!s}: {value:d}\n".format(name=name,
+                                                               value=value))
+        for name, stats in sorted(report['caches'].items()):
+            ratio = stats['ratio']
+            ratio = 'n/a' if ratio is None else '{0:.1%}'.format(ratio)
+            self.stdout.write("cache {name!s}: {hits:d} hits, {misses:d} "
+                              "misses ({ratio!s})\n".format(
+                                  name=name, hits=stats['hits'],
+                                  misses=stats['misses'], ratio=ratio))
+        for depth, value in sorted(report['depth'].items()):
+            self.stdout.write("depth {depth:d}: {value:d}\n".format(
+                depth=depth, value=value))
+        shadow = report['shadow']
+        if shadow['compared'] or shadow['errors']:
+            self.stdout.write("shadow: {compared:d} compared, {mismatched:d} "
+                              "mismatched, {errors:d} errors\n".format(
+                                  **shadow))
+        if shadow['compared']:
+            self.stdout.write("shadow: {reference_ms:.3f}ms reference, "
+                              "{alternate_ms:.3f}ms alternate ({delta_ms:+.3f}"
+                              "ms)\n".format(**shadow))
@@ -0,0 +1,33 @@
+from optparse import make_option
+from django.core.management.base import BaseCommand
+from churlish.models import URL, LITERAL
+from churlish.paths import normalise_path
+
+
+class Command(BaseCommand):
+    help = ("Re-saves any URL whose path isn't spelled the way requests are "
+            "looked up, eg: URLs created before paths were normalised.")
+    option_list = BaseCommand.option_list + (
+        make_option('--dry-run', action='store_true', dest='dry_run',
+                    default=False, help="Only list what would change"),
+    )
+
+    def handle(self, *args, **options):
+        urls = URL.objects.filter(kind=LITERAL).order_by('pk')
+        taken = set(urls.values_list('site_id', 'path'))
+        changed = 0
+        for url in urls.iterator():
+            path = normalise_path(url.path)
+            if path == url.path:
+                continue
+            if (url.site_id, path) in taken:
+                self.stderr.write("Skipping {0!s} (pk {1!s}), as {2!s} "
+                                  "already exists\n".format(url.path, url.pk,
+                                                            path))
+                continue
+            self.stdout.write("{0!s} -> {1!s}\n".format(url.path, path))
+            taken.add((url.site_id, path))
+            changed += 1
+            if not options['dry_run']:
+                url.save()
+        self.stdout.write("{0:d} paths normalised\n".format(changed))
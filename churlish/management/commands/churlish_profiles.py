@@ -0,0 +1,66 @@
+from optparse import make_option
+from django.core.management.base import BaseCommand, CommandError
+from churlish.profiling import list_captures, load_capture, get_profile_dir
+
+
+class Command(BaseCommand):
+    args = '[capture name]'
+    help = ("Lists the captured slow churlish middleware evaluations, "
+            "summarises them, or shows a single capture in full.")
+    option_list = BaseCommand.option_list + (
+        make_option('--summary', action='store_true', dest='summary',
+                    default=False,
+                    help="Summarise the captures by path."),
+    )
+
+    def handle(self, *args, **options):
+        names = list_captures()
+        if args:
+            if args[0] not in names:
+                raise CommandError("No capture named {0!s} in {1!s}".format(
+                    args[0], get_profile_dir()))
+            return self.show(load_capture(args[0]))
+        captures = tuple(load_capture(name) for name in names)
+        if options['summary']:
+            return self.summarise(captures)
+        for capture in captures:
+            self.stdout.write("{name!s} {method!s} {path!s} {ms:.1f}ms "
+                              "{queries:d} queries ({outcome!s}{slow!s})"
+                              "\n".format(
+                                  name=capture['name'],
+                                  method=capture['method'],
+                                  path=capture['path'],
+                                  ms=capture['duration'] * 1000.0,
+                                  queries=len(capture['queries']),
+                                  outcome=capture['outcome'],
+                                  slow=', slow' if capture['slow'] else ''))
+        return None
+
+    def show(self, capture):
+        self.stdout.write("{method!s} {path!s} took {ms:.1f}ms, outcome "
+                          "{outcome!s}\n\n".format(
+                              method=capture['method'], path=capture['path'],
+                              ms=capture['duration'] * 1000.0,
+                              outcome=capture['outcome']))
+        for query in capture['queries']:
+            self.stdout.write("[{time!s}s] {sql!s}\n".format(**query))
+        self.stdout.write("\n")
+        self.stdout.write(capture['stats'])
+        return None
+
+    def summarise(self, captures):
+        by_path = {}
+        for capture in captures:
+            by_path.setdefault(capture['path'], []).append(capture)
+        ordered = sorted(by_path.items(), key=lambda item: -len(item[1]))
+        for path, found in ordered:
+            durations = sorted(x['duration'] * 1000.0 for x in found)
+            queries = sum(len(x['queries']) for x in found)
+            self.stdout.write("{path!s}: {count:d} captures, median "
+                              "{median:.1f}ms, max {max:.1f}ms, {queries:.1f}"
+                              " queries on average\n".format(
+                                  path=path, count=len(found),
+                                  median=durations[len(durations) // 2],
+                                  max=durations[-1],
+                                  queries=float(queries) / len(found)))
+        return None
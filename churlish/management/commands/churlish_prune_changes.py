@@ -0,0 +1,16 @@
+from optparse import make_option
+from django.core.management.base import BaseCommand
+from churlish.changelog import prune
+
+
+class Command(BaseCommand):
+    help = ("Removes entries from the churlish change log older than the "
+            "given number of days.")
+    option_list = BaseCommand.option_list + (
+        make_option('--days', action='store', dest='days', type='int',
+                    default=7, help="Keep this many days of changes"),
+    )
+
+    def handle(self, *args, **options):
+        count = prune(days=options['days'])
+        self.stdout.write("Removed {0:d} changes\n".format(count))
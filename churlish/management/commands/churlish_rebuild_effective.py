@@ -0,0 +1,31 @@
+from optparse import make_option
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.contrib.sites.models import Site
+from churlish.effective import rebuild, refresh_stale
+
+
+class Command(BaseCommand):
+    args = '[site id ...]'
+    help = ("Recomputes every row of the effective rules read by "
+            "CHURLISH_ENGINE = 'effective'.")
+    option_list = BaseCommand.option_list + (
+        make_option('--all', action='store_true', dest='all', default=False,
+                    help="Rebuild the rules of every site."),
+        make_option('--stale', action='store_true', dest='stale',
+                    default=False,
+                    help="Only recompute the rows marked stale."),
+    )
+
+    def handle(self, *args, **options):
+        if options['all']:
+            site_ids = tuple(Site.objects.values_list('pk', flat=True))
+        else:
+            site_ids = tuple(int(x) for x in args) or (settings.SITE_ID,)
+        for site_id in site_ids:
+            if options['stale']:
+                count = refresh_stale(site_id=site_id)
+            else:
+                count = rebuild(site_id=site_id)
+            self.stdout.write("Rebuilt {count:d} URLs for site "
+                              "{site!s}\n".format(count=count, site=site_id))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from churlish.warmup import warmup
+
+
+class Command(BaseCommand):
+    args = '[site id ...]'
+    help = ("Builds the state the churlish middleware needs, as would "
+            "happen before forking, and reports how long each step took.")
+
+    def handle(self, *args, **options):
+        site_ids = tuple(int(x) for x in args) or None
+        for step in warmup(site_ids=site_ids):
+            self.stdout.write("{name!s}: {ms:.1f}ms ({detail!s})\n".format(
+                name=step.name, ms=step.duration * 1000.0, detail=step.detail))
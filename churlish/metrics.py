@@ -0,0 +1,296 @@
+"""
+Cheap in-process counters for what the middleware decided, how well the
+caches are doing, and how deep the matched ancestry tends to be.
+
+Enabled by setting CHURLISH_METRICS = True. Each thread increments its own
+dictionary, so the hot path never takes a lock; the lock is only taken
+when a thread first counts something, and when the counters are read or
+reset. The counters of threads which have finished are folded into one
+total then, so that servers starting a thread per request don't keep a
+dictionary for each.
+
+Each process periodically publishes its counters to the default cache
+(every CHURLISH_METRICS_PUBLISH_INTERVAL seconds), so that the
+``churlish_metrics`` management command (and churlish.views.metrics) can
+report on, and reset, the counters for every process sharing that cache.
+Each process claims a numbered slot with `cache.add`, rather than every
+process rewriting one shared list, which would lose updates.
+"""
+import os
+import socket
+import weakref
+import threading
+from time import time
+from django.conf import settings
+from django.core.cache import cache
+
+
+DECISIONS = ('excluded', 'no_rules', 'redirected', 'failed', 'responded',
+             'passed')
+CACHE_PREFIX = 'cache.'
+DEPTH_PREFIX = 'depth.'
+# see churlish.shadow, which counts these.
+SHADOW_PREFIX = 'shadow.'
+SHADOW_COUNTERS = ('compared', 'mismatched', 'errors')
+SLOTS_KEY = 'churlish:metrics:slots'
+SLOT_KEY = 'churlish:metrics:slot:{0:d}'
+RESET_KEY = 'churlish:metrics:reset'
+
+
+def add_counters(totals, counters):
+    for name, value in counters.items():
+        totals[name] = totals.get(name, 0) + value
+    return totals
+
+
+class MetricsRegistry(object):
+    __slots__ = ('_lock', '_local', '_shards', '_finished', '_slot',
+                 '_published', '_reset_at')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        # (a weak reference to the thread, its counters)
+        self._shards = []
+        # the counters of threads which have finished.
+        self._finished = {}
+        self._slot = None
+        self._published = 0
+        self._reset_at = time()
+
+    @property
+    def key(self):
+        # not computed up front, because the registry may be imported
+        # before the server forks its workers.
+        return 'churlish:metrics:{host!s}:{pid:d}'.format(
+            host=socket.gethostname(), pid=os.getpid())
+
+    def _shard(self):
+        try:
+            return self._local.counters
+        except AttributeError:
+            counters = {}
+            thread = weakref.ref(threading.current_thread())
+            with self._lock:
+                self._fold()
+                self._shards.append((thread, counters))
+            self._local.counters = counters
+            return counters
+
+    def _fold(self):
+        """
+        Moves the counters of finished threads into one total; must be
+        called holding the lock.
+        """
+        live = []
+        for thread, counters in self._shards:
+            thread_object = thread()
+            if thread_object is not None and thread_object.is_alive():
+                live.append((thread, counters))
+            else:
+                add_counters(self._finished, dict(counters))
+        self._shards = live
+
+    def increment(self, name, amount=1):
+        counters = self._shard()
+        counters[name] = counters.get(name, 0) + amount
+
+    def decision(self, name):
+        self.increment(name)
+
+    def cache_hit(self, name):
+        self.increment('{prefix!s}{name!s}.hits'.format(prefix=CACHE_PREFIX,
+                                                        name=name))
+
+    def cache_miss(self, name):
+        self.increment('{prefix!s}{name!s}.misses'.format(
+            prefix=CACHE_PREFIX, name=name))
+
+    def depth(self, depth):
+        self.increment('{prefix!s}{depth:d}'.format(prefix=DEPTH_PREFIX,
+                                                    depth=depth))
+
+    def snapshot(self):
+        with self._lock:
+            self._fold()
+            shards = tuple(x[1] for x in self._shards)
+            totals = dict(self._finished)
+        for shard in shards:
+            # copying a dict is atomic, whereas iterating over one which
+            # another thread is writing to is not.
+            add_counters(totals, dict(shard))
+        return totals
+
+    def reset(self):
+        with self._lock:
+            self._fold()
+            for thread, counters in self._shards:
+                counters.clear()
+            self._finished = {}
+            self._reset_at = time()
+
+    def claim_slot(self, timeout):
+        """
+        The number under which this process lists itself: the first free
+        one, or a new one if none are.
+        """
+        slots = cache.get(SLOTS_KEY)
+        if slots is None:
+            # only when missing: Django 1.6's local memory cache adds over
+            # a key which never expires.
+            cache.add(SLOTS_KEY, 0, None)
+            slots = 0
+        for slot in range(1, slots + 1):
+            if cache.add(SLOT_KEY.format(slot), self.key, timeout):
+                return slot
+        try:
+            slot = cache.incr(SLOTS_KEY)
+        except ValueError:
+            # evicted since it was added; numbering starts again.
+            cache.add(SLOTS_KEY, 0, None)
+            slot = cache.incr(SLOTS_KEY)
+        cache.set(SLOT_KEY.format(slot), self.key, timeout)
+        return slot
+
+    def register(self, timeout):
+        """
+        Keeps this process's slot from expiring, claiming another if it
+        already did, and was taken.
+        """
+        slot = self._slot
+        if slot is None or cache.get(SLOT_KEY.format(slot)) != self.key:
+            slot = self._slot = self.claim_slot(timeout=timeout)
+        cache.set(SLOT_KEY.format(slot), self.key, timeout)
+        return slot
+
+    def maybe_publish(self):
+        interval = get_publish_interval()
+        current = time()
+        if current - self._published < interval:
+            return False
+        self._published = current
+        reset_requested = cache.get(RESET_KEY)
+        if reset_requested is not None and reset_requested > self._reset_at:
+            self.reset()
+        cache.set(self.key, self.snapshot(), interval * 3)
+        self.register(timeout=interval * 3)
+        return True
+
+
+class NullRegistry(object):
+    __slots__ = ()
+
+    def increment(self, name, amount=1):
+        return None
+
+    def decision(self, name):
+        return None
+
+    def cache_hit(self, name):
+        return None
+
+    def cache_miss(self, name):
+        return None
+
+    def depth(self, depth):
+        return None
+
+    def maybe_publish(self):
+        return False
+
+
+registry = MetricsRegistry()
+NULL_REGISTRY = NullRegistry()
+
+
+def _reset_after_fork():
+    # a forked worker starts counting from nothing, with a lock which
+    # can't have been left held by a thread of the parent.
+    registry._lock = threading.Lock()
+    registry._local = threading.local()
+    registry._shards = []
+    registry._finished = {}
+    registry._slot = None
+    registry._published = 0
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_metrics():
+    if getattr(settings, 'CHURLISH_METRICS', False):
+        return registry
+    return NULL_REGISTRY
+
+
+def get_publish_interval():
+    return getattr(settings, 'CHURLISH_METRICS_PUBLISH_INTERVAL', 60)
+
+
+def get_published():
+    """
+    Sums the counters most recently published by every live process.
+    """
+    slots = cache.get(SLOTS_KEY) or 0
+    processes = cache.get_many(tuple(SLOT_KEY.format(x)
+                                     for x in range(1, slots + 1)))
+    published = cache.get_many(tuple(set(processes.values())))
+    totals = {}
+    for counters in published.values():
+        add_counters(totals, counters)
+    return totals, len(published)
+
+
+def request_reset():
+    """
+    Asks every process to reset the next time it publishes.
+    """
+    cache.set(RESET_KEY, time(), get_publish_interval() * 3)
+
+
+def get_report(counters):
+    """
+    Turns the flat counters into something answering the questions asked
+    of them: what was decided, how the caches did, and how deep the
+    matched ancestry was.
+    """
+    decisions = dict((name, counters.get(name, 0)) for name in DECISIONS)
+    caches = {}
+    depths = {}
+    for name, value in counters.items():
+        if name.startswith(CACHE_PREFIX):
+            cache_name, _, kind = name[len(CACHE_PREFIX):].rpartition('.')
+            caches.setdefault(cache_name, {'hits': 0, 'misses': 0})
+            caches[cache_name][kind] = value
+        elif name.startswith(DEPTH_PREFIX):
+            depths[int(name[len(DEPTH_PREFIX):])] = value
+    for stats in caches.values():
+        lookups = stats['hits'] + stats['misses']
+        stats['ratio'] = (float(stats['hits']) / lookups) if lookups else None
+    return {
+        'decisions': decisions,
+        'requests': sum(decisions.values()),
+        'caches': caches,
+        'depth': depths,
+        'shadow': get_shadow_report(counters),
+    }
+
+
+def get_shadow_report(counters):
+    """
+    How often the shadowed engine disagreed with the reference, and the
+    mean milliseconds each took to decide.
+    """
+    shadow = dict((name, counters.get(SHADOW_PREFIX + name, 0))
+                  for name in SHADOW_COUNTERS)
+    compared = shadow['compared']
+    for side in ('reference', 'alternate'):
+        total = counters.get('{prefix!s}{side!s}_us'.format(
+            prefix=SHADOW_PREFIX, side=side), 0)
+        shadow[side + '_ms'] = (total / 1000.0 / compared) if compared else None
+    if compared:
+        shadow['delta_ms'] = shadow['alternate_ms'] - shadow['reference_ms']
+    else:
+        shadow['delta_ms'] = None
+    return shadow
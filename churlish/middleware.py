@@ -1,15 +1,39 @@
 import re
 import logging
 from collections import namedtuple
-from itertools import product
+from itertools import product, chain
+from timeit import default_timer
 from django.conf import settings
 from django.utils.functional import cached_property
 from django.http import (Http404, HttpResponseRedirect,
                          HttpResponsePermanentRedirect)
-from django.core.urlresolvers import reverse_lazy, NoReverseMatch
-from django.contrib import admin
-from django.contrib.sites.models import Site
-from .models import URL, URLVisible, URLRedirect
+try:
+    from django.core.urlresolvers import (reverse, NoReverseMatch,
+                                          get_script_prefix)
+except ImportError:  # pragma: no cover ... Django 2.0+
+    from django.urls import reverse, NoReverseMatch, get_script_prefix
+from .models import URL, URLVisible, URLRedirect, LITERAL
+from .budgets import budgets_enforced, query_budget
+from .querycount import QueryCounter
+from .instrumentation import (get_instrument, server_timing_enabled,
+                              format_server_timing)
+from .signals import evaluation_timed
+from .metrics import get_metrics
+from .profiling import get_profiler
+from .snapshot import get_store, get_engine, patterns
+from .patterns import merge_ancestry
+from .sites import get_site_id
+from .paths import get_request_path, clear_path_caches
+from .caching import cache_headers_enabled, apply_cache_headers
+from .routing import get_read_database, using, track_writes, remember_writes
+from . import partials
+from . import redirects
+from . import shadow
+
+try:
+    from django.db.models import Prefetch
+except ImportError:  # pragma: no cover ... Django < 1.7
+    Prefetch = None
 
 try:
     from django.utils.timezone import now
@@ -22,6 +46,50 @@ logger = logging.getLogger(__name__)
 
 
 URLData = namedtuple('URLData', 'perfect imperfect all path')
+# the columns of URL itself the middleware reads, when it's only fetching
+# what the partials need.
+URL_FIELDS = ('site', 'path', 'kind')
+
+# the compiled exclusions, partial classes and relations only depend on
+# settings (and maybe the admin), so are discovered once per process (or before
+# forking, see churlish.warmup) rather than once per request.
+runtime_state = {}
+
+
+def clear_runtime_state():
+    runtime_state.clear()
+    clear_path_caches()
+
+
+def merge_needs(needs):
+    """
+    Combines the DataNeeds of every partial into one per relation.
+    """
+    merged = {}
+    for need in needs:
+        existing = merged.get(need.relation)
+        if existing is None:
+            merged[need.relation] = need
+            continue
+        fields = existing.fields + tuple(x for x in need.fields
+                                         if x not in existing.fields)
+        merged[need.relation] = existing._replace(fields=fields)
+    return tuple(merged[x] for x in sorted(merged))
+
+
+def get_url_data_for(path, rows):
+    """
+    `rows` may be URL instances, or anything else with a `path`, such as the
+    RuleSets of a snapshot.
+    """
+    imperfect = None
+    perfect = None
+    if rows:
+        imperfect = tuple(
+            x for x in rows
+            if path.startswith(x.path) and len(x.path) < len(path))
+        perfect = tuple(x for x in rows if x.path == path)
+    return URLData(perfect=perfect, imperfect=imperfect, all=rows, path=path)
 
 
 class RequestURL(object):
@@ -46,11 +114,52 @@ class RequestURL(object):
         relations = self.test_collector.get_relations()
         return tuple(relations)
 
-    def get_query_set(self, request, instance):
+    def get_pattern_matches(self, request):
+        pattern_set = patterns.get(site_id=get_site_id(request=request)).rules
+        return pattern_set.matcher.match(get_request_path(request))
+
+    def get_needs(self, request):
+        if self.test_collector is None or cache_headers_enabled():
+            # the caching headers are derived from every rule, and when
+            # each was modified.
+            return None
+        return self.test_collector.get_needs(request=request)
+
+    def prune_query_set(self, qs, needs):
+        """
+        Only fetch the columns of URL & its joined rules which the partials
+        read, and prefetch only the columns they read of the rest.
+        """
+        only = list(URL_FIELDS)
+        selects = []
+        for need in needs:
+            if not need.many:
+                # older Djangos replace, rather than add to, the relations
+                # of an earlier select_related call.
+                selects.append(need.relation)
+                only.extend('{0!s}__{1!s}'.format(need.relation, x)
+                            for x in ('url',) + need.fields)
+            elif Prefetch is not None:
+                related = need.model.objects.only('url', *need.fields)
+                qs = qs.prefetch_related(Prefetch(need.relation,
+                                                  queryset=related))
+            else:
+                qs = qs.prefetch_related(need.relation)
+        if selects:
+            qs = qs.select_related(*selects)
+        return qs.only(*only)
+
+    def get_query_set(self, request, instance, matches=()):
+        qs = instance.get_ancestors(include_self=True).filter(kind=LITERAL)
+        if matches:
+            qs = qs | URL.objects.filter(pk__in=[x.key for x in matches])
+        qs = using(qs.filter(site=get_site_id(request=request)),
+                   request=request)
+        needs = self.get_needs(request=request)
+        if needs is not None:
+            return self.prune_query_set(qs=qs, needs=needs)
         prefetches = self.get_prefetch_related(request=request)
         selects = self.get_select_related(request=request)
-        qs = instance.get_ancestors(include_self=True).filter(
-            site=Site.objects.get_current())
         if selects:
             qs = qs.select_related(*selects)
         if prefetches:
@@ -58,23 +167,24 @@ class RequestURL(object):
         return qs
 
     def get_url_data(self, request):
-        url = URL(path=request.path)
-        all_urls = tuple(
-            self.get_query_set(request=request, instance=url).iterator())
-
-        imperfect = None
-        perfect = None
-        if all_urls:
-            imperfect = tuple(x for x in all_urls if x.is_ancestor_of(url))
-            perfect = tuple(x for x in all_urls if x.is_same_as(url))
-
-        outdata = URLData(perfect=perfect, imperfect=imperfect,
-                          all=all_urls, path=request.path)
-        return outdata
+        path = get_request_path(request)
+        url = URL(path=path)
+        matches = self.get_pattern_matches(request=request)
+        # not .iterator(), which would skip the prefetches.
+        all_urls = tuple(self.get_query_set(request=request, instance=url,
+                                            matches=matches))
+        if matches:
+            found = dict((x.pk, x) for x in all_urls if x.is_pattern())
+            all_urls = merge_ancestry(
+                tuple(x for x in all_urls if not x.is_pattern()),
+                tuple((x, found[x.key]) for x in matches if x.key in found))
+        return get_url_data_for(path=path, rows=all_urls)
 
     def get_exclusions(self):
+        # reversed now, so that without the admin's URLs the exception is
+        # raised here rather than when the exclusions are compiled.
         try:
-            admin_root = reverse_lazy('admin:index')
+            admin_root = reverse('admin:index')
         except NoReverseMatch:
             admin_root = None
 
@@ -93,9 +203,21 @@ class RequestURL(object):
             if configured_exclude:
                 yield configured_exclude
 
+    def get_compiled_exclusions(self):
+        # the admin's root is reversed with the script prefix of the request
+        # being handled (SCRIPT_NAME), which isn't set while warming up, so
+        # they're compiled once per prefix rather than once per process.
+        key = ('exclusions', get_script_prefix())
+        try:
+            return runtime_state[key]
+        except KeyError:
+            compiled = tuple(frozenset(re.compile(x, re.VERBOSE)
+                                       for x in self.get_exclusions()))
+            runtime_state[key] = compiled
+            return compiled
+
     def request_is_excluded(self, request):
-        compiled_exclusions = frozenset(re.compile(x, re.VERBOSE) 
-                                        for x in self.get_exclusions())
+        compiled_exclusions = self.get_compiled_exclusions()
         for exclusion in compiled_exclusions:
             if exclusion.search(request.path):
                 return True
@@ -104,71 +226,299 @@ class RequestURL(object):
 
 class RequestTesters(object):
     """
-    Serves as an API around discovery of middleware partials, currently
-    using the URL ModelAdmin, maybe using a separate registry in future.
+    Serves as an API around discovery of middleware partials, from
+    CHURLISH_PARTIALS, the URL ModelAdmin, or the built in order; see
+    churlish.partials.
     """
     __slots__ = ()
 
     def get_modeladmin(self, request=None):
+        return partials.get_modeladmin()
+
+    def get_test_classes(self, request=None):
         try:
-            return admin.site._registry[URL]
+            return runtime_state['partials']
         except KeyError:
-            # Not mounted into the admin, so we can't figure out which
-            # relations might affect the URL instances.
-            logger.error("Unable to use ChurlishMiddleware because the"
-                         "the admin site doesn't have a URL Modeladmin "
-                         "instance", exc_info=1)
-            return None
+            pass
+        classes = partials.get_configured_partials()
+        if classes is None:
+            urladmin = self.get_modeladmin(request=request)
+            if urladmin is not None:
+                classes = partials.get_admin_partials(urladmin)
+            else:
+                classes = partials.get_default_partials()
+        runtime_state['partials'] = classes
+        return classes
 
     def get_tests(self, request=None):
-        urladmin = self.get_modeladmin(request=request)
-        if urladmin is None:
+        classes = self.get_test_classes(request=request)
+        if classes is None:
             return None
+        return tuple(x() for x in classes)
+
+    def get_needs(self, request=None):
+        """
+        The DataNeeds of every partial, or None if any don't declare them,
+        in which case every relation is fetched in full.
+        """
         try:
-            return urladmin.get_middlewares()
-        except AttributeError:
-            logger.error("Unable to use ChurlishMiddleware because the "
-                         "admin site doesn't implement the `get_middlewares`"
-                         "method", exc_info=1)
-            return None
-    
+            return runtime_state['needs']
+        except KeyError:
+            pass
+        classes = self.get_test_classes(request=request)
+        needs = None
+        if classes is not None and all(hasattr(x, 'needs') for x in classes):
+            needs = merge_needs(chain.from_iterable(x.needs for x in classes))
+        runtime_state['needs'] = needs
+        return needs
+
     def get_relations(self, request=None):
-        return self.get_modeladmin(request=request).get_runtime_relations()
+        try:
+            return runtime_state['relations']
+        except KeyError:
+            pass
+        relations = partials.get_relations(
+            self.get_test_classes(request=request))
+        if relations is None:
+            # partials which don't say what they read are left to the
+            # admin to work out, as they're likely to come from its inlines.
+            urladmin = self.get_modeladmin(request=request)
+            if urladmin is not None:
+                relations = tuple(urladmin.get_runtime_relations())
+            else:
+                relations = partials.get_relations(
+                    partials.get_default_partials())
+        runtime_state['relations'] = relations
+        return relations
 
 
 class ChurlishMiddleware(object):
     __slots__ = ()
 
+    def process_request(self, request):
+        """
+        Redirects for exactly this path are issued before the URL is
+        resolved, or the rest of the middleware runs.
+        """
+        if get_read_database() is not None:
+            track_writes(request=request)
+        if not redirects.fast_path_enabled():
+            return None
+        url_handler = RequestURL()
+        if url_handler.request_is_excluded(request=request):
+            return None
+        partial_classes = RequestTesters().get_test_classes(request=request)
+        if not redirects.fast_path_applies(partial_classes=partial_classes):
+            return None
+        response = redirects.respond(request=request)
+        if response is not None:
+            get_metrics().decision('redirected')
+        return response
+
     def process_view(self, request, view_func, view_args, view_kwargs):
+        with get_profiler().capture(request=request):
+            if not budgets_enforced():
+                return self.evaluate(request=request, view_func=view_func)
+            relations = RequestTesters().get_relations(request=request)
+            with query_budget('process_view',
+                              relations=len(tuple(relations))) as budget:
+                try:
+                    return self.evaluate(request=request,
+                                         view_func=view_func)
+                finally:
+                    budget.exempt = getattr(request, shadow.QUERIES_ATTR, 0)
+
+    def evaluate(self, request, view_func):
         test_collector = RequestTesters()
         url_handler = RequestURL(test_collector=test_collector)
+        instrument = get_instrument(request=request)
+        metrics = get_metrics()
+        # the debug messages are built for every URL & partial pair, so
+        # avoid formatting them at all unless they'll be emitted.
+        debug = logger.isEnabledFor(logging.DEBUG)
         logextra = {'request': request}
         logcls = self.__class__.__name__
-        if url_handler.request_is_excluded(request=request):
-            logger.debug("Skipping {cls!s} for this request as it matches "
-                         "a configured exclusion".format(cls=logcls),
-                         extra=logextra)
+        with instrument.phase('exclusions'):
+            excluded = url_handler.request_is_excluded(request=request)
+        if excluded:
+            if debug:
+                logger.debug("Skipping {cls!s} for this request as it "
+                             "matches a configured exclusion".format(
+                                 cls=logcls), extra=logextra)
+            metrics.decision('excluded')
             return None  # no match, so continue with other middlewares
-        request.churlish = url_handler.get_url_data(request=request)
+        bound_mws = test_collector.get_tests(request=request)
+        engine = get_engine(partials=bound_mws)
+        if engine is not None:
+            site_id = get_site_id(request=request)
+            with instrument.phase('snapshot'):
+                snapshot = get_store().get(site_id=site_id)
+                pattern_set = patterns.get(site_id=site_id).rules
+            return self.evaluate_snapshot(request=request, view_func=view_func,
+                                          engine=engine, snapshot=snapshot,
+                                          pattern_set=pattern_set,
+                                          instrument=instrument,
+                                          metrics=metrics)
+        shadow_engine = shadow.get_shadow_engine(partials=bound_mws)
+        if shadow_engine is not None:
+            return self.evaluate_shadowed(
+                request=request, view_func=view_func, engine=shadow_engine,
+                reference=lambda: self.evaluate_reference(
+                    request=request, view_func=view_func,
+                    url_handler=url_handler, partials=bound_mws,
+                    instrument=instrument, metrics=metrics, debug=debug))
+        return self.evaluate_reference(request=request, view_func=view_func,
+                                       url_handler=url_handler,
+                                       partials=bound_mws,
+                                       instrument=instrument,
+                                       metrics=metrics, debug=debug)
+
+    def evaluate_reference(self, request, view_func, url_handler, partials,
+                           instrument, metrics, debug):
+        logextra = {'request': request}
+        logcls = self.__class__.__name__
+        with instrument.phase('ancestry'):
+            request.churlish = url_handler.get_url_data(request=request)
         if len(request.churlish.all) < 1:
-            logger.debug("Skipping {cls!s} for this request because no URLs "
-                         "match any path components".format(cls=logcls),
-                         extra=logextra)
+            metrics.decision('no_rules')
+            if debug:
+                logger.debug("Skipping {cls!s} for this request because no "
+                             "URLs match any path components".format(
+                                 cls=logcls), extra=logextra)
             return None   # no match, so continue with other middlewares
 
-        bound_mws = test_collector.get_tests(request=request)
-        urls_and_mws = product(request.churlish.all, bound_mws)
+        metrics.depth(len(request.churlish.all))
+        try:
+            response = self.run_partials(request=request, view_func=view_func,
+                                         partials=partials,
+                                         instrument=instrument, debug=debug)
+        except Http404:
+            metrics.decision('failed')
+            raise
+        self.record_response(metrics=metrics, response=response)
+        return response
+
+    def evaluate_shadowed(self, request, view_func, engine, reference):
+        """
+        Serves the `reference` decision, having compared it with what
+        `engine` would have decided; see churlish.shadow.
+        """
+        started = default_timer()
+        try:
+            response = reference()
+        except Http404 as error:
+            self.compare_shadow(request=request, view_func=view_func,
+                                engine=engine,
+                                reference=shadow.from_error(error),
+                                reference_duration=default_timer() - started)
+            raise
+        self.compare_shadow(request=request, view_func=view_func,
+                            engine=engine,
+                            reference=shadow.from_response(response),
+                            reference_duration=default_timer() - started)
+        return response
+
+    def compare_shadow(self, request, view_func, engine, reference,
+                       reference_duration):
+        url_data = getattr(request, 'churlish', None)
+        # the alternate engine's queries aren't held to the budget.
+        counter = QueryCounter() if budgets_enforced() else None
+        started = default_timer()
+        try:
+            if counter is None:
+                alternate = self.decide_shadow(
+                    request=request, view_func=view_func, engine=engine)
+            else:
+                with counter:
+                    alternate = self.decide_shadow(
+                        request=request, view_func=view_func, engine=engine)
+        except Exception:
+            return shadow.record_error(request=request)
+        finally:
+            # the view sees what the reference found.
+            request.churlish = url_data
+            if counter is not None:
+                setattr(request, shadow.QUERIES_ATTR, counter.count)
+        return shadow.record(request=request, reference=reference,
+                             alternate=alternate,
+                             reference_duration=reference_duration,
+                             alternate_duration=default_timer() - started)
+
+    def decide_shadow(self, request, view_func, engine):
+        """
+        As evaluate_snapshot, but without counting the decision, which
+        is returned as a churlish.shadow.Outcome.
+        """
+        site_id = get_site_id(request=request)
+        store = get_store(name=shadow.get_shadow_engine_name())
+        rulesets = engine.get_ancestry(
+            request=request, snapshot=store.get(site_id=site_id),
+            pattern_set=patterns.get(site_id=site_id).rules)
+        request.churlish = get_url_data_for(path=get_request_path(request),
+                                            rows=rulesets)
+        if len(rulesets) < 1:
+            return shadow.from_response(None)
+        try:
+            decision = engine.decide(request=request, rulesets=rulesets)
+            response = engine.respond(request=request, decision=decision,
+                                      view_func=view_func)
+        except Http404 as error:
+            return shadow.from_error(error)
+        return shadow.from_response(response)
+
+    def evaluate_snapshot(self, request, view_func, engine, snapshot,
+                          pattern_set, instrument, metrics):
+        """
+        Does no I/O, except for fetching the user's groups if a group
+        restriction applies and they haven't already been fetched.
+        """
+        with instrument.phase('ancestry'):
+            rulesets = engine.get_ancestry(request=request, snapshot=snapshot,
+                                           pattern_set=pattern_set)
+        request.churlish = get_url_data_for(path=get_request_path(request),
+                                            rows=rulesets)
+        if len(rulesets) < 1:
+            metrics.decision('no_rules')
+            return None
+        metrics.depth(len(rulesets))
+        try:
+            with instrument.phase('decide'):
+                decision = engine.decide(request=request, rulesets=rulesets)
+            response = engine.respond(request=request, decision=decision,
+                                      view_func=view_func)
+        except Http404:
+            metrics.decision('failed')
+            raise
+        self.record_response(metrics=metrics, response=response)
+        return response
+
+    def record_response(self, metrics, response):
+        if response is None:
+            metrics.decision('passed')
+        elif response.status_code in (301, 302):
+            metrics.decision('redirected')
+        else:
+            metrics.decision('responded')
+
+    def run_partials(self, request, view_func, partials, instrument, debug):
+        logextra = {'request': request}
+        urls_and_mws = product(request.churlish.all, partials)
 
         errors = []
         for url, mw in urls_and_mws:
-            logger.debug("Running {cls!s} against {url!s}".format(
-                cls=mw.__class__.__name__, url=url.path), extra=logextra)
+            mwcls = mw.__class__.__name__
+            if debug:
+                logger.debug("Running {cls!s} against {url!s}".format(
+                    cls=mwcls, url=url.path), extra=logextra)
 
-            status = mw.test(request=request, obj=url, view=view_func)
+            with instrument.phase(mwcls):
+                status = mw.test(request=request, obj=url, view=view_func)
 
             if status is None:
-                logger.debug("{cls!s} is not applicable for {url!s}".format(
-                    cls=mw.__class__.__name__, url=url.path), extra=logextra)
+                if debug:
+                    logger.debug("{cls!s} is not applicable for "
+                                 "{url!s}".format(cls=mwcls, url=url.path),
+                                 extra=logextra)
                 continue
 
             # make True worth 0 points, False worth 1. Keeps our tally for 
@@ -177,18 +527,24 @@ class ChurlishMiddleware(object):
             errors.append(int(not status))
 
             if status is True and hasattr(mw, 'success'):
-                response = mw.success(request=request, obj=url, view=view_func)
+                with instrument.phase('{0!s}.success'.format(mwcls)):
+                    response = mw.success(request=request, obj=url,
+                                          view=view_func)
                 if response is not None:
-                    logger.debug("{cls!s} forced {url!s} to return".format(
-                        cls=mw.__class__.__name__, url=url.path),
-                        extra=logextra)
+                    if debug:
+                        logger.debug("{cls!s} forced {url!s} to "
+                                     "return".format(cls=mwcls, url=url.path),
+                                     extra=logextra)
                     return response
             elif status is False and hasattr(mw, 'error'):
-                response = mw.error(request=request, obj=url, view=view_func)
+                with instrument.phase('{0!s}.error'.format(mwcls)):
+                    response = mw.error(request=request, obj=url,
+                                        view=view_func)
                 if response is not None:
-                    logger.debug("{cls!s} forced {url!s} to return".format(
-                        cls=mw.__class__.__name__, url=url.path),
-                        extra=logextra)
+                    if debug:
+                        logger.debug("{cls!s} forced {url!s} to "
+                                     "return".format(cls=mwcls, url=url.path),
+                                     extra=logextra)
                     return response
 
         # we should only hit this condition if a test failed, but didn't try
@@ -199,3 +555,19 @@ class ChurlishMiddleware(object):
                            "request should fail, but did not opt to handle "
                            " the response.", extra=logextra)
             raise Http404("Request failed tests for this URL")
+
+    def process_response(self, request, response):
+        get_metrics().maybe_publish()
+        if get_read_database() is not None:
+            remember_writes(request=request)
+        if cache_headers_enabled():
+            response = apply_cache_headers(request=request, response=response)
+        instrument = getattr(request, '_churlish_instrument', None)
+        if instrument is None:
+            return response
+        timings = instrument.timings()
+        evaluation_timed.send(sender=self.__class__, request=request,
+                              timings=timings)
+        if timings and server_timing_enabled():
+            response['Server-Timing'] = format_server_timing(timings)
+        return response
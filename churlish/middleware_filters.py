@@ -1,6 +1,11 @@
+from collections import namedtuple
+from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
 from django.http import Http404
 from django.shortcuts import redirect
+from django.utils.cache import patch_cache_control
+from .models import (URLVisible, URLRedirect, SimpleAccessRestriction,
+                     GroupAccessRestriction, UserAccessRestriction)
 
 # Always use an RequestFailedTest subclass for the error condition, to
 # avoid leaking that some part of the URL may be correct. eg, an error
@@ -11,10 +16,69 @@ from django.shortcuts import redirect
 class RequestFailedTest(Http404): pass  # noqa
 
 
+# What a partial reads of a URL's related rows, as its `needs`, so that the
+# middleware fetches only those columns: `relation` is the accessor on the
+# URL, `fields` are of `model`, and `many` is whether it's a reverse
+# foreign key (prefetched) rather than one to one (joined).
+DataNeeds = namedtuple('DataNeeds', 'relation model fields many')
+
+
+def get_redirect_max_age(permanent):
+    if permanent:
+        return getattr(settings, 'CHURLISH_PERMANENT_REDIRECT_MAX_AGE', 86400)
+    return getattr(settings, 'CHURLISH_TEMPORARY_REDIRECT_MAX_AGE', 0)
+
+
+def redirect_to(target, permanent, cacheable):
+    """
+    `cacheable` should only be True if every user requesting the URL would
+    be redirected in the same way.
+    """
+    response = redirect(target, permanent=permanent)
+    max_age = get_redirect_max_age(permanent=permanent)
+    if cacheable and max_age:
+        patch_cache_control(response, public=True, max_age=max_age)
+    return response
+
+
+def get_authorization(request):
+    """
+    The cached AuthorizationFacts for the request's user, if enabled.
+    """
+    # imported here because churlish.authorization needs (via the snapshot
+    # module) this module.
+    from .authorization import get_facts
+    return get_facts(request)
+
+
+def is_nearest(request, obj):
+    """
+    Whether `obj` is the nearest URL to the one requested; only partials
+    for that URL are guaranteed to have run before, so any further up may
+    have only been reached because the user was let through a restriction.
+    """
+    url_data = getattr(request, 'churlish', None)
+    if url_data is None or not url_data.all:
+        return False
+    return url_data.all[0].path == obj.path
+
+
+def is_authenticated(user):
+    """
+    `is_authenticated` is a method until Django 1.10, and a property after.
+    """
+    if not user:
+        return False
+    authenticated = user.is_authenticated
+    if callable(authenticated):
+        return authenticated()
+    return authenticated
+
+
 class IsAuthenticated(object):
     __slots__ = ()
     def test(self, request, obj, view):
-        return request.user and request.user.is_authenticated()
+        return is_authenticated(request.user)
     __call__ = test
 
 
@@ -34,6 +98,11 @@ class IsAdmin(object):
 
 class UserRoleRequired(object):
     __slots__ = ()
+    needs = (DataNeeds(relation='simpleaccessrestriction',
+                       model=SimpleAccessRestriction,
+                       fields=('is_authenticated', 'is_staff', 'is_superuser'),
+                       many=False),)
+
     def test(self, request, obj, view):
         try:
             access_required = obj.simpleaccessrestriction
@@ -60,13 +129,24 @@ class UserRoleRequired(object):
 
 class UserRequired(object):
     __slots__ = ()
+    needs = (DataNeeds(relation='useraccessrestriction_set',
+                       model=UserAccessRestriction, fields=('user',),
+                       many=True),)
+
     def test(self, request, obj, view):
-        users = obj.useraccessrestriction_set.values_list('user_id', flat=True)
+        # .all() rather than .values_list() so that the rows prefetched by
+        # the middleware are used, instead of a query per URL.
+        users = (x.user_id for x in obj.useraccessrestriction_set.all())
         distinct_users = frozenset(users)
         if not distinct_users:
             return None
         not_anonymous = IsAuthenticated().test(request, obj, None)
-        return not_anonymous and request.user.pk in distinct_users
+        if not not_anonymous:
+            return False
+        facts = get_authorization(request)
+        if facts is not None:
+            return obj.pk in facts.user_urls
+        return request.user.pk in distinct_users
     __call__ = test
 
     def error(self, request, obj, view):
@@ -77,21 +157,42 @@ class UserRequired(object):
 
 class GroupRequired(object):
     __slots__ = ()
+    needs = (DataNeeds(relation='groupaccessrestriction_set',
+                       model=GroupAccessRestriction, fields=('group',),
+                       many=True),)
+
     def test(self, request, obj, view):
-        grps = obj.groupaccessrestriction_set.values_list('group_id',
-                                                          flat=True)
+        grps = (x.group_id for x in obj.groupaccessrestriction_set.all())
         distinct_groups = frozenset(grps)
         if not distinct_groups:
             return None
         is_auth = IsAuthenticated().test(request, obj, None)
         if not is_auth:
             return False
-        user_groups = frozenset(request.user.groups.values_list('pk',
-                                flat=True))
-        intersection = grps & user_groups
+        facts = get_authorization(request)
+        if facts is not None:
+            return obj.pk in facts.group_urls
+        user_groups = self.get_user_groups(request)
+        intersection = distinct_groups & user_groups
         return len(intersection) > 0
     __call__ = test
 
+    def get_user_groups(self, request):
+        """
+        Asked for once per request, rather than once per restricted URL.
+        """
+        try:
+            return request._churlish_user_groups
+        except AttributeError:
+            facts = get_authorization(request)
+            if facts is not None:
+                groups = facts.groups
+            else:
+                groups = frozenset(request.user.groups.values_list(
+                    'pk', flat=True))
+            request._churlish_user_groups = groups
+            return groups
+
     def error(self, request, obj, view):
         raise RequestFailedTest("You don't have access to this URL resource "
                                 "because of your groups")
@@ -99,6 +200,10 @@ class GroupRequired(object):
 
 class RedirectRequired(object):
     __slots__ = ()
+    needs = (DataNeeds(relation='urlredirect', model=URLRedirect,
+                       fields=('target', 'permanent', 'final_target'),
+                       many=False),)
+
     def test(self, request, obj, view):
         try:
             target = obj.urlredirect
@@ -109,11 +214,17 @@ class RedirectRequired(object):
     __call__ = test
 
     def success(self, request, obj, view):
-        return redirect(obj.urlredirect.get_absolute_url())
+        target = obj.urlredirect
+        return redirect_to(target.get_final_target(),
+                           permanent=target.is_permanent(),
+                           cacheable=is_nearest(request, obj))
 
 
 class PublishedRequired(object):
     __slots__ = ()
+    needs = (DataNeeds(relation='urlvisible', model=URLVisible,
+                       fields=('publish_on', 'unpublish_on'), many=False),)
+
     def test(self, request, obj, view):
         try:
             publishing_status = obj.urlvisible
@@ -1,15 +1,16 @@
 import logging
-from itertools import chain
 from datetime import timedelta
 from django import VERSION
 from django.utils.encoding import python_2_unicode_compatible
-from django.db import models
+from django.db import models, connection, connections
 from django.utils.functional import cached_property
 from django.utils.translation import ugettext_lazy as _
 from django.core.exceptions import ValidationError
 from django.conf import settings
 from model_utils.models import TimeStampedModel
 from .querying import VisbilityManager
+from .patterns import GLOB, REGEX, PatternError, validate_pattern
+from .paths import PATH_SEP, normalise_path, get_ancestry
 
 try:
     from django.utils.timezone import now
@@ -19,7 +20,9 @@ except ImportError:
 
 
 logger = logging.getLogger(__name__)
-PATH_SEP = '/'
+LITERAL = 'literal'
+KIND_CHOICES = ((LITERAL, _('Exact path')), (GLOB, _('Glob pattern')),
+                (REGEX, _('Regular expression')))
 DJANGO_VERSION = VERSION[0:3]
 BOOL_CHOICES = ((True, _('Yes')), (False, _('No')))
 publish_label = _("publishing date")
@@ -28,6 +31,12 @@ publish_help = _("the date and time on which this object should be visible on "
 unpublish_label = _("publishing end date")
 unpublish_help = _("if filled in, this date and time are when this object "
                    "will cease being available.")
+kind_help = _("glob patterns may use * and ? within a part of the path, or "
+              "** for any number of parts, eg: /*/private/; regular "
+              "expressions are matched against the start of the path.")
+permanent_help = _("permanent redirects may be cached by browsers and "
+                   "proxies, so only tick this if the URL will never be "
+                   "used again.")
 
 
 class ModelValidationError(ValidationError):
@@ -41,6 +50,12 @@ class URL(TimeStampedModel):
     """
     site = models.ForeignKey('sites.Site', null=False)
     path = models.CharField(max_length=2048, null=False, blank=False)
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES,
+                            default=LITERAL, verbose_name=_("Matches"),
+                            help_text=kind_help)
+    # see prefetch_relative_counts
+    _ancestor_count = None
+    _descendant_count = None
 
     def __str__(self):
         return self.path
@@ -50,22 +65,37 @@ class URL(TimeStampedModel):
 
     def clean(self):
         self.path = self.path.strip()
-        if self.path and not self.path.startswith(PATH_SEP):
+        if self.is_pattern():
+            try:
+                validate_pattern(kind=self.kind, pattern=self.path)
+            except PatternError as e:
+                raise ModelValidationError(str(e))
+        elif self.path and not self.path.startswith(PATH_SEP):
             raise ModelValidationError("Invalid URL root")
+        elif self.path:
+            self.path = normalise_path(self.path)
+
+    def save(self, *args, **kwargs):
+        # the same spelling requests are looked up by; see churlish.paths
+        if self.path and not self.is_pattern():
+            self.path = normalise_path(self.path)
+        return super(URL, self).save(*args, **kwargs)
+
+    def is_pattern(self):
+        return self.kind != LITERAL
+
+    def get_manager(self):
+        """
+        Relatives are looked up on the database this URL came from (eg: a
+        read replica), as Django's own related managers do.
+        """
+        return self.__class__.objects.db_manager(self._state.db)
 
     def get_path_ancestry(self, include_self=False):
-        parts = tuple(x for x in self.path.split(PATH_SEP) if x)
-        max_length = len(parts)
-        if include_self:
-            max_length += 1
-        part_range = range(1, len(parts) + 1)
-        combos = ('{sep}{path}{sep}'.format(
-                  path=PATH_SEP.join(parts[0:x]), sep=PATH_SEP)
-                  for x in part_range)
-        return chain([PATH_SEP], combos)
+        return get_ancestry(self.path)
 
     def get_depth(self):
-        return len(tuple(self.get_path_ancestry(include_self=True)))
+        return len(self.get_path_ancestry(include_self=True))
 
     get_level = get_depth
 
@@ -81,10 +111,10 @@ class URL(TimeStampedModel):
         (/a/b/c/, /a/b/, /a/, /)
         Allowing for naive iteration over them.
         """
-        manager = self.__class__.objects
+        manager = self.get_manager()
         if self.is_root():
             if include_self is True:
-                return self.__class__.get_root_nodes()
+                return manager.filter(path=PATH_SEP)
             return manager.none()
         parent_urls = tuple(self.get_path_ancestry(include_self=include_self))
         if not parent_urls:
@@ -92,14 +122,57 @@ class URL(TimeStampedModel):
         return manager.filter(path__in=parent_urls)
 
     def get_ancestor_count(self):
+        if self._ancestor_count is not None:
+            return self._ancestor_count
         return self.get_ancestors().count()
 
     def get_descendants(self):
-        return self.__class__.objects.filter(path__startswith=self.path)
+        return self.get_manager().filter(path__startswith=self.path)
 
     def get_descendant_count(self):
+        if self._descendant_count is not None:
+            return self._descendant_count
         return self.get_descendants().count()
 
+    @classmethod
+    def prefetch_relative_counts(cls, urls):
+        """
+        Counts the ancestors & descendants of every one of `urls` in two
+        queries, rather than two for each, for listing them.
+        """
+        urls = tuple(urls)
+        if not urls:
+            return urls
+        manager = urls[0].get_manager()
+        # as get_ancestors, the root has none.
+        ancestries = dict((x.pk, () if x.is_root() else x.get_path_ancestry())
+                          for x in urls)
+        paths = set()
+        for ancestry in ancestries.values():
+            paths.update(ancestry)
+        found = {}
+        for path in manager.filter(path__in=paths).values_list('path',
+                                                               flat=True):
+            found[path] = found.get(path, 0) + 1
+        # the same comparison as path__startswith, made for every row at
+        # once by the database.
+        qn = connections[manager.db].ops.quote_name
+        column = qn(cls._meta.get_field('path').column)
+        descendants = (
+            "SELECT COUNT(*) FROM {table!s} {alias!s} WHERE SUBSTR("
+            "{alias!s}.{column!s}, 1, LENGTH({table!s}.{column!s})) = "
+            "{table!s}.{column!s}".format(table=qn(cls._meta.db_table),
+                                          alias=qn('descendant'),
+                                          column=column))
+        counts = dict(manager.filter(pk__in=ancestries.keys())
+                      .extra(select={'descendants': descendants})
+                      .values_list('pk', 'descendants'))
+        for url in urls:
+            url._ancestor_count = sum(found.get(x, 0)
+                                      for x in ancestries[url.pk])
+            url._descendant_count = counts[url.pk]
+        return urls
+
     def get_parent(self):
         if self.is_root():
             return None
@@ -108,15 +181,20 @@ class URL(TimeStampedModel):
             return None
         closest_parent = parent_urls[-1]
         try:
-            return self.__class__.objects.get(path=closest_parent)
+            return self.get_manager().get(path=closest_parent)
         except self.__class__.DoesNotExist:
             return None
 
     def get_qs_extra(self, target_depth):
-        field_obj = self._meta.get_field_by_name('path')
-        column = field_obj[0].db_column
-        params = [column, column, PATH_SEP, PATH_SEP, target_depth]
-        qs_extra = ["(LENGTH(%s) - LENGTH(REPLACE(%s, %s, ''))) / LENGTH(%s) = %d"]
+        # column names can't be query parameters, or they'd be quoted as
+        # string literals, so only the separator & depth are parameterised.
+        qn = connection.ops.quote_name
+        column = '{table!s}.{column!s}'.format(
+            table=qn(self._meta.db_table),
+            column=qn(self._meta.get_field('path').column))
+        params = [PATH_SEP, PATH_SEP, target_depth]
+        qs_extra = ["(LENGTH({col!s}) - LENGTH(REPLACE({col!s}, %s, ''))) "
+                    "/ LENGTH(%s) = %s".format(col=column)]
         return {
             'where': qs_extra,
             'params': params,
@@ -124,12 +202,12 @@ class URL(TimeStampedModel):
 
     def get_siblings(self):
         if self.is_root():
-            return self.__class__.objects.none()
+            return self.get_manager().none()
         ancestors = tuple(self.get_path_ancestry(include_self=False))
         nearest_ancestor = ancestors[-1]
         slash_count = self.path.count(PATH_SEP)
         extras = self.get_qs_extra(target_depth=slash_count)
-        return (self.__class__.objects
+        return (self.get_manager()
                 .filter(path__startswith=nearest_ancestor)
                 .extra(**extras))
 
@@ -161,7 +239,7 @@ class URL(TimeStampedModel):
             return None
 
     def get_root(self):
-        return self.__class__.objects.get(path=PATH_SEP)
+        return self.get_manager().get(path=PATH_SEP)
 
     def is_ancestor_of(self, node):
         """
@@ -234,6 +312,13 @@ class URLRedirect(TimeStampedModel):
     url = models.OneToOneField('churlish.URL')
     target = models.CharField(max_length=2048,
                               validators=[validate_redirect_target])
+    permanent = models.BooleanField(default=False,
+                                    verbose_name=_("Permanent"),
+                                    help_text=permanent_help)
+    # where following `target` (and any redirects it leads to) ends up;
+    # see churlish.chains
+    final_target = models.CharField(max_length=2048, blank=True, null=True,
+                                    editable=False)
 
     def __str__(self):
         return self.target
@@ -242,12 +327,25 @@ class URLRedirect(TimeStampedModel):
         self.target = self.target.strip()
         if len(self.target) < 1:
             raise ModelValidationError("Invalid target")
+        if self.url_id is None:
+            return None
+        url = self.url
+        if url.is_pattern():
+            return None
+        loop = chains.find_loop(site_id=url.site_id, path=url.path,
+                                target=self.target)
+        if loop is not None:
+            raise ModelValidationError("This redirect would loop: "
+                                       "{0!s}".format(' -> '.join(loop)))
 
     def get_absolute_url(self):
         return self.target
 
+    def get_final_target(self):
+        return self.final_target or self.target
+
     def is_permanent(self):
-        return True
+        return self.permanent
 
     class Meta:
         verbose_name = _("Redirect")
@@ -349,3 +447,63 @@ class UserAccessRestriction(TimeStampedModel):
 
     class Meta:
         db_table = 'churlish_url_accessuser'
+
+
+@python_2_unicode_compatible
+class RuleChange(models.Model):
+    """
+    A path on a site whose rules changed, written in the same transaction
+    as the change, for other processes to find; see churlish.changelog.
+    """
+    site = models.ForeignKey('sites.Site')
+    path = models.CharField(max_length=2048)
+    created = models.DateTimeField(default=now, db_index=True)
+
+    def __str__(self):
+        return self.path
+
+    class Meta:
+        ordering = ('pk',)
+        db_table = 'churlish_rule_change'
+
+
+@python_2_unicode_compatible
+class EffectiveRules(models.Model):
+    """
+    Every rule which applies to a URL, its own and those inherited from its
+    ancestors, kept up to date for CHURLISH_ENGINE = 'effective'; see
+    churlish.effective.
+    """
+    url = models.OneToOneField('churlish.URL', related_name='effective_rules')
+    site = models.ForeignKey('sites.Site')
+    path = models.CharField(max_length=2048)
+    depth = models.PositiveIntegerField()
+    modified = models.DateTimeField()
+    # the combined restrictions, for finding (or checking) URLs by them.
+    redirect_target = models.CharField(max_length=2048, blank=True, null=True)
+    redirect_permanent = models.BooleanField(default=False)
+    publish_on = models.DateTimeField(blank=True, null=True)
+    unpublish_on = models.DateTimeField(blank=True, null=True)
+    is_authenticated = models.BooleanField(default=False)
+    is_staff = models.BooleanField(default=False)
+    is_superuser = models.BooleanField(default=False)
+    restricted = models.BooleanField(default=False)
+    # an ancestor changed since the row was computed.
+    stale = models.BooleanField(default=False, db_index=True)
+    # the rules of the URL and each of its ancestors, nearest first, which
+    # are what requests are decided from.
+    rules = models.TextField()
+
+    def __str__(self):
+        return self.path
+
+    class Meta:
+        db_table = 'churlish_effective_rules'
+        unique_together = (('site', 'path'),)
+
+
+# connects the signal handlers which invalidate copies of the rules.
+from . import invalidation  # noqa
+from . import changelog  # noqa
+from . import effective  # noqa
+from . import chains  # noqa
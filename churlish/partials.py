@@ -0,0 +1,91 @@
+"""
+Which partials the middleware runs, and in what order, without needing the
+admin: CHURLISH_PARTIALS may list them as dotted paths, otherwise the URL
+ModelAdmin is asked (if django.contrib.admin is installed and has one
+registered), and failing that the built in order is used.
+
+Nothing here, nor in the middleware, snapshot or models, imports the admin
+or REST framework, so that neither needs installing to serve requests.
+"""
+import logging
+from django.conf import settings
+
+try:
+    from django.utils.module_loading import import_string
+except ImportError:  # pragma: no cover ... Django < 1.7
+    from django.utils.module_loading import import_by_path as import_string
+
+
+logger = logging.getLogger(__name__)
+
+
+# the order the URL ModelAdmin's inlines give them in.
+DEFAULT_PARTIALS = (
+    'churlish.middleware_filters.PublishedRequired',
+    'churlish.middleware_filters.RedirectRequired',
+    'churlish.middleware_filters.UserRoleRequired',
+    'churlish.middleware_filters.GroupRequired',
+    'churlish.middleware_filters.UserRequired',
+)
+ADMIN_APP = 'django.contrib.admin'
+
+
+def admin_installed():
+    return ADMIN_APP in settings.INSTALLED_APPS
+
+
+def get_configured_partials():
+    """
+    The partial classes named by CHURLISH_PARTIALS, or None if it's unset.
+    """
+    paths = getattr(settings, 'CHURLISH_PARTIALS', None)
+    if paths is None:
+        return None
+    return tuple(import_string(x) for x in paths)
+
+
+def get_default_partials():
+    return tuple(import_string(x) for x in DEFAULT_PARTIALS)
+
+
+def get_modeladmin():
+    """
+    The URL ModelAdmin, if the admin is installed and has one registered.
+    """
+    if not admin_installed():
+        return None
+    from django.contrib import admin
+    from .models import URL
+    try:
+        return admin.site._registry[URL]
+    except KeyError:
+        logger.info("The admin site doesn't have a URL ModelAdmin, so the "
+                    "built in partials are used")
+        return None
+
+
+def get_admin_partials(modeladmin):
+    try:
+        tests = modeladmin.get_middlewares()
+    except AttributeError:
+        logger.error("Unable to ask the URL ModelAdmin for partials, "
+                     "because it doesn't implement the `get_middlewares` "
+                     "method", exc_info=1)
+        return None
+    return tuple(x.__class__ for x in tests)
+
+
+def get_relations(partial_classes):
+    """
+    The relations every partial reads from, in order, or None if any of
+    them don't declare their `needs`.
+    """
+    if not partial_classes or not all(hasattr(x, 'needs')
+                                      for x in partial_classes):
+        return None
+    relations = []
+    for partial in partial_classes:
+        for need in partial.needs:
+            if need.relation not in relations:
+                relations.append(need.relation)
+    return tuple(relations)
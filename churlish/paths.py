@@ -0,0 +1,147 @@
+"""
+The one spelling of a path which URLs are saved under and requests are
+looked up by, so that `//a`, `/a` and `/a/` (and, if configured, `/A/`)
+are all the same URL, and the same cache and database key.
+
+A normalised path:
+
+    * starts and ends with a separator, with no empty parts in between,
+    * has any percent-encoded characters decoded, as Django's own
+      `request.path` already is (so it's not decoded again, lest a request
+      for `/%2541/` find the URL `/A/`),
+    * is lower-cased, if CHURLISH_CASE_SENSITIVE_PATHS is False.
+
+The ancestry of each path (every prefix of it, root first) is worked out
+once, and the most recent CHURLISH_PATH_CACHE_SIZE of them are kept.
+"""
+import os
+import threading
+from collections import OrderedDict
+from django.conf import settings
+
+try:
+    from urllib.parse import unquote
+except ImportError:  # pragma: no cover ... Python 2.
+    from urllib import unquote as unquote_bytes
+
+    def unquote(path):
+        return unquote_bytes(path.encode('utf-8')).decode('utf-8',
+                                                           'replace')
+
+
+PATH_SEP = '/'
+MISSING = object()
+
+
+def case_sensitive():
+    return getattr(settings, 'CHURLISH_CASE_SENSITIVE_PATHS', True)
+
+
+def get_cache_size():
+    return getattr(settings, 'CHURLISH_PATH_CACHE_SIZE', 10000)
+
+
+def get_parts(path):
+    return tuple(x for x in path.split(PATH_SEP) if x)
+
+
+def join_parts(parts):
+    if not parts:
+        return PATH_SEP
+    # concatenated, as formatting a byte string with a decoded non-ASCII
+    # part fails on Python 2.
+    return PATH_SEP + PATH_SEP.join(parts) + PATH_SEP
+
+
+class BoundedCache(object):
+    """
+    First in, first out, once it holds `get_cache_size()` items. Reads take
+    no lock (a single dict lookup is atomic), so they don't reorder it;
+    only adding to it, and evicting, do.
+    """
+    __slots__ = ('data', 'lock')
+
+    def __init__(self):
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        return self.data.get(key, MISSING)
+
+    def set(self, key, value):
+        limit = get_cache_size()
+        with self.lock:
+            self.data[key] = value
+            while len(self.data) > limit:
+                self.data.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+
+normalised = BoundedCache()
+# those of paths which were already decoded.
+normalised_decoded = BoundedCache()
+ancestries = BoundedCache()
+
+
+def _normalise(path, decode=True):
+    if decode and '%' in path:
+        path = unquote(path)
+    if not case_sensitive():
+        path = path.lower()
+    return join_parts(get_parts(path))
+
+
+def normalise_path(path, decode=True):
+    """
+    The canonical spelling of `path`; with `decode` False, it has already
+    been decoded.
+    """
+    cache = normalised if decode else normalised_decoded
+    found = cache.get(path)
+    if found is MISSING:
+        found = cache.set(path, _normalise(path, decode=decode))
+    return found
+
+
+def get_request_path(request):
+    """
+    The request's normalised path, worked out once per request.
+    """
+    try:
+        return request._churlish_path
+    except AttributeError:
+        request._churlish_path = normalise_path(request.path, decode=False)
+        return request._churlish_path
+
+
+def get_ancestry(path):
+    """
+    The root, and every prefix of `path` down to and including itself, in
+    that order, as a tuple.
+    """
+    found = ancestries.get(path)
+    if found is MISSING:
+        parts = get_parts(path)
+        found = ancestries.set(path, tuple(
+            join_parts(parts[0:x]) for x in range(len(parts) + 1)))
+    return found
+
+
+def clear_path_caches():
+    normalised.clear()
+    normalised_decoded.clear()
+    ancestries.clear()
+
+
+def _reset_locks_after_fork():
+    normalised.lock = threading.Lock()
+    normalised_decoded.lock = threading.Lock()
+    ancestries.lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_locks_after_fork)
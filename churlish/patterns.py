@@ -0,0 +1,246 @@
+"""
+Matching request paths against URLs whose path is a glob or a regular
+expression, rather than a literal path, all at once.
+
+Like literal URLs, a pattern applies to the paths it matches and to
+everything beneath them, so patterns only need to match a prefix of the
+path; `/*/private/` applies to `/a/private/` and `/a/private/b/`.
+
+Globs are split into path segments and merged into one tree, walked a
+segment at a time, so the cost of matching depends on how deep the path
+is, not on how many patterns there are. Within a segment, `*` matches any
+text and `?` any character, while a `**` segment matches any number of
+segments.
+
+Regular expressions are matched against the start of the path. They're
+combined into one compiled expression per REGEX_CHUNK of them, which saves
+a call per pattern, but each is still tried in turn, so matching them
+takes time in proportion to how many there are. Combining renumbers their
+groups, so backreferences aren't allowed; any saved before they were
+rejected are compiled on their own.
+"""
+import re
+from fnmatch import translate
+from operator import itemgetter
+from collections import namedtuple
+
+
+PATH_SEP = '/'
+GLOB = 'glob'
+REGEX = 'regex'
+WILDCARDS = ('*', '?', '[')
+# Python 2 allows only 100 groups per expression, and each pattern is one
+# of them, along with any of its own.
+REGEX_CHUNK = 50
+
+PatternMatch = namedtuple('PatternMatch', 'key prefix')
+
+# a numbered or named backreference, or a conditional on a group, after an
+# even number of backslashes.
+BACKREFERENCE = re.compile(r'(?:^|[^\\])(?:\\\\)*'
+                           r'(?:\\[1-9]|\(\?P=|\(\?\()')
+
+
+class PatternError(ValueError):
+    pass
+
+
+def split_glob(pattern):
+    if not pattern.startswith(PATH_SEP):
+        raise PatternError("Glob patterns must start with "
+                           "{0!s}".format(PATH_SEP))
+    return tuple(x for x in pattern.split(PATH_SEP) if x)
+
+
+def compile_segment(segment):
+    return re.compile(translate(segment))
+
+
+def has_backreference(pattern):
+    return BACKREFERENCE.search(pattern) is not None
+
+
+def compile_regex(pattern):
+    try:
+        return re.compile(pattern)
+    except re.error as e:
+        raise PatternError("Invalid regular expression: {0!s}".format(e))
+
+
+def validate_pattern(kind, pattern):
+    if kind == GLOB:
+        for segment in split_glob(pattern):
+            if segment != '**' and any(x in segment for x in WILDCARDS):
+                compile_segment(segment)
+        return True
+    if kind == REGEX:
+        compile_regex(pattern)
+        if has_backreference(pattern):
+            raise PatternError("Regular expressions can't refer back to "
+                               "their own groups")
+        return True
+    raise PatternError("Unknown kind of pattern: {0!s}".format(kind))
+
+
+class Node(object):
+    __slots__ = ('children', 'star', 'wild', 'globstar', 'loops', 'keys')
+
+    def __init__(self, loops=False):
+        self.children = {}
+        self.star = None
+        self.wild = []
+        self.globstar = None
+        self.loops = loops
+        self.keys = []
+
+
+def get_prefix(segments, depth):
+    if depth == 0:
+        return PATH_SEP
+    return '{sep}{path}{sep}'.format(sep=PATH_SEP,
+                                     path=PATH_SEP.join(segments[0:depth]))
+
+
+class PatternMatcher(object):
+    """
+    Built from (key, kind, pattern) triples; `match` returns the key of
+    every pattern matching the path, along with the prefix it matched,
+    nearest (ie: longest) first.
+    """
+    __slots__ = ('root', 'regexes', 'count')
+
+    def __init__(self, patterns):
+        self.root = Node()
+        self.regexes = []
+        self.count = 0
+        regexes = []
+        for key, kind, pattern in patterns:
+            if kind == GLOB:
+                self.add_glob(key=key, pattern=pattern)
+            elif kind == REGEX:
+                regexes.append((key, pattern))
+            self.count += 1
+        for key, pattern in regexes:
+            if has_backreference(pattern):
+                self.regexes.append((compile_regex(pattern), {0: key}))
+        regexes = [x for x in regexes if not has_backreference(x[1])]
+        for start in range(0, len(regexes), REGEX_CHUNK):
+            self.add_regexes(regexes[start:start + REGEX_CHUNK])
+
+    def add_glob(self, key, pattern):
+        node = self.root
+        for segment in split_glob(pattern):
+            if segment == '**':
+                if node.globstar is None:
+                    node.globstar = Node(loops=True)
+                node = node.globstar
+            elif segment == '*':
+                if node.star is None:
+                    node.star = Node()
+                node = node.star
+            elif any(x in segment for x in WILDCARDS):
+                child = Node()
+                node.wild.append((compile_segment(segment), child))
+                node = child
+            else:
+                node = node.children.setdefault(segment, Node())
+        node.keys.append(key)
+
+    def add_regexes(self, regexes):
+        """
+        Each regex becomes an optional lookahead in one expression, so a
+        single match tries them all, capturing the prefix each matched.
+        """
+        names = {}
+        parts = []
+        for index, (key, pattern) in enumerate(regexes):
+            name = 'p{0:d}'.format(index)
+            names[name] = key
+            parts.append('(?:(?=(?P<{name!s}>{pattern!s})))?'.format(
+                name=name, pattern=pattern))
+        try:
+            combined = re.compile(''.join(parts))
+        except (re.error, AssertionError):
+            # eg: the patterns' own named groups clash, or too many groups.
+            for key, pattern in regexes:
+                self.regexes.append((compile_regex(pattern), {0: key}))
+            return None
+        self.regexes.append((combined, names))
+        return None
+
+    def closure(self, nodes):
+        states = {}
+        pending = list(nodes)
+        while pending:
+            node = pending.pop()
+            if id(node) in states:
+                continue
+            states[id(node)] = node
+            # `**` may match no segments at all.
+            if node.globstar is not None:
+                pending.append(node.globstar)
+        return tuple(states.values())
+
+    def match_globs(self, path, found):
+        segments = tuple(x for x in path.split(PATH_SEP) if x)
+        states = self.closure((self.root,))
+        depth = 0
+        while states:
+            for node in states:
+                for key in node.keys:
+                    found[key] = max(found.get(key, 0), depth)
+            if depth == len(segments):
+                break
+            segment = segments[depth]
+            following = []
+            for node in states:
+                child = node.children.get(segment)
+                if child is not None:
+                    following.append(child)
+                if node.star is not None:
+                    following.append(node.star)
+                for compiled, child in node.wild:
+                    if compiled.match(segment):
+                        following.append(child)
+                if node.loops:
+                    following.append(node)
+            states = self.closure(following)
+            depth += 1
+        return segments
+
+    def match(self, path):
+        if not self.count:
+            return ()
+        found = {}
+        segments = self.match_globs(path=path, found=found)
+        matches = [PatternMatch(key=key, prefix=get_prefix(segments, depth))
+                   for key, depth in found.items()]
+        for compiled, names in self.regexes:
+            matched = compiled.match(path)
+            if matched is None:
+                continue
+            for group, key in names.items():
+                prefix = matched.group(group)
+                if prefix is not None:
+                    matches.append(PatternMatch(key=key, prefix=prefix))
+        matches.sort(key=lambda x: len(x.prefix), reverse=True)
+        return tuple(matches)
+
+    def __len__(self):
+        return self.count
+
+
+def merge_ancestry(rows, matches):
+    """
+    Interleaves literal URLs (or their RuleSets), nearest first, with the
+    rows for matched patterns, given as (PatternMatch, row) pairs, so that
+    a pattern ranks as if it were a literal URL for the prefix it matched.
+    A literal URL comes first where they're equally near.
+    """
+    if not matches:
+        return rows
+    ranked = [(len(x.path), x) for x in rows]
+    ranked.extend((len(match.prefix), row) for match, row in matches)
+    # sorting is stable, even in reverse.
+    ranked.sort(key=itemgetter(0), reverse=True)
+    return tuple(x[1] for x in ranked)
@@ -0,0 +1,246 @@
+"""
+Opt-in capture of slow (or randomly sampled) middleware evaluations.
+
+With CHURLISH_PROFILE_THRESHOLD (milliseconds) set, every evaluation is
+timed, which costs next to nothing. One taking longer than the threshold
+marks its path, and the next evaluation of that path runs under cProfile
+with its SQL logged, and is written to CHURLISH_PROFILE_DIR if it's slow
+again. With CHURLISH_PROFILE_SAMPLE_RATE (0 to 1) set, that proportion of
+requests are profiled and written regardless of how long they took.
+
+Only the newest CHURLISH_PROFILE_KEEP captures are kept, and the
+``churlish_profiles`` management command lists & summarises them.
+"""
+import os
+import json
+import random
+import socket
+import logging
+import pstats
+import tempfile
+import threading
+from cProfile import Profile
+from time import time
+from timeit import default_timer
+from django.conf import settings
+from .querycount import QueryCounter
+from .paths import BoundedCache
+
+try:
+    from cStringIO import StringIO
+except ImportError:  # pragma: no cover ... Python 3.
+    from io import StringIO
+
+
+logger = logging.getLogger(__name__)
+
+CAPTURE_SUFFIX = '.json'
+STATS_SUFFIX = '.prof'
+
+# the paths whose last evaluation was slow, to profile the next one of.
+flagged = BoundedCache()
+
+
+def get_profile_dir():
+    default = os.path.join(tempfile.gettempdir(), 'churlish-profiles')
+    return getattr(settings, 'CHURLISH_PROFILE_DIR', default)
+
+
+def get_threshold():
+    threshold = getattr(settings, 'CHURLISH_PROFILE_THRESHOLD', None)
+    if threshold is None:
+        return None
+    return threshold / 1000.0
+
+
+def get_sample_rate():
+    return getattr(settings, 'CHURLISH_PROFILE_SAMPLE_RATE', 0)
+
+
+def get_keep():
+    return getattr(settings, 'CHURLISH_PROFILE_KEEP', 100)
+
+
+class NullCapture(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return None
+
+
+class NullProfiler(object):
+    __slots__ = ()
+    _capture = NullCapture()
+
+    def capture(self, request):
+        return self._capture
+
+
+NULL_PROFILER = NullProfiler()
+
+
+class Timer(object):
+    """
+    Only times the evaluation, flagging its path to be profiled next time
+    if it was slow.
+    """
+    __slots__ = ('profiler', 'request', 'started')
+
+    def __init__(self, profiler, request):
+        self.profiler = profiler
+        self.request = request
+
+    def __enter__(self):
+        self.started = default_timer()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if default_timer() - self.started >= self.profiler.threshold:
+            flagged.set(self.request.path, True)
+        return None
+
+
+class Capture(object):
+    __slots__ = ('profiler', 'request', 'sampled', 'profile', 'counter',
+                 'started')
+
+    def __init__(self, profiler, request, sampled):
+        self.profiler = profiler
+        self.request = request
+        self.sampled = sampled
+        self.profile = Profile()
+        self.counter = QueryCounter()
+
+    def __enter__(self):
+        self.counter.__enter__()
+        self.started = default_timer()
+        self.profile.enable()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.profile.disable()
+        duration = default_timer() - self.started
+        self.counter.__exit__(exc_type, exc_value, traceback)
+        threshold = self.profiler.threshold
+        slow = threshold is not None and duration >= threshold
+        if slow or self.sampled:
+            outcome = 'ok' if exc_type is None else exc_type.__name__
+            try:
+                self.profiler.write(request=self.request, duration=duration,
+                                    profile=self.profile,
+                                    queries=self.counter.queries,
+                                    outcome=outcome, slow=slow)
+            except (IOError, OSError):
+                logger.exception("Unable to write churlish profile capture")
+        return None
+
+
+class Profiler(object):
+    __slots__ = ('directory', 'threshold', 'sample_rate', 'keep')
+
+    def __init__(self, directory, threshold, sample_rate, keep):
+        self.directory = directory
+        self.threshold = threshold
+        self.sample_rate = sample_rate
+        self.keep = keep
+
+    def capture(self, request):
+        sampled = (self.sample_rate > 0 and
+                   random.random() < self.sample_rate)
+        if sampled:
+            return Capture(profiler=self, request=request, sampled=True)
+        if self.threshold is None:
+            return NULL_PROFILER.capture(request=request)
+        if flagged.get(request.path) is True:
+            flagged.set(request.path, False)
+            return Capture(profiler=self, request=request, sampled=False)
+        return Timer(profiler=self, request=request)
+
+    def write(self, request, duration, profile, queries, outcome, slow):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        created = time()
+        # sorting by name is sorting by age, across every process (and
+        # every thread of each).
+        name = '{created:017.6f}-{host!s}-{pid:d}-{thread:d}'.format(
+            created=created, host=socket.gethostname(), pid=os.getpid(),
+            thread=threading.current_thread().ident)
+        base = os.path.join(self.directory, name)
+        profile.dump_stats(base + STATS_SUFFIX)
+        data = {
+            'name': name,
+            'created': created,
+            'path': request.path,
+            'method': request.method,
+            'duration': duration,
+            'slow': slow,
+            'outcome': outcome,
+            'queries': [{'sql': x.get('sql'), 'time': x.get('time')}
+                        for x in queries],
+            'stats': format_stats(profile),
+        }
+        temporary = base + CAPTURE_SUFFIX + '.tmp'
+        with open(temporary, 'w') as f:
+            json.dump(data, f, indent=2)
+        os.rename(temporary, base + CAPTURE_SUFFIX)
+        self.prune()
+        return base + CAPTURE_SUFFIX
+
+    def prune(self):
+        names = list_captures(directory=self.directory)
+        for name in names[:-self.keep] if self.keep else names:
+            for suffix in (CAPTURE_SUFFIX, STATS_SUFFIX):
+                try:
+                    os.remove(os.path.join(self.directory, name + suffix))
+                except OSError:
+                    # another process got to it first.
+                    pass
+
+
+def format_stats(profile, limit=30):
+    output = StringIO()
+    stats = pstats.Stats(profile, stream=output)
+    stats.sort_stats('cumulative').print_stats(limit)
+    return output.getvalue()
+
+
+def _reset_lock_after_fork():
+    flagged.lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_lock_after_fork)
+
+
+def get_profiler():
+    threshold = get_threshold()
+    sample_rate = get_sample_rate()
+    if threshold is None and not sample_rate:
+        return NULL_PROFILER
+    return Profiler(directory=get_profile_dir(), threshold=threshold,
+                    sample_rate=sample_rate, keep=get_keep())
+
+
+def list_captures(directory=None):
+    """
+    The names of the captures held, oldest first.
+    """
+    if directory is None:
+        directory = get_profile_dir()
+    try:
+        files = os.listdir(directory)
+    except OSError:
+        return []
+    return sorted(x[:-len(CAPTURE_SUFFIX)] for x in files
+                  if x.endswith(CAPTURE_SUFFIX))
+
+
+def load_capture(name, directory=None):
+    if directory is None:
+        directory = get_profile_dir()
+    path = os.path.join(directory, name + CAPTURE_SUFFIX)
+    with open(path, 'r') as f:
+        return json.load(f)
@@ -0,0 +1,54 @@
+from collections import deque
+from django.db import connections, DEFAULT_DB_ALIAS
+
+
+class QueryCounter(object):
+    """
+    Forces a database connection to log queries, regardless of DEBUG,
+    for the duration of the block, so that the queries issued within it
+    may be counted and inspected afterwards.
+
+    The block logs into a log of its own, which is added to the
+    connection's afterwards, so that nothing is missed once the
+    connection's log is full (from Django 1.8 it keeps only the newest
+    9000).
+    """
+    __slots__ = ('using', 'count', 'queries', 'previous', 'previous_log')
+
+    def __init__(self, using=DEFAULT_DB_ALIAS):
+        self.using = using
+        self.count = 0
+        self.queries = ()
+
+    @property
+    def connection(self):
+        return connections[self.using]
+
+    def __enter__(self):
+        connection = self.connection
+        # Django < 1.8 uses `use_debug_cursor`, later versions use
+        # `force_debug_cursor`; setting both is harmless.
+        self.previous = (getattr(connection, 'use_debug_cursor', None),
+                         getattr(connection, 'force_debug_cursor', False))
+        connection.use_debug_cursor = True
+        connection.force_debug_cursor = True
+        if hasattr(connection, 'queries_log'):
+            self.previous_log = connection.queries_log
+            connection.queries_log = deque(maxlen=self.previous_log.maxlen)
+        else:
+            self.previous_log = connection.queries
+            connection.queries = []
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        connection = self.connection
+        if hasattr(connection, 'queries_log'):
+            self.queries = tuple(connection.queries_log)
+            connection.queries_log = self.previous_log
+        else:
+            self.queries = tuple(connection.queries)
+            connection.queries = self.previous_log
+        self.previous_log.extend(self.queries)
+        self.count = len(self.queries)
+        connection.use_debug_cursor, connection.force_debug_cursor = \
+            self.previous
@@ -0,0 +1,123 @@
+"""
+Redirects for exactly the requested path are found before the URL is even
+resolved, from an in-memory map of every redirect for the site (or the
+snapshot, if that engine is in use), so they cost no queries at all.
+
+Only the rules attached to the requested URL itself can come before its
+redirect, so with the partials in their usual order, the only one to check
+is whether the URL is published. Redirects inherited from further up are
+still handled by ChurlishMiddleware.process_view.
+
+The map is held by each process, and only learns of changes through the
+default cache (or churlish.changelog), so unless CHURLISH_REDIRECT_FAST_PATH
+says otherwise it's only used when that cache is shared between processes,
+or the change log is enabled.
+"""
+from collections import namedtuple
+from django.conf import settings
+from .models import URLRedirect, LITERAL
+from .middleware_filters import (RedirectRequired, PublishedRequired,
+                                 redirect_to)
+from .snapshot import (SnapshotStore, Redirect, Visible, ENGINES,
+                       get_engine_name, get_store, is_visible)
+from .sites import get_site_id
+from .paths import get_request_path
+from .changelog import changelog_enabled
+
+try:
+    from django.utils.timezone import now
+except ImportError:
+    from datetime import datetime
+    now = datetime.now
+
+
+ExactRedirect = namedtuple('ExactRedirect', 'redirect visible')
+# backends whose contents no other process can see.
+LOCAL_CACHES = ('django.core.cache.backends.locmem.LocMemCache',
+                'django.core.cache.backends.dummy.DummyCache')
+
+
+def build_redirects(site_id, paths=None):
+    redirects = {}
+    rows = URLRedirect.objects.filter(url__site=site_id, url__kind=LITERAL)
+    if paths is not None:
+        rows = rows.filter(url__path__in=tuple(paths))
+    rows = rows.values_list(
+        'url__path', 'target', 'permanent', 'final_target',
+        'url__urlvisible__publish_on', 'url__urlvisible__unpublish_on')
+    for path, target, permanent, final_target, publish_on, unpublish_on \
+            in rows.iterator():
+        visible = None
+        if publish_on is not None:
+            visible = Visible(publish_on=publish_on, unpublish_on=unpublish_on)
+        redirects[path] = ExactRedirect(
+            redirect=Redirect(target=final_target or target,
+                              permanent=permanent),
+            visible=visible)
+    return redirects
+
+
+redirects = SnapshotStore(build=build_redirects, name='redirects',
+                          partial=True)
+
+
+def cache_is_shared():
+    default = getattr(settings, 'CACHES', {}).get('default', {})
+    return default.get('BACKEND', LOCAL_CACHES[0]) not in LOCAL_CACHES
+
+
+def fast_path_enabled():
+    """
+    With a cache local to each process, another process's change would
+    never reach this one's map, which would keep sending the old redirect.
+    """
+    enabled = getattr(settings, 'CHURLISH_REDIRECT_FAST_PATH', None)
+    if enabled is None:
+        return changelog_enabled() or cache_is_shared()
+    return enabled
+
+
+def fast_path_applies(partial_classes):
+    """
+    If anything other than PublishedRequired has been ordered before
+    RedirectRequired, the redirect can't be decided ahead of it.
+    """
+    if not partial_classes or RedirectRequired not in partial_classes:
+        return False
+    before = partial_classes[:partial_classes.index(RedirectRequired)]
+    return all(x is PublishedRequired for x in before)
+
+
+def get_redirect_store():
+    """
+    A snapshot of every rule also has every redirect in it, so there's no
+    need to hold both.
+    """
+    if get_engine_name() in ENGINES:
+        return get_store()
+    return redirects
+
+
+def find_redirect(request, snapshot):
+    """
+    The redirect for exactly this path, if there is one and it's published.
+    """
+    found = snapshot.get(get_request_path(request))
+    if found is None or found.redirect is None:
+        return None
+    if found.visible is not None and not is_visible(visible=found.visible,
+                                                    current=now()):
+        return None
+    return found.redirect
+
+
+def respond(request, snapshot=None):
+    if snapshot is None:
+        snapshot = get_redirect_store().get(
+            site_id=get_site_id(request=request))
+    redirect = find_redirect(request=request, snapshot=snapshot)
+    if redirect is None:
+        return None
+    # nothing nearer than this URL exists, so it's the same for everyone.
+    return redirect_to(redirect.target, permanent=redirect.permanent,
+                       cacheable=True)
@@ -0,0 +1,113 @@
+"""
+Sending the reads made for every request to a read replica.
+
+With CHURLISH_READ_DATABASE set to a database alias, the middleware's
+query for the URLs above the request, the same query when checking which
+links are visible, the DRF list views and the `churlish.utils` helpers
+all read from it. Everything else, including the snapshots and caches
+shared between requests (which would otherwise keep whatever stale data
+the replica had), still reads from CHURLISH_WRITE_DATABASE (default:
+the default database).
+
+A session which has just changed a rule reads from the write database for
+CHURLISH_READ_STALENESS seconds afterwards (default: 10), so editors see
+their changes immediately, however far behind the replica is.
+
+That a request changed a rule is held on the request itself, so that
+finishing it in another thread (or finishing another request in between)
+can't lose or misattribute the write.
+"""
+import threading
+from time import time
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models.signals import post_save, post_delete
+from .invalidation import RULE_MODELS
+
+
+SESSION_KEY = 'churlish_rules_written'
+REQUEST_ATTR = '_churlish_writes'
+
+# the Writes of the request being handled.
+writes = threading.local()
+
+
+class Writes(object):
+    __slots__ = ('written',)
+
+    def __init__(self):
+        self.written = None
+
+
+def get_read_database():
+    return getattr(settings, 'CHURLISH_READ_DATABASE', None)
+
+
+def get_write_database():
+    return getattr(settings, 'CHURLISH_WRITE_DATABASE', DEFAULT_DB_ALIAS)
+
+
+def get_staleness():
+    return getattr(settings, 'CHURLISH_READ_STALENESS', 10)
+
+
+def get_read_alias(request=None):
+    """
+    The database to read from for this request; None means the default
+    routing, because no replica is configured.
+    """
+    alias = get_read_database()
+    if alias is None:
+        return None
+    session = getattr(request, 'session', None)
+    if session is not None:
+        written = session.get(SESSION_KEY)
+        if written is not None and time() - written < get_staleness():
+            return get_write_database()
+    return alias
+
+
+def using(queryset, request=None):
+    alias = get_read_alias(request=request)
+    if alias is None:
+        return queryset
+    return queryset.using(alias)
+
+
+def rules_written(sender, instance, **kwargs):
+    tracked = getattr(writes, 'current', None)
+    if tracked is not None:
+        tracked.written = time()
+
+
+def track_writes(request):
+    """
+    Called at the start of a request, so that any rule changed while
+    handling it is noted on it.
+    """
+    tracked = Writes()
+    setattr(request, REQUEST_ATTR, tracked)
+    writes.current = tracked
+    return tracked
+
+
+def remember_writes(request):
+    """
+    Called at the end of a request, to note in the session that it changed
+    a rule, and when.
+    """
+    tracked = getattr(request, REQUEST_ATTR, None)
+    if tracked is None or tracked.written is None:
+        return None
+    written = tracked.written
+    tracked.written = None
+    session = getattr(request, 'session', None)
+    if session is not None:
+        session[SESSION_KEY] = written
+    return written
+
+
+for model in RULE_MODELS:
+    uid = 'churlish_rules_written_{0!s}'.format(model._meta.db_table)
+    post_save.connect(rules_written, sender=model, dispatch_uid=uid)
+    post_delete.connect(rules_written, sender=model, dispatch_uid=uid)
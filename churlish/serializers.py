@@ -32,4 +32,4 @@ class URLSerializer(serializers.HyperlinkedModelSerializer):
     class Meta:
         model = URL
         fields = ['created', 'modified', 'url', 'object_url', 'site', 'path',
-                  'root', 'child', 'descendants', 'ancestors']
+                  'kind', 'root', 'child', 'descendants', 'ancestors']
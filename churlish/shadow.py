@@ -0,0 +1,120 @@
+"""
+Decides a sample of requests with an alternate engine as well as the
+reference one, to prove they agree before switching to it.
+
+With CHURLISH_SHADOW_ENGINE set to 'snapshot', 'index' or 'effective' (and
+CHURLISH_ENGINE left as 'reference'), CHURLISH_SHADOW_SAMPLE_RATE (0 to 1)
+of the requests reaching the partials are also decided by that engine. The
+reference decision is always the one served.
+
+Both decisions are reduced to an Outcome: passing, redirecting (and where
+to), failing (and why), or any other response's status. Mismatches are
+logged as warnings, and with CHURLISH_METRICS enabled the comparisons,
+mismatches, errors and time taken by each side are counted (see
+``churlish_metrics``). Every comparison sends `shadow_compared`.
+
+Anything other than Http404 raised by the alternate engine is logged and
+counted, and never reaches the client.
+"""
+import random
+import logging
+from collections import namedtuple
+from django.conf import settings
+from .snapshot import (SnapshotEngine, PASS, REDIRECT, FAIL, ENGINES,
+                       EFFECTIVE)
+from .signals import shadow_compared
+from .metrics import get_metrics
+
+
+logger = logging.getLogger(__name__)
+
+
+Outcome = namedtuple('Outcome', 'decision status target reason')
+
+# any response other than a redirect, which no built in partial returns.
+RESPOND = 'respond'
+PREFIX = 'shadow.'
+PASSED = Outcome(decision=PASS, status=None, target=None, reason=None)
+# how many queries the alternate engine issued for the request.
+QUERIES_ATTR = '_churlish_shadow_queries'
+
+
+def get_shadow_engine_name():
+    return getattr(settings, 'CHURLISH_SHADOW_ENGINE', None)
+
+
+def get_sample_rate():
+    return getattr(settings, 'CHURLISH_SHADOW_SAMPLE_RATE', 0.01)
+
+
+def get_shadow_engine(partials):
+    """
+    The engine to compare this request's reference decision against, or
+    None if it isn't being shadowed.
+    """
+    name = get_shadow_engine_name()
+    if name not in ENGINES + (EFFECTIVE,):
+        return None
+    rate = get_sample_rate()
+    if rate <= 0 or random.random() >= rate:
+        return None
+    if not SnapshotEngine.supports(partials):
+        return None
+    return SnapshotEngine(partials=partials)
+
+
+def from_response(response):
+    if response is None:
+        return PASSED
+    if response.status_code in (301, 302):
+        return Outcome(decision=REDIRECT, status=response.status_code,
+                       target=response['Location'], reason=None)
+    return Outcome(decision=RESPOND, status=response.status_code,
+                   target=None, reason=None)
+
+
+def from_error(error):
+    return Outcome(decision=FAIL, status=404, target=None,
+                   reason='{0!s}'.format(error))
+
+
+def to_microseconds(duration):
+    return int(duration * 1000000)
+
+
+def record(request, reference, alternate, reference_duration,
+           alternate_duration):
+    """
+    Counts & logs the comparison of the two Outcomes, returning whether
+    they matched.
+    """
+    matched = reference == alternate
+    metrics = get_metrics()
+    metrics.increment(PREFIX + 'compared')
+    metrics.increment(PREFIX + 'reference_us',
+                      to_microseconds(reference_duration))
+    metrics.increment(PREFIX + 'alternate_us',
+                      to_microseconds(alternate_duration))
+    if not matched:
+        metrics.increment(PREFIX + 'mismatched')
+        logger.warning("The {engine!s} engine decided {alternate!r} for "
+                       "{path!s}, but the reference decided "
+                       "{reference!r}".format(
+                           engine=get_shadow_engine_name(),
+                           alternate=alternate, path=request.path,
+                           reference=reference),
+                       extra={'request': request})
+    shadow_compared.send(sender=Outcome, request=request,
+                         reference=reference, alternate=alternate,
+                         reference_duration=reference_duration,
+                         alternate_duration=alternate_duration)
+    return matched
+
+
+def record_error(request):
+    get_metrics().increment(PREFIX + 'errors')
+    logger.exception("The {engine!s} engine was unable to decide "
+                     "{path!s}".format(engine=get_shadow_engine_name(),
+                                       path=request.path),
+                     extra={'request': request})
+    return None
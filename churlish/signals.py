@@ -0,0 +1,13 @@
+from django.dispatch import Signal
+
+
+# sent from ChurlishMiddleware.process_response when instrumentation is
+# enabled, with `timings` being a tuple of churlish.instrumentation.Timing
+evaluation_timed = Signal(providing_args=['request', 'timings'])
+
+# sent from churlish.shadow for every request decided by both the reference
+# and the alternate engine, with each decision as a churlish.shadow.Outcome
+# and how long (in seconds) each took.
+shadow_compared = Signal(providing_args=['request', 'reference', 'alternate',
+                                         'reference_duration',
+                                         'alternate_duration'])
@@ -0,0 +1,62 @@
+"""
+Which Site a request is for.
+
+By default that's always settings.SITE_ID. With CHURLISH_SITE_FROM_HOST =
+True, it's the Site whose domain matches the request's host instead, found
+from a map of every domain held in each process, so that one deployment
+can serve many sites without looking the Site up on every request. The map
+is rebuilt when a Site is saved or deleted, in the same way as snapshots
+of the rules are.
+
+Requests for hosts which don't match any Site fall back to SITE_ID, if it's
+set, otherwise no rules apply to them.
+"""
+from django.conf import settings
+from django.contrib.sites.models import Site
+from .invalidation import HOSTS
+from .snapshot import SnapshotStore
+
+
+def site_from_host_enabled():
+    return getattr(settings, 'CHURLISH_SITE_FROM_HOST', False)
+
+
+def get_default_site_id():
+    return getattr(settings, 'SITE_ID', None)
+
+
+def build_hosts(key):
+    return dict((domain.lower(), pk) for pk, domain
+                in Site.objects.values_list('pk', 'domain').iterator())
+
+
+# Sites aren't in the change log, so the map follows the generation alone.
+hosts = SnapshotStore(build=build_hosts, name='hosts', follows_changes=False)
+
+
+def get_site_id_for_host(host):
+    host_map = hosts.get(site_id=HOSTS)
+    host = host.lower()
+    site_id = host_map.get(host)
+    if site_id is None and ':' in host:
+        # the Site's domain may not include the port, as Django's own
+        # `get_current(request)` allows for.
+        site_id = host_map.get(host.rsplit(':', 1)[0])
+    if site_id is None:
+        return get_default_site_id()
+    return site_id
+
+
+def get_site_id(request):
+    if not site_from_host_enabled():
+        return settings.SITE_ID
+    try:
+        return request._churlish_site_id
+    except AttributeError:
+        site_id = get_site_id_for_host(host=request.get_host())
+        request._churlish_site_id = site_id
+        return site_id
+
+
+def get_all_site_ids():
+    return tuple(Site.objects.values_list('pk', flat=True))
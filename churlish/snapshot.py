@@ -0,0 +1,517 @@
+"""
+An in-memory, per-site copy of every URL and the rules attached to it, from
+which the built in partials can be evaluated without issuing any queries.
+
+Enabled by setting CHURLISH_ENGINE = 'snapshot' (or 'index', to read the
+same data from a file shared between processes; see churlish.index, or
+'effective', to read it from the database a URL at a time; see
+churlish.effective).
+Partials which aren't built in can't be evaluated from a snapshot, so the
+middleware falls back to querying if any others are in use.
+"""
+import os
+import logging
+import threading
+from time import time
+from operator import attrgetter
+from collections import namedtuple
+from django.conf import settings
+from django.http import Http404
+from django.core.exceptions import ObjectDoesNotExist
+from .models import (URL, URLRedirect, URLVisible, SimpleAccessRestriction,
+                     GroupAccessRestriction, UserAccessRestriction, LITERAL)
+from .patterns import PatternMatcher, merge_ancestry
+from .paths import get_ancestry, get_request_path
+from .middleware_filters import (UserRoleRequired, UserRequired,
+                                 GroupRequired, RedirectRequired,
+                                 PublishedRequired, redirect_to,
+                                 is_nearest, is_authenticated)
+from .invalidation import get_generation
+from .changelog import changelog_enabled, feed
+from .metrics import get_metrics
+
+try:
+    from django.utils.timezone import now
+except ImportError:
+    from datetime import datetime
+    now = datetime.now
+
+
+logger = logging.getLogger(__name__)
+
+
+RuleSet = namedtuple('RuleSet', 'pk path modified redirect visible access '
+                                'groups users')
+Redirect = namedtuple('Redirect', 'target permanent')
+Visible = namedtuple('Visible', 'publish_on unpublish_on')
+Access = namedtuple('Access', 'is_authenticated is_staff is_superuser')
+Decision = namedtuple('Decision', 'outcome rules partial')
+
+PASS = 'pass'
+REDIRECT = 'redirect'
+FAIL = 'fail'
+ENGINES = ('snapshot', 'index')
+# decided from the database, a row per request, rather than from memory.
+EFFECTIVE = 'effective'
+
+
+def get_engine_name():
+    return getattr(settings, 'CHURLISH_ENGINE', 'reference')
+
+
+def get_check_interval():
+    """
+    How many seconds a snapshot is used for before asking the cache whether
+    it's still current.
+    """
+    return getattr(settings, 'CHURLISH_SNAPSHOT_CHECK_INTERVAL', 5)
+
+
+def build_rules(site_id, literal=True, paths=None, within=None):
+    """
+    A handful of queries, however many URLs there are.
+
+    Each RuleSet's `modified` is the most recent of the URL's and its
+    rules' modification times. With `literal` False, the RuleSets are for
+    the URLs which are patterns instead, keyed by the pattern. With `paths`,
+    only the RuleSets for those are built, and with `within`, only those
+    for the path and its descendants.
+    """
+    modifications = {}
+
+    def of_kind(queryset, prefix=''):
+        if paths is not None:
+            queryset = queryset.filter(**{
+                '{0!s}path__in'.format(prefix): tuple(paths)})
+        if within is not None:
+            queryset = queryset.filter(**{
+                '{0!s}path__startswith'.format(prefix): within})
+        lookup = '{0!s}kind'.format(prefix)
+        if literal:
+            return queryset.filter(**{lookup: LITERAL})
+        return queryset.exclude(**{lookup: LITERAL})
+
+    def rows_for(model, *fields):
+        rows = of_kind(model.objects.filter(url__site=site_id), 'url__')
+        rows = rows.values_list('url_id', 'modified', *fields)
+        for row in rows.iterator():
+            url_id, modified = row[0:2]
+            modifications[url_id] = max(modified,
+                                        modifications.get(url_id, modified))
+            yield (url_id,) + tuple(row[2:])
+
+    redirects = dict(
+        (url_id, Redirect(target=final_target or target,
+                          permanent=permanent))
+        for url_id, target, permanent, final_target in rows_for(
+            URLRedirect, 'target', 'permanent', 'final_target'))
+    visible = dict(
+        (url_id, Visible(publish_on=publish_on, unpublish_on=unpublish_on))
+        for url_id, publish_on, unpublish_on in rows_for(
+            URLVisible, 'publish_on', 'unpublish_on'))
+    access = dict(
+        (row[0], Access(*row[1:]))
+        for row in rows_for(SimpleAccessRestriction, 'is_authenticated',
+                            'is_staff', 'is_superuser'))
+    groups = {}
+    for url_id, group_id in rows_for(GroupAccessRestriction, 'group_id'):
+        groups.setdefault(url_id, set()).add(group_id)
+    users = {}
+    for url_id, user_id in rows_for(UserAccessRestriction, 'user_id'):
+        users.setdefault(url_id, set()).add(user_id)
+
+    urls = of_kind(URL.objects.filter(site=site_id)).values_list(
+        'pk', 'path', 'modified')
+    empty = frozenset()
+    rules = {}
+    for pk, path, modified in urls.iterator():
+        modified = max(modified, modifications.get(pk, modified))
+        rules[path] = RuleSet(pk=pk, path=path, modified=modified,
+                              redirect=redirects.get(pk),
+                              visible=visible.get(pk),
+                              access=access.get(pk),
+                              groups=frozenset(groups.get(pk, empty)),
+                              users=frozenset(users.get(pk, empty)))
+    return rules
+
+
+def get_related(obj, accessor):
+    try:
+        return getattr(obj, accessor)
+    except ObjectDoesNotExist:
+        return None
+
+
+def get_ruleset(url):
+    """
+    The RuleSet for a URL instance whose rules were already fetched, as
+    the middleware does, so that both can be treated alike.
+    """
+    if isinstance(url, RuleSet):
+        return url
+    redirect = get_related(url, 'urlredirect')
+    visible = get_related(url, 'urlvisible')
+    access = get_related(url, 'simpleaccessrestriction')
+    groups = tuple(url.groupaccessrestriction_set.all())
+    users = tuple(url.useraccessrestriction_set.all())
+    found = [x for x in (redirect, visible, access) if x is not None]
+    found.extend(groups)
+    found.extend(users)
+    modified = max([url.modified] + [x.modified for x in found])
+    if redirect is not None:
+        redirect = Redirect(target=redirect.get_final_target(),
+                            permanent=redirect.permanent)
+    if visible is not None:
+        visible = Visible(publish_on=visible.publish_on,
+                          unpublish_on=visible.unpublish_on)
+    if access is not None:
+        access = Access(is_authenticated=access.is_authenticated,
+                        is_staff=access.is_staff,
+                        is_superuser=access.is_superuser)
+    return RuleSet(pk=url.pk, path=url.path, modified=modified,
+                   redirect=redirect, visible=visible, access=access,
+                   groups=frozenset(x.group_id for x in groups),
+                   users=frozenset(x.user_id for x in users))
+
+
+def get_ancestry_from(lookup, path):
+    """
+    The same rows, in the same order (nearest first), as
+    `URL.get_ancestors(include_self=True)` would return.
+    """
+    found = (lookup(x) for x in get_ancestry(path))
+    return tuple(sorted((x for x in found if x is not None),
+                        key=attrgetter('path'), reverse=True))
+
+
+class Snapshot(object):
+    __slots__ = ('site_id', 'generation', 'rules', 'checked')
+
+    def __init__(self, site_id, generation, rules):
+        self.site_id = site_id
+        self.generation = generation
+        self.rules = rules
+        self.checked = time()
+
+    def get(self, path):
+        return self.rules.get(path)
+
+    def get_ancestry(self, path):
+        return get_ancestry_from(lookup=self.rules.get, path=path)
+
+    def __len__(self):
+        return len(self.rules)
+
+
+class SnapshotStore(object):
+    """
+    Holds the current Snapshot for each site in this process, where `build`
+    is the function called with a site id to get the data to hold, and
+    `name` is what hits & misses are counted against.
+
+    With `partial`, `build` also takes `paths`, and returns a dict of only
+    those, so that changes from churlish.changelog can be applied to a
+    snapshot without rebuilding all of it. With `follows_changes` False,
+    the store is only ever invalidated by the generation in the cache.
+    """
+    __slots__ = ('snapshots', 'lock', 'build', 'name', 'partial',
+                 'follows_changes')
+
+    def __init__(self, build=build_rules, name='snapshot', partial=False,
+                 follows_changes=True):
+        self.snapshots = {}
+        self.lock = threading.Lock()
+        self.build = build
+        self.name = name
+        self.partial = partial
+        self.follows_changes = follows_changes
+        STORES.append(self)
+
+    def peek(self, site_id):
+        """
+        The snapshot for the site, if it can be used without any I/O at all,
+        otherwise None.
+        """
+        snapshot = self.snapshots.get(site_id)
+        if snapshot is None:
+            return None
+        if time() - snapshot.checked >= get_check_interval():
+            return None
+        get_metrics().cache_hit(self.name)
+        return snapshot
+
+    def get(self, site_id):
+        snapshot = self.peek(site_id=site_id)
+        if snapshot is not None:
+            return snapshot
+        if self.follows_changes and changelog_enabled():
+            return self.get_from_changes(site_id=site_id)
+        generation = get_generation(site_id=site_id)
+        snapshot = self.snapshots.get(site_id)
+        if snapshot is not None and snapshot.generation == generation:
+            snapshot.checked = time()
+            get_metrics().cache_hit(self.name)
+            return snapshot
+        get_metrics().cache_miss(self.name)
+        # only one thread per process rebuilds; the rest wait for it.
+        with self.lock:
+            snapshot = self.snapshots.get(site_id)
+            if snapshot is None or snapshot.generation != generation:
+                snapshot = Snapshot(site_id=site_id, generation=generation,
+                                    rules=self.build(site_id))
+                self.snapshots[site_id] = snapshot
+        return snapshot
+
+    def get_from_changes(self, site_id):
+        version = feed.get_version()
+        snapshot = self.snapshots.get(site_id)
+        if snapshot is not None and snapshot.generation == version:
+            snapshot.checked = time()
+            get_metrics().cache_hit(self.name)
+            return snapshot
+        get_metrics().cache_miss(self.name)
+        with self.lock:
+            snapshot = self.snapshots.get(site_id)
+            if snapshot is None or snapshot.generation != version:
+                snapshot = Snapshot(site_id=site_id, generation=version,
+                                    rules=self.apply_changes(
+                                        site_id=site_id, snapshot=snapshot))
+                self.snapshots[site_id] = snapshot
+        return snapshot
+
+    def apply_changes(self, site_id, snapshot):
+        paths = None
+        if snapshot is not None:
+            paths = feed.get_changed_paths(site_id=site_id,
+                                           since=snapshot.generation)
+        if paths is None:
+            return self.build(site_id)
+        if not paths:
+            return snapshot.rules
+        if not self.partial:
+            return self.build(site_id)
+        # a copy, as other threads may be reading the current one.
+        rules = dict(snapshot.rules)
+        for path in paths:
+            rules.pop(path, None)
+        rules.update(self.build(site_id, paths=paths))
+        return rules
+
+    def clear(self):
+        with self.lock:
+            self.snapshots = {}
+
+
+class PatternSet(object):
+    """
+    The URLs for a site which are patterns, along with their rules.
+    """
+    __slots__ = ('matcher', 'rules')
+
+    def __init__(self, matcher, rules):
+        self.matcher = matcher
+        self.rules = rules
+
+    def match(self, path):
+        """
+        (PatternMatch, RuleSet) pairs, nearest first.
+        """
+        return tuple((x, self.rules[x.key])
+                     for x in self.matcher.match(path))
+
+    def __len__(self):
+        return len(self.matcher)
+
+
+def build_patterns(site_id):
+    urls = tuple(URL.objects.filter(site=site_id).exclude(
+        kind=LITERAL).values_list('pk', 'kind', 'path'))
+    if not urls:
+        # most sites have none, so don't go looking for their rules.
+        return PatternSet(matcher=PatternMatcher(()), rules={})
+    rules = dict((x.pk, x) for x in build_rules(site_id=site_id,
+                                                 literal=False).values())
+    # anything added between the queries waits for the next rebuild.
+    matcher = PatternMatcher(x for x in urls if x[0] in rules)
+    return PatternSet(matcher=matcher, rules=rules)
+
+
+STORES = []
+snapshots = SnapshotStore(partial=True)
+patterns = SnapshotStore(build=build_patterns, name='patterns')
+
+
+def _reset_lock_after_fork():
+    # a lock held by another thread when the process forked would never
+    # be released in the child.
+    for store in STORES:
+        store.lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_lock_after_fork)
+
+
+def is_visible(visible, current):
+    if visible.unpublish_on is not None:
+        return (visible.unpublish_on >= current and
+                visible.publish_on <= current)
+    return visible.publish_on <= current
+
+
+def published_status(rules, request, current):
+    if rules.visible is None:
+        return None
+    return is_visible(visible=rules.visible, current=current)
+
+
+def redirect_status(rules, request, current):
+    if rules.redirect is None:
+        return None
+    return True
+
+
+def role_status(rules, request, current):
+    access = rules.access
+    if access is None:
+        return None
+    user = request.user
+    final = []
+    if access.is_authenticated:
+        final.append(is_authenticated(user))
+    if access.is_staff:
+        final.append(bool(user and user.is_staff))
+    if access.is_superuser:
+        final.append(bool(user and user.is_superuser))
+    return all(final)
+
+
+def user_status(rules, request, current):
+    if not rules.users:
+        return None
+    return is_authenticated(request.user) and request.user.pk in rules.users
+
+
+def group_status(rules, request, current):
+    if not rules.groups:
+        return None
+    if not is_authenticated(request.user):
+        return False
+    user_groups = GroupRequired().get_user_groups(request)
+    return len(rules.groups & user_groups) > 0
+
+
+# the in-memory equivalent of each built in partial's `test`
+STATUSES = {
+    PublishedRequired: published_status,
+    RedirectRequired: redirect_status,
+    UserRoleRequired: role_status,
+    UserRequired: user_status,
+    GroupRequired: group_status,
+}
+
+
+class SnapshotEngine(object):
+    """
+    Makes the same decision as running the partials against the URLs
+    would, in the same order, from a Snapshot.
+    """
+    __slots__ = ('statuses',)
+
+    def __init__(self, partials):
+        self.statuses = tuple((partial, STATUSES[partial.__class__])
+                              for partial in partials)
+
+    @classmethod
+    def supports(cls, partials):
+        if partials is None:
+            return False
+        return all(x.__class__ in STATUSES for x in partials)
+
+    def get_ancestry(self, request, snapshot, pattern_set):
+        """
+        `pattern_set` is the `rules` of the site's snapshot from `patterns`.
+        """
+        path = get_request_path(request)
+        return merge_ancestry(snapshot.get_ancestry(path=path),
+                              pattern_set.match(path))
+
+    def needs_preparing(self, rulesets):
+        """
+        Whether deciding may have to ask the database about the user, which
+        is only the case if an access restriction applies.
+        """
+        return any(x.access is not None or x.groups or x.users
+                   for x in rulesets)
+
+    def prepare(self, request, rulesets):
+        """
+        Loads the (lazy) user, and their groups if they'll be needed, so
+        that `decide` does no I/O.
+        """
+        if not is_authenticated(request.user):
+            return None
+        if any(x.groups for x in rulesets):
+            GroupRequired().get_user_groups(request)
+        return None
+
+    def decide(self, request, rulesets):
+        current = now()
+        for rules in rulesets:
+            for partial, status_for in self.statuses:
+                status = status_for(rules, request, current)
+                if status is None:
+                    continue
+                if status is True and isinstance(partial, RedirectRequired):
+                    return Decision(outcome=REDIRECT, rules=rules,
+                                    partial=partial)
+                if status is False:
+                    return Decision(outcome=FAIL, rules=rules,
+                                    partial=partial)
+        return Decision(outcome=PASS, rules=None, partial=None)
+
+    def respond(self, request, decision, view_func):
+        if decision.outcome == REDIRECT:
+            target = decision.rules.redirect
+            return redirect_to(target.target, permanent=target.permanent,
+                               cacheable=is_nearest(request, decision.rules))
+        if decision.outcome == FAIL:
+            # the built in partials only need `obj.path` to raise their
+            # errors, which a RuleSet has.
+            response = decision.partial.error(request=request,
+                                              obj=decision.rules,
+                                              view=view_func)
+            if response is not None:
+                return response
+            raise Http404("Request failed tests for this URL")
+        return None
+
+
+def get_store(name=None):
+    """
+    Where the configured engine (or the one named) gets its Snapshot-like
+    objects from.
+    """
+    if name is None:
+        name = get_engine_name()
+    if name == 'index':
+        from .index import indexes
+        return indexes
+    if name == EFFECTIVE:
+        from .effective import effective
+        return effective
+    return snapshots
+
+
+def get_engine(partials):
+    """
+    The SnapshotEngine, if configured and able to handle the partials in
+    use, otherwise None, meaning the partials should be run as normal.
+    """
+    if get_engine_name() not in ENGINES + (EFFECTIVE,):
+        return None
+    if not SnapshotEngine.supports(partials):
+        logger.debug("Unable to use the snapshot engine, as not every "
+                     "partial can be evaluated from a snapshot")
+        return None
+    return SnapshotEngine(partials=partials)
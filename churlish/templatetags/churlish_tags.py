@@ -0,0 +1,14 @@
+from django import template
+from ..visibility import visible_links
+
+register = template.Library()
+
+
+@register.filter
+def visible_to(links, request):
+    """
+    {% for link in links|visible_to:request %}
+    """
+    if request is None or not links:
+        return links
+    return visible_links(request=request, links=links)
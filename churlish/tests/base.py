@@ -0,0 +1,114 @@
+from django.core.cache import cache
+from django.http import Http404
+from django.contrib.sites.models import Site
+from django.test import TestCase
+from django.test.client import RequestFactory
+from django.contrib.auth.models import AnonymousUser
+from churlish.models import (URL, URLRedirect, URLVisible,
+                             SimpleAccessRestriction, GroupAccessRestriction,
+                             UserAccessRestriction)
+from churlish.middleware import ChurlishMiddleware, clear_runtime_state
+from churlish.snapshot import STORES
+from churlish.tests.urls import ok_view
+
+
+def make_url(path, site=None, redirect=None, permanent=False,
+             published=None, login=False, **kwargs):
+    """
+    A URL at `path`, with whichever of the common rules are asked for.
+    """
+    if site is None:
+        site = Site.objects.get_current()
+    url = URL.objects.create(site=site, path=path, **kwargs)
+    if redirect is not None:
+        URLRedirect.objects.create(url=url, target=redirect,
+                                   permanent=permanent)
+    if published is not None:
+        visible = URLVisible(url=url)
+        visible.is_published = published
+        visible.save()
+    if login:
+        SimpleAccessRestriction.objects.create(url=url, is_authenticated=True)
+    return url
+
+
+def make_tree(depth, prefix='/'):
+    """
+    A URL at every level down to `depth`, returning the deepest path.
+    """
+    path = prefix
+    make_url(path)
+    for level in range(1, depth + 1):
+        path = '{0!s}{1:d}/'.format(path, level)
+        make_url(path)
+    return path
+
+
+def make_rule_mix(user, group):
+    """
+    A URL with each kind of rule, some beneath others, returning the paths
+    worth deciding, including some which aren't configured.
+    """
+    make_url('/', published=True)
+    make_url('/hidden/', published=False)
+    make_url('/moved/', redirect='/', permanent=True)
+    make_url('/found/', redirect='/moved/')
+    make_url('/private/', login=True)
+    make_url('/private/hidden/', published=False)
+    staff = make_url('/staff/')
+    SimpleAccessRestriction.objects.create(url=staff, is_staff=True)
+    GroupAccessRestriction.objects.create(url=make_url('/group/'),
+                                          group=group)
+    UserAccessRestriction.objects.create(url=make_url('/user/'), user=user)
+    return ('/', '/unconfigured/', '/hidden/', '/hidden/below/', '/moved/',
+            '/found/below/', '/private/', '/private/below/',
+            '/private/hidden/', '/staff/', '/group/', '/group/below/',
+            '/user/')
+
+
+class ChurlishTestCase(TestCase):
+    """
+    Every test starts without whatever a previous one discovered, built or
+    cached.
+    """
+    def setUp(self):
+        super(ChurlishTestCase, self).setUp()
+        self.reset()
+        self.factory = RequestFactory()
+
+    def reset(self):
+        cache.clear()
+        clear_runtime_state()
+        for store in STORES:
+            store.clear()
+
+    def get_request(self, path, user=None, **kwargs):
+        request = self.factory.get(path, **kwargs)
+        request.user = user or AnonymousUser()
+        request.session = {}
+        return request
+
+    def outcome(self, path, user=None, **kwargs):
+        """
+        What ChurlishMiddleware decided for `path`: None if it let the
+        request through, 404 if it failed it, or the response's status.
+        """
+        try:
+            response = self.process(path, user=user, **kwargs)
+        except Http404:
+            return 404
+        if response is None:
+            return None
+        return response.status_code
+
+    def process(self, path, user=None, **kwargs):
+        """
+        The response from ChurlishMiddleware for `path`, or None if it let
+        the request through.
+        """
+        request = self.get_request(path, user=user, **kwargs)
+        middleware = ChurlishMiddleware()
+        response = middleware.process_request(request)
+        if response is not None:
+            return response
+        return middleware.process_view(request, ok_view, (), {})
@@ -0,0 +1,3 @@
+"""
+Django < 1.7 only finds the tests of an app with a models module.
+"""
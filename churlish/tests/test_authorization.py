@@ -0,0 +1,63 @@
+from django.contrib.auth.models import User, Group
+from django.http import Http404
+from django.test.utils import override_settings
+from churlish.authorization import get_facts
+from churlish.models import GroupAccessRestriction, UserAccessRestriction
+from churlish.querycount import QueryCounter
+from churlish.tests.base import ChurlishTestCase, make_url
+
+
+@override_settings(CHURLISH_AUTHORIZATION_CACHE=True)
+class AuthorizationCacheTestCase(ChurlishTestCase):
+    def setUp(self):
+        super(AuthorizationCacheTestCase, self).setUp()
+        self.group = Group.objects.create(name='members')
+        self.user = User.objects.create_user(username='member',
+                                             password='member')
+        self.staff = make_url('/staff/')
+        GroupAccessRestriction.objects.create(url=self.staff,
+                                              group=self.group)
+        self.mine = make_url('/mine/')
+        UserAccessRestriction.objects.create(url=self.mine, user=self.user)
+
+    def facts(self, user=None):
+        return get_facts(self.get_request('/', user=user or self.user))
+
+    def test_facts(self):
+        self.user.groups.add(self.group)
+        facts = self.facts()
+        self.assertEqual(facts.groups, frozenset([self.group.pk]))
+        self.assertEqual(facts.user_urls, frozenset([self.mine.pk]))
+        self.assertEqual(facts.group_urls, frozenset([self.staff.pk]))
+
+    def test_cached_between_requests(self):
+        self.facts()
+        with QueryCounter() as counter:
+            self.facts()
+        self.assertEqual(counter.count, 0)
+
+    def test_groups_changed(self):
+        self.assertEqual(self.facts().group_urls, frozenset())
+        self.user.groups.add(self.group)
+        self.assertEqual(self.facts().group_urls, frozenset([self.staff.pk]))
+        self.group.user_set.remove(self.user)
+        self.assertEqual(self.facts().groups, frozenset())
+
+    def test_rules_changed(self):
+        self.facts()
+        other = make_url('/other/')
+        UserAccessRestriction.objects.create(url=other, user=self.user)
+        self.assertEqual(self.facts().user_urls,
+                         frozenset([self.mine.pk, other.pk]))
+
+    def test_not_cached(self):
+        self.assertIsNone(get_facts(self.get_request('/')))
+        with override_settings(CHURLISH_AUTHORIZATION_CACHE=False):
+            self.assertIsNone(self.facts())
+
+    def test_decisions(self):
+        self.assertIsNone(self.process('/mine/', user=self.user))
+        with self.assertRaises(Http404):
+            self.process('/staff/', user=self.user)
+        self.user.groups.add(self.group)
+        self.assertIsNone(self.process('/staff/', user=self.user))
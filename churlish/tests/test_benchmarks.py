@@ -0,0 +1,125 @@
+import random
+from django.contrib.sites.models import Site
+from django.db import connection
+from mock import patch
+from benchmarks import load
+from benchmarks.cases import summarise, bench_process_view, bench_tree_api
+from benchmarks.treegen import (TreeSpec, RuleMix, generate_paths, populate,
+                                sample_by_depth)
+from churlish.models import URL, URLRedirect
+from churlish.tests.base import ChurlishTestCase
+
+
+class TreeGenerationTestCase(ChurlishTestCase):
+    spec = TreeSpec(size=40, depth=3, fanout=3, seed=1)
+
+    def test_paths(self):
+        paths = tuple(generate_paths(self.spec))
+        self.assertEqual(len(paths), 1 + 3 + 9 + 27)
+        self.assertEqual(paths, tuple(generate_paths(self.spec)))
+        existing = frozenset(paths)
+        for path in paths[1:]:
+            parent = path[:path.rstrip('/').rfind('/') + 1]
+            self.assertIn(parent, existing)
+
+    def test_size_is_a_limit(self):
+        spec = self.spec._replace(size=10)
+        self.assertEqual(len(tuple(generate_paths(spec))), 10)
+
+    def test_populate(self):
+        mix = RuleMix(redirect=1, visible=0, access=0, group=0, user=0)
+        tree = populate(site=Site.objects.get_current(), spec=self.spec,
+                        mix=mix)
+        self.assertEqual(URL.objects.count(), 40)
+        self.assertEqual(URLRedirect.objects.count(), 40)
+        self.assertEqual(tree.counts['redirect'], 40)
+        self.assertEqual(tree.counts['user'], 0)
+
+    def test_sample_by_depth(self):
+        paths = tuple(generate_paths(self.spec))
+        sampled = sample_by_depth(paths, per_depth=2, seed=1)
+        self.assertEqual(sampled, sample_by_depth(paths, per_depth=2, seed=1))
+        self.assertEqual(len(sampled[0]), 1)
+        # the chosen paths at depth 2, and an unconfigured one beneath
+        # each of those chosen at depth 1.
+        self.assertEqual(len(sampled[2]), 4)
+        self.assertEqual(len([x for x in sampled[2]
+                              if 'unconfigured' in x]), 2)
+
+
+class BenchmarkCasesTestCase(ChurlishTestCase):
+    def test_summarise(self):
+        summary = summarise([0.004, 0.001, 0.002, 0.003])
+        self.assertEqual(summary['count'], 4)
+        self.assertEqual(summary['min'], 1.0)
+        self.assertEqual(summary['max'], 4.0)
+        self.assertAlmostEqual(summary['mean'], 2.5)
+        self.assertEqual(summarise([]), {})
+
+    def test_cases(self):
+        spec = TreeSpec(size=13, depth=2, fanout=3, seed=1)
+        tree = populate(site=Site.objects.get_current(), spec=spec)
+        sampled = sample_by_depth(tree.paths, per_depth=2, seed=1)
+        results = bench_process_view(sampled, users=tree.users,
+                                     iterations=1)
+        self.assertEqual(sorted(results), ['0:anonymous', '0:authenticated',
+                                           '1:anonymous', '1:authenticated',
+                                           '2:anonymous', '2:authenticated',
+                                           '3:anonymous', '3:authenticated'])
+        for result in results.values():
+            self.assertGreater(result['queries']['max'], 0)
+        results = bench_tree_api(tree.paths[:3], iterations=1)
+        self.assertEqual(results['get_children']['rows'], 9)
+        # as get_descendants includes the URL itself.
+        self.assertEqual(results['get_descendants']['rows'], 21)
+
+    def test_redirects_are_their_own_outcome(self):
+        spec = TreeSpec(size=4, depth=1, fanout=3, seed=1)
+        mix = RuleMix(redirect=1, visible=0, access=0, group=0, user=0)
+        tree = populate(site=Site.objects.get_current(), spec=spec, mix=mix)
+        results = bench_process_view({1: tree.paths[1:]}, users=tree.users,
+                                     iterations=2)
+        self.assertEqual(results['1:anonymous']['outcomes'],
+                         {'redirected': 6})
+
+
+def plain_application(environ, start_response):
+    if 'missing' in environ['PATH_INFO']:
+        status = '404 Not Found'
+    else:
+        status = '200 OK'
+        connection.cursor().execute('SELECT 1')
+    start_response(status, [('Content-Type', 'text/plain')])
+    return [b'ok']
+
+
+class LoadHarnessTestCase(ChurlishTestCase):
+    def test_zipf_favours_the_first_ranks(self):
+        sampler = load.ZipfSampler(items=range(100), exponent=1.2, seed=1)
+        rng = random.Random(1)
+        drawn = [sampler.sample(rng) for _ in range(2000)]
+        counts = sorted((drawn.count(x) for x in set(drawn)), reverse=True)
+        self.assertEqual(drawn.count(sampler.ranked[0]), counts[0])
+        self.assertGreater(counts[0], 10 * counts[len(counts) // 2])
+
+    def test_streams(self):
+        streams = load.zipf_streams(['/', '/a/'], count=10, threads=3,
+                                    exponent=1.0, seed=1)
+        self.assertEqual([len(x) for x in streams], [4, 3, 3])
+        self.assertEqual(streams, load.zipf_streams(['/', '/a/'], count=10,
+                                                    threads=3, exponent=1.0,
+                                                    seed=1))
+        self.assertTrue(set(sum(streams, [])) <=
+                        set(['/', '/page/', '/a/', '/a/page/']))
+
+    def test_replay(self):
+        with patch.object(load, 'get_wsgi_application',
+                          return_value=plain_application):
+            server = load.LoadServer()
+        with server:
+            results = load.replay(server, [['/', '/missing/'], ['/']])
+        self.assertEqual(results['threads'], 2)
+        self.assertEqual(results['statuses'], {'200': 2, '404': 1})
+        self.assertEqual(results['errors'], 0)
+        self.assertEqual(results['latency_ms']['count'], 3)
+        self.assertAlmostEqual(results['queries_per_request'], 2 / 3.0)
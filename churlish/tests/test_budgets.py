@@ -0,0 +1,100 @@
+from django.contrib.auth.models import User, Group
+from django.test.utils import override_settings
+from churlish.budgets import (QueryBudgetTestMixin, QueryBudgetExceeded,
+                              query_budget)
+from churlish.middleware import RequestURL, RequestTesters
+from churlish.models import (URL, GroupAccessRestriction,
+                             UserAccessRestriction)
+from churlish.tests.base import ChurlishTestCase, make_url, make_tree
+
+
+class QueryBudgetTestCase(QueryBudgetTestMixin, ChurlishTestCase):
+    def setUp(self):
+        super(QueryBudgetTestCase, self).setUp()
+        self.user = User.objects.create_user(username='budget',
+                                             password='budget')
+        self.group = Group.objects.create(name='budget')
+        self.user.groups.add(self.group)
+
+    def restrict_tree(self, depth):
+        """
+        Every level of a tree `depth` deep is restricted to the user and
+        their group, so every partial has something to read at every level.
+        """
+        path = make_tree(depth=depth, prefix='/restricted/')
+        for url in URL.objects.filter(path__startswith='/restricted/'):
+            GroupAccessRestriction.objects.create(url=url, group=self.group)
+            UserAccessRestriction.objects.create(url=url, user=self.user)
+        return path
+
+    def get_relations(self):
+        return len(tuple(RequestTesters().get_relations()))
+
+    def test_exceeding_raises(self):
+        make_url('/')
+        with self.assertRaises(QueryBudgetExceeded):
+            with query_budget('get_url_data'):
+                for _ in range(3):
+                    RequestURL().get_url_data(request=self.get_request('/'))
+
+    def test_get_url_data(self):
+        for depth in (1, 4, 8):
+            path = self.restrict_tree(depth=depth)
+            self.reset()
+            handler = RequestURL(test_collector=RequestTesters())
+            with self.assertWithinQueryBudget('get_url_data',
+                                              relations=self.get_relations()):
+                data = handler.get_url_data(request=self.get_request(path))
+                # the restrictions were prefetched.
+                for url in data.all:
+                    tuple(url.groupaccessrestriction_set.all())
+                    tuple(url.useraccessrestriction_set.all())
+            self.assertEqual(len(data.all), depth + 1)
+            URL.objects.filter(path__startswith='/restricted/').delete()
+
+    def test_process_view(self):
+        for depth in (1, 4, 8):
+            path = self.restrict_tree(depth=depth)
+            self.reset()
+            with self.assertWithinQueryBudget('process_view',
+                                              relations=self.get_relations()):
+                response = self.process(path, user=self.user)
+            self.assertIsNone(response)
+            URL.objects.filter(path__startswith='/restricted/').delete()
+
+    def test_admin_changelist(self):
+        User.objects.create_superuser(username='admin', password='admin',
+                                      email='admin@example.com')
+        self.client.login(username='admin', password='admin')
+        self.restrict_tree(depth=4)
+        for index in range(10):
+            make_url('/page-{0:d}/'.format(index), redirect='/',
+                     published=True, login=True)
+        # the changelist holds itself to its budget when they're enforced.
+        with override_settings(CHURLISH_ENFORCE_QUERY_BUDGETS=True):
+            response = self.client.get('/admin/churlish/url/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_drf_list(self):
+        self.restrict_tree(depth=4)
+        for index in range(20):
+            make_url('/page-{0:d}/'.format(index))
+        # the view holds itself to its budget, leaving out the middleware.
+        with override_settings(CHURLISH_ENFORCE_QUERY_BUDGETS=True):
+            response = self.client.get('/api/urls/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_relative_counts(self):
+        self.restrict_tree(depth=4)
+        make_url('/')
+        make_url('/restricted/*/', kind='glob')
+        urls = tuple(URL.objects.all())
+        expected = [(x.get_ancestor_count(), x.get_descendant_count())
+                    for x in urls]
+        with self.assertNumQueries(2):
+            prefetched = URL.prefetch_relative_counts(urls)
+        with self.assertNumQueries(0):
+            self.assertEqual([(x.get_ancestor_count(),
+                               x.get_descendant_count())
+                              for x in prefetched], expected)
+        self.assertEqual(URL.prefetch_relative_counts(()), ())
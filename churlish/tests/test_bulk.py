@@ -0,0 +1,125 @@
+import json
+from django.contrib.auth.models import User, Group
+from django.contrib.sites.models import Site
+from mock import patch
+from churlish import bulk
+from churlish.models import (URL, URLRedirect, URLVisible,
+                             SimpleAccessRestriction, GroupAccessRestriction,
+                             UserAccessRestriction)
+from churlish.tests.base import ChurlishTestCase, make_url
+
+
+class BulkTestCase(ChurlishTestCase):
+    def setUp(self):
+        super(BulkTestCase, self).setUp()
+        self.site_id = Site.objects.get_current().pk
+        self.group = Group.objects.create(name='bulk')
+        self.user = User.objects.create_user(username='bulk',
+                                             password='bulk')
+
+    def test_create(self):
+        items = [
+            {'path': '/a/',
+             'redirect': {'target': '/b/', 'permanent': True},
+             'visible': {'publish_on': '2015-01-01T00:00:00',
+                         'unpublish_on': None},
+             'access': {'is_authenticated': True},
+             'groups': [self.group.pk], 'users': [self.user.pk]},
+            {'path': '/b/'},
+            {'path': '/c/*', 'kind': 'glob'},
+        ]
+        self.assertEqual(bulk.create(items=items, site_id=self.site_id), 3)
+        self.assertEqual(sorted(URL.objects.values_list('path', 'kind')),
+                         [('/a/', 'literal'), ('/b/', 'literal'),
+                          ('/c/*', 'glob')])
+        self.assertTrue(URLRedirect.objects.get(url__path='/a/').permanent)
+        for model in (URLVisible, SimpleAccessRestriction,
+                      GroupAccessRestriction, UserAccessRestriction):
+            self.assertEqual(
+                list(model.objects.values_list('url__path', flat=True)),
+                ['/a/'])
+
+    def test_every_problem_is_reported(self):
+        make_url('/exists/')
+        items = [{'path': '/ok/'},
+                 {'path': ''},
+                 {'path': '/exists/'},
+                 {'path': '/kind/', 'kind': 'other'},
+                 {'path': '/groups/', 'groups': [self.group.pk, 999]},
+                 {'path': '/date/', 'visible': {'publish_on': 'soon'}},
+                 {'path': '/ok/'},
+                 'not an object']
+        with self.assertRaises(bulk.BulkValidationError) as raised:
+            bulk.create(items=items, site_id=self.site_id)
+        errors = raised.exception.errors
+        self.assertEqual(errors[0], {})
+        self.assertEqual(list(errors[1]), ['path'])
+        self.assertEqual(errors[2], {'path': ["Already exists"]})
+        self.assertIn('kind', errors[3])
+        self.assertEqual(errors[4], {'groups': ["Unknown ids: 999"]})
+        self.assertEqual(list(errors[5]), ['visible'])
+        self.assertEqual(errors[6], {'path': ["Repeats item 0"]})
+        self.assertEqual(list(errors[7]), ['non_field_errors'])
+        self.assertEqual(URL.objects.count(), 1)
+
+    def test_update(self):
+        make_url('/a/', redirect='/b/', login=True)
+        items = [{'path': '/a/', 'redirect': None,
+                  'groups': [self.group.pk]}]
+        self.assertEqual(bulk.update(items=items, site_id=self.site_id), 1)
+        self.assertFalse(URLRedirect.objects.exists())
+        self.assertTrue(SimpleAccessRestriction.objects.exists())
+        self.assertEqual(
+            list(GroupAccessRestriction.objects.values_list('group',
+                                                            flat=True)),
+            [self.group.pk])
+        with self.assertRaises(bulk.BulkValidationError) as raised:
+            bulk.update(items=[{'path': '/none/'}], site_id=self.site_id)
+        self.assertEqual(raised.exception.errors,
+                         [{'path': ["Doesn't exist"]}])
+
+    def test_delete(self):
+        make_url('/a/')
+        make_url('/b/')
+        with self.assertRaises(bulk.BulkValidationError):
+            bulk.delete(paths=['/a/', '/none/'], site_id=self.site_id)
+        self.assertEqual(URL.objects.count(), 2)
+        self.assertEqual(bulk.delete(paths=['/a/', {'path': '/b/'}],
+                                     site_id=self.site_id), 2)
+        self.assertFalse(URL.objects.exists())
+
+    def test_invalidated_once(self):
+        items = [{'path': '/{0:d}/'.format(x), 'access': {}}
+                 for x in range(5)]
+        with patch.object(bulk, 'record_changes') as record:
+            bulk.create(items=items, site_id=self.site_id)
+        self.assertEqual(record.call_count, 1)
+        self.assertEqual(len(record.call_args[1]['paths']), 5)
+
+
+class BulkViewTestCase(ChurlishTestCase):
+    def send(self, method, items):
+        return getattr(self.client, method)(
+            '/api/bulk/', data=json.dumps(items),
+            content_type='application/json')
+
+    def test_writes(self):
+        response = self.send('post', [{'path': '/a/'}, {'path': '/b/'}])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(json.loads(response.content.decode('utf-8')),
+                         {'created': 2})
+        response = self.send('put', [{'path': '/a/', 'access': {}}])
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(SimpleAccessRestriction.objects.exists())
+        response = self.send('delete', ['/a/', '/b/'])
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(URL.objects.exists())
+
+    def test_errors(self):
+        response = self.send('post', [{'path': '/a/'}, {}])
+        self.assertEqual(response.status_code, 400)
+        errors = json.loads(response.content.decode('utf-8'))['errors']
+        self.assertEqual(errors[0], {})
+        self.assertIn('path', errors[1])
+        response = self.send('post', {'path': '/a/'})
+        self.assertEqual(response.status_code, 400)
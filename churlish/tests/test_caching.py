@@ -0,0 +1,65 @@
+from django.contrib.auth.models import User
+from django.contrib.sessions.backends.cache import SessionStore
+from django.http import HttpResponse
+from django.test.utils import override_settings
+from django.utils.cache import patch_vary_headers
+from churlish.middleware import ChurlishMiddleware
+from churlish.tests.base import ChurlishTestCase, make_url
+from churlish.tests.urls import ok_view
+
+
+@override_settings(CHURLISH_CACHE_HEADERS=True)
+class CacheHeadersTestCase(ChurlishTestCase):
+    def setUp(self):
+        super(CacheHeadersTestCase, self).setUp()
+        make_url('/', published=True)
+        make_url('/private/', login=True)
+
+    def respond(self, path, response=None, session=None, user=None):
+        request = self.get_request(path, user=user)
+        if session is not None:
+            request.session = session
+        middleware = ChurlishMiddleware()
+        self.assertIsNone(middleware.process_request(request))
+        self.assertIsNone(middleware.process_view(request, ok_view, (), {}))
+        if response is None:
+            response = HttpResponse('ok')
+        return middleware.process_response(request, response)
+
+    def test_public(self):
+        response = self.respond('/')
+        self.assertIn('public', response['Cache-Control'])
+        self.assertIn('max-age=300', response['Cache-Control'])
+        self.assertTrue(response.has_header('ETag'))
+        self.assertTrue(response.has_header('Last-Modified'))
+
+    def test_restricted(self):
+        user = User.objects.create_user(username='cache', password='cache')
+        response = self.respond('/private/', user=user)
+        self.assertIn('private', response['Cache-Control'])
+        self.assertIn('Cookie', response['Vary'])
+
+    def test_varies_on_cookie(self):
+        response = HttpResponse('ok')
+        patch_vary_headers(response, ('Cookie',))
+        response = self.respond('/', response=response)
+        self.assertIn('private', response['Cache-Control'])
+        self.assertNotIn('public', response['Cache-Control'])
+
+    def test_session_used(self):
+        session = SessionStore()
+        session.get('anything')
+        response = self.respond('/', session=session)
+        self.assertIn('private', response['Cache-Control'])
+        self.assertIn('Cookie', response['Vary'])
+
+    def test_session_unused(self):
+        response = self.respond('/', session=SessionStore())
+        self.assertIn('public', response['Cache-Control'])
+
+    def test_sets_cookie(self):
+        response = HttpResponse('ok')
+        response.set_cookie('flavour', 'oatmeal')
+        response = self.respond('/', response=response)
+        self.assertFalse(response.has_header('Cache-Control'))
+        self.assertTrue(response.has_header('ETag'))
@@ -0,0 +1,113 @@
+from django.contrib.sites.models import Site
+from mock import patch
+from churlish import chains, bulk
+from churlish.models import URL, URLRedirect, URLVisible
+from churlish.tests.base import ChurlishTestCase, make_url
+
+
+class ChainsTestCase(ChurlishTestCase):
+    def setUp(self):
+        super(ChainsTestCase, self).setUp()
+        self.site_id = Site.objects.get_current().pk
+
+    def resolves(self):
+        return patch.object(chains, 'resolve', wraps=chains.resolve)
+
+    def final_target(self, path):
+        return URLRedirect.objects.get(url__path=path).get_final_target()
+
+    def test_collapsed(self):
+        make_url('/c/', redirect='/d/', permanent=True)
+        make_url('/b/', redirect='/c/', permanent=True)
+        make_url('/a/', redirect='/b/', permanent=True)
+        self.assertEqual(self.final_target('/a/'), '/d/')
+        # conditions on a hop stop it being skipped.
+        URLVisible.objects.create(url=URL.objects.get(path='/c/'))
+        self.assertEqual(self.final_target('/a/'), '/c/')
+
+    def test_only_relevant_changes_resolve(self):
+        with self.resolves() as resolve:
+            url = make_url('/a/')
+            URLVisible.objects.create(url=url)
+            url.save()
+        self.assertEqual(resolve.call_count, 0)
+
+        with self.resolves() as resolve:
+            redirect = URLRedirect.objects.create(url=url, target='/b/')
+        self.assertEqual(resolve.call_count, 1)
+
+        with self.resolves() as resolve:
+            redirect.save()
+            url.save()
+            URLVisible.objects.get(url=url).save()
+        self.assertEqual(resolve.call_count, 0)
+
+        with self.resolves() as resolve:
+            redirect.target = '/c/'
+            redirect.save()
+            redirect.permanent = True
+            redirect.save()
+            URLVisible.objects.get(url=url).delete()
+            url.path = '/moved/'
+            url.save()
+        self.assertEqual(resolve.call_count, 4)
+
+    def test_only_chains_through_the_change_resolve(self):
+        make_url('/b/', redirect='/c/')
+        make_url('/a/', redirect='/b/')
+        make_url('/y/', redirect='/z/')
+        make_url('/x/', redirect='/y/')
+        # out of date, as though changed without signals.
+        URLRedirect.objects.filter(url__path='/x/').update(final_target=None)
+        make_url('/c/', redirect='/d/')
+        self.assertEqual(self.final_target('/a/'), '/d/')
+        self.assertEqual(self.final_target('/b/'), '/d/')
+        self.assertEqual(self.final_target('/x/'), '/y/')
+        # whereas resolving the whole site catches it.
+        self.assertEqual(chains.resolve(site_id=self.site_id), ('/x/',))
+        self.assertEqual(self.final_target('/x/'), '/z/')
+
+    def test_moving_a_hop(self):
+        make_url('/c/', redirect='/d/')
+        make_url('/a/', redirect='/c/')
+        make_url('/b/', redirect='/e/')
+        url = URL.objects.get(path='/c/')
+        url.path = '/e/'
+        url.save()
+        # the chain into where it was ends there, and the one into where it
+        # is now goes on through it.
+        self.assertEqual(self.final_target('/a/'), '/c/')
+        self.assertEqual(self.final_target('/b/'), '/d/')
+
+
+class BulkLoopTestCase(ChurlishTestCase):
+    def setUp(self):
+        super(BulkLoopTestCase, self).setUp()
+        self.site_id = Site.objects.get_current().pk
+
+    def test_loop_within_batch(self):
+        items = [{'path': '/a/', 'redirect': {'target': '/b/'}},
+                 {'path': '/c/'},
+                 {'path': '/b/', 'redirect': {'target': '/a/'}}]
+        with self.assertRaises(bulk.BulkValidationError) as raised:
+            bulk.create(items=items, site_id=self.site_id)
+        errors = raised.exception.errors
+        self.assertEqual(errors[1], {})
+        self.assertEqual(errors[0]['redirect'],
+                         ["This redirect would loop: /a/ -> /b/ -> /a/"])
+        self.assertIn('redirect', errors[2])
+        self.assertFalse(URL.objects.exists())
+
+    def test_loop_with_existing(self):
+        make_url('/b/', redirect='/a/')
+        with self.assertRaises(bulk.BulkValidationError):
+            bulk.create(items=[{'path': '/a/', 'redirect': {'target': '/b/'}}],
+                        site_id=self.site_id)
+        self.assertFalse(URL.objects.filter(path='/a/').exists())
+
+    def test_without_loop(self):
+        items = [{'path': '/a/', 'redirect': {'target': '/b/'}},
+                 {'path': '/b/', 'redirect': {'target': '/c/'}}]
+        self.assertEqual(bulk.create(items=items, site_id=self.site_id), 2)
+        self.assertEqual(
+            URLRedirect.objects.get(url__path='/a/').get_final_target(), '/c/')
@@ -0,0 +1,113 @@
+from datetime import timedelta
+from django.contrib.sites.models import Site
+from django.test.utils import override_settings
+from mock import patch
+from churlish import snapshot
+from churlish.changelog import (ChangeFeed, record_changes_for, prune,
+                                get_changed_paths)
+from churlish.models import URL, URLVisible, RuleChange
+from churlish.tests.base import ChurlishTestCase, make_url
+
+try:
+    from django.utils.timezone import now
+except ImportError:
+    from datetime import datetime
+    now = datetime.now
+
+
+@override_settings(CHURLISH_CHANGELOG=True,
+                   CHURLISH_CHANGELOG_POLL_INTERVAL=0)
+class ChangeLogTestCase(ChurlishTestCase):
+    def setUp(self):
+        super(ChangeLogTestCase, self).setUp()
+        self.site = Site.objects.get_current()
+        self.feed = ChangeFeed()
+
+    def changed(self):
+        return sorted(RuleChange.objects.values_list('path', flat=True))
+
+    def test_saving_records(self):
+        url = make_url('/page/', published=True)
+        self.assertEqual(self.changed(), ['/page/', '/page/'])
+        RuleChange.objects.all().delete()
+        url.path = '/moved/'
+        url.save()
+        self.assertEqual(self.changed(), ['/moved/', '/page/'])
+
+    def test_bulk_changes(self):
+        make_url('/a/', published=True)
+        make_url('/b/', published=True)
+        RuleChange.objects.all().delete()
+        queryset = URLVisible.objects.all()
+        record_changes_for(queryset)
+        queryset.update(publish_on=now())
+        self.assertEqual(self.changed(), ['/a/', '/b/'])
+
+    def test_disabled(self):
+        with override_settings(CHURLISH_CHANGELOG=False):
+            make_url('/page/', published=True)
+        self.assertEqual(self.changed(), [])
+
+    def test_feed(self):
+        make_url('/before/')
+        self.assertEqual(self.feed.get_version(), 0)
+        make_url('/a/')
+        make_url('/b/')
+        self.assertEqual(self.feed.get_version(), 1)
+        self.assertEqual(self.feed.get_version(), 1)
+        self.assertEqual(
+            self.feed.get_changed_paths(site_id=self.site.pk, since=0),
+            set(['/a/', '/b/']))
+        self.assertEqual(
+            self.feed.get_changed_paths(site_id=self.site.pk, since=1),
+            set())
+
+    def test_feed_forgets(self):
+        self.feed.get_version()
+        with override_settings(CHURLISH_CHANGELOG_RETAINED=1):
+            make_url('/a/')
+            make_url('/b/')
+            self.feed.get_version()
+        self.assertIsNone(
+            self.feed.get_changed_paths(site_id=self.site.pk, since=0))
+
+    def test_too_many_paths(self):
+        self.feed.get_version()
+        make_url('/a/')
+        make_url('/b/')
+        self.feed.get_version()
+        with override_settings(CHURLISH_CHANGELOG_MAX_PATHS=1):
+            self.assertIsNone(
+                self.feed.get_changed_paths(site_id=self.site.pk, since=0))
+
+    def test_prune(self):
+        make_url('/old/')
+        make_url('/new/')
+        RuleChange.objects.filter(path='/old/').update(
+            created=now() - timedelta(days=10))
+        self.assertEqual(prune(days=7), 1)
+        self.assertEqual(self.changed(), ['/new/'])
+
+    def test_changed_paths_of_a_rule(self):
+        url = make_url('/page/', published=True)
+        self.assertEqual(get_changed_paths(instance=url.urlvisible),
+                         [(self.site.pk, '/page/')])
+
+    @override_settings(CHURLISH_ENGINE='snapshot',
+                       CHURLISH_SNAPSHOT_CHECK_INTERVAL=0)
+    def test_snapshot_rebuilds_changed_paths(self):
+        make_url('/', published=True)
+        make_url('/other/', published=True)
+        store = snapshot.snapshots
+        with patch.object(snapshot, 'feed', self.feed):
+            with patch.object(store, 'build',
+                              wraps=snapshot.build_rules) as build:
+                store.get(site_id=self.site.pk)
+                visible = URLVisible.objects.get(url__path='/other/')
+                visible.is_published = False
+                visible.save()
+                rules = store.get(site_id=self.site.pk)
+        self.assertEqual(build.call_count, 2)
+        self.assertEqual(build.call_args[1], {'paths': set(['/other/'])})
+        self.assertEqual(len(rules), 2)
+        self.assertIsNotNone(rules.get('/other/').visible.unpublish_on)
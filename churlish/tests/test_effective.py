@@ -0,0 +1,117 @@
+from django.db import connection
+from django.db.utils import OperationalError
+from django.test.utils import override_settings, CaptureQueriesContext
+from django.http import Http404
+from django.contrib.auth.models import User, Group
+from django.contrib.sites.models import Site
+from mock import patch
+from churlish import effective
+from churlish.models import URL, URLVisible, EffectiveRules
+from churlish.tests.base import (ChurlishTestCase, make_url, make_tree,
+                                 make_rule_mix)
+
+
+@override_settings(CHURLISH_ENGINE='effective')
+class EffectiveRulesTestCase(ChurlishTestCase):
+    def setUp(self):
+        super(EffectiveRulesTestCase, self).setUp()
+        self.site_id = Site.objects.get_current().pk
+        self.deepest = make_tree(depth=5)
+
+    def unpublish_root(self):
+        visible = URLVisible(url=URL.objects.get(path='/'))
+        visible.is_published = False
+        visible.save()
+
+    def stale(self):
+        return sorted(EffectiveRules.objects.filter(stale=True)
+                      .values_list('path', flat=True))
+
+    def test_computed_while_locked(self):
+        calls = []
+        lock = effective.lock_site
+
+        def locking(site_id):
+            calls.append('lock')
+            return lock(site_id=site_id)
+
+        def build(site_id, within):
+            calls.append('build')
+            return []
+        with patch.object(effective, 'lock_site', side_effect=locking):
+            with patch.object(effective, 'build_effective',
+                              side_effect=build):
+                effective.refresh(site_id=self.site_id, path='/')
+        self.assertEqual(calls, ['lock', 'build'])
+        self.assertEqual(EffectiveRules.objects.count(), 0)
+
+    def test_lock_selects_for_update(self):
+        with patch.object(connection.features, 'has_select_for_update',
+                          True):
+            with CaptureQueriesContext(connection) as context:
+                # which SQLite can't run, but it was asked for.
+                with self.assertRaises(OperationalError):
+                    effective.lock_site(site_id=self.site_id)
+        self.assertIn('FOR UPDATE', context.captured_queries[-1]['sql'])
+
+    def test_below_the_limit(self):
+        self.assertEqual(EffectiveRules.objects.count(), 6)
+        self.unpublish_root()
+        self.assertEqual(self.stale(), [])
+        with self.assertRaises(Http404):
+            self.process(self.deepest)
+
+    @override_settings(CHURLISH_EFFECTIVE_SYNC_LIMIT=2)
+    def test_above_the_limit(self):
+        self.assertIsNone(self.process(self.deepest))
+        self.unpublish_root()
+        self.assertEqual(len(self.stale()), 5)
+        self.assertNotIn('/', self.stale())
+        # decided from the rules themselves, until recomputed.
+        lookup = effective.EffectiveLookup(site_id=self.site_id)
+        chain = lookup.get_ancestry(self.deepest)
+        self.assertEqual(len(chain), 6)
+        self.assertIsNotNone(chain[-1].visible)
+        with self.assertRaises(Http404):
+            self.process(self.deepest)
+        self.assertEqual(effective.refresh_stale(site_id=self.site_id), 5)
+        self.assertEqual(self.stale(), [])
+        with self.assertRaises(Http404):
+            self.process(self.deepest)
+
+    @override_settings(CHURLISH_EFFECTIVE_SYNC_LIMIT=2)
+    def test_new_url_above_the_limit(self):
+        make_url('/1/2/3/other/')
+        self.assertIn('/1/2/3/other/', EffectiveRules.objects.values_list(
+            'path', flat=True))
+
+
+class EffectiveEngineTestCase(ChurlishTestCase):
+    def setUp(self):
+        super(EffectiveEngineTestCase, self).setUp()
+        self.group = Group.objects.create(name='effective')
+        self.user = User.objects.create_user(username='effective',
+                                             password='effective')
+        self.user.groups.add(self.group)
+        self.paths = make_rule_mix(user=self.user, group=self.group)
+
+    def outcomes(self, user):
+        return [self.outcome(x, user=user) for x in self.paths]
+
+    def test_agrees_with_reference(self):
+        effective.rebuild(site_id=Site.objects.get_current().pk)
+        for user in (None, self.user):
+            expected = self.outcomes(user=user)
+            with override_settings(CHURLISH_ENGINE='effective'):
+                self.assertEqual(self.outcomes(user=user), expected)
+
+    @override_settings(CHURLISH_ENGINE='effective')
+    def test_follows_changes(self):
+        effective.rebuild(site_id=Site.objects.get_current().pk)
+        self.assertIsNone(self.outcome('/private/below/', user=self.user))
+        make_url('/private/below/', published=False)
+        self.assertEqual(self.outcome('/private/below/', user=self.user), 404)
+        URL.objects.get(path='/private/').delete()
+        self.assertEqual(self.outcome('/private/below/'), 404)
+        URL.objects.get(path='/private/below/').delete()
+        self.assertIsNone(self.outcome('/private/below/'))
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import io
+import os
+import shutil
+import tempfile
+from django.contrib.sites.models import Site
+from churlish.export import export, is_safe, NGINX, TSV
+from churlish.tests.base import ChurlishTestCase, make_url
+
+
+class ExportTestCase(ChurlishTestCase):
+    def setUp(self):
+        super(ExportTestCase, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.site_id = Site.objects.get_current().pk
+        make_url('/old/', redirect='/new/', permanent=True)
+        make_url('/caf\xe9/', redirect='/caf\xe9-new/')
+        make_url('/hidden/', redirect='/new/', published=False)
+
+    def read(self, name):
+        with io.open(os.path.join(self.directory, name),
+                     encoding='utf-8') as f:
+            return f.read()
+
+    def export(self, output_format):
+        return export(site_id=self.site_id,
+                      path=os.path.join(self.directory, 'static'),
+                      output_format=output_format,
+                      dynamic_path=os.path.join(self.directory, 'dynamic'))
+
+    def test_is_safe(self):
+        self.assertTrue(is_safe('/a/b/'))
+        for value in ('/a b/', '/a;/', '~/a/', '/caf\xe9/'):
+            self.assertFalse(is_safe(value))
+
+    def test_nginx(self):
+        static, dynamic, changed, dynamic_changed = self.export(NGINX)
+        self.assertEqual([x.path for x in static], ['/old/'])
+        self.assertEqual(sorted((x.path, x.reason) for x in dynamic),
+                         [('/caf\xe9/', 'unsafe characters'),
+                          ('/hidden/', 'scheduled')])
+        self.assertTrue(changed and dynamic_changed)
+        content = self.read('static')
+        self.assertIn('    "/old/" "/new/";', content)
+        self.assertIn('    "/old" 301;', content)
+        self.assertIn('/caf\xe9/\t/caf\xe9-new/\t302\tunsafe characters',
+                      self.read('dynamic'))
+        # nothing changed, so nothing is written.
+        self.assertEqual(self.export(NGINX)[2:], (False, False))
+
+    def test_tsv(self):
+        self.export(TSV)
+        self.assertEqual(self.read('static'), '/old/\t/new/\t301\n')
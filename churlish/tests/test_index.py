@@ -0,0 +1,101 @@
+import os
+import shutil
+import tempfile
+from django.contrib.auth.models import User, Group
+from django.contrib.sites.models import Site
+from django.test.utils import override_settings
+from mock import patch
+from churlish import index
+from churlish.snapshot import Snapshot
+from churlish.tests.base import ChurlishTestCase, make_url, make_rule_mix
+
+
+class IndexStoreTestCase(ChurlishTestCase):
+    def setUp(self):
+        super(IndexStoreTestCase, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.site_id = Site.objects.get_current().pk
+        index.indexes.clear()
+        self.addCleanup(index.indexes.clear)
+        make_url('/', redirect='/elsewhere/')
+
+    def get(self, times):
+        stat = patch.object(index.os, 'stat', side_effect=os.stat)
+        error = patch.object(index.logger, 'error')
+        with override_settings(CHURLISH_INDEX_DIR=self.directory):
+            with stat as stats, error as errors:
+                found = [index.indexes.get(site_id=self.site_id)
+                         for _ in range(times)]
+        return found, stats.call_count, errors.call_count
+
+    def test_missing_is_remembered(self):
+        found, stats, errors = self.get(times=5)
+        self.assertTrue(all(isinstance(x, Snapshot) for x in found))
+        self.assertEqual((stats, errors), (1, 1))
+
+    @override_settings(CHURLISH_SNAPSHOT_CHECK_INTERVAL=0)
+    def test_missing_is_logged_once(self):
+        found, stats, errors = self.get(times=5)
+        self.assertEqual((stats, errors), (5, 1))
+
+    @override_settings(CHURLISH_SNAPSHOT_CHECK_INTERVAL=0)
+    def test_found_again(self):
+        self.get(times=2)
+        index.write_index(site_id=self.site_id, directory=self.directory)
+        found, stats, errors = self.get(times=1)
+        self.assertIsInstance(found[0], index.MappedIndex)
+        self.assertEqual(found[0].get('/').redirect.target, '/elsewhere/')
+        os.remove(index.get_index_path(site_id=self.site_id,
+                                       directory=self.directory))
+        found, stats, errors = self.get(times=2)
+        self.assertIsInstance(found[0], Snapshot)
+        self.assertEqual(errors, 1)
+
+
+class IndexEngineTestCase(ChurlishTestCase):
+    def setUp(self):
+        super(IndexEngineTestCase, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        index.indexes.clear()
+        self.addCleanup(index.indexes.clear)
+        self.group = Group.objects.create(name='index')
+        self.user = User.objects.create_user(username='index',
+                                             password='index')
+        self.paths = make_rule_mix(user=self.user, group=self.group)
+
+    def outcomes(self, user):
+        return [self.outcome(x, user=user) for x in self.paths]
+
+    def test_agrees_with_reference(self):
+        self.user.groups.add(self.group)
+        other = User.objects.create_user(username='other', password='other')
+        site_id = Site.objects.get_current().pk
+        index.write_index(site_id=site_id, directory=self.directory)
+        for user in (None, self.user, other):
+            expected = self.outcomes(user=user)
+            with override_settings(CHURLISH_ENGINE='index',
+                                   CHURLISH_INDEX_DIR=self.directory):
+                self.assertIsInstance(index.indexes.get(site_id=site_id),
+                                      index.MappedIndex)
+                self.assertEqual(self.outcomes(user=user), expected)
+
+    def test_records(self):
+        site_id = Site.objects.get_current().pk
+        index.write_index(site_id=site_id, directory=self.directory)
+        mapped = index.MappedIndex(site_id=site_id, path=index.get_index_path(
+            site_id=site_id, directory=self.directory))
+        self.assertEqual(len(mapped), 9)
+        self.assertIsNone(mapped.get('/unconfigured/'))
+        self.assertEqual(mapped.get('/moved/').redirect.target, '/')
+        self.assertTrue(mapped.get('/moved/').redirect.permanent)
+        self.assertEqual(mapped.get('/group/').groups,
+                         frozenset([self.group.pk]))
+        self.assertEqual(mapped.get('/user/').users,
+                         frozenset([self.user.pk]))
+        self.assertTrue(mapped.get('/staff/').access.is_staff)
+        with self.assertRaises(index.IndexFormatError):
+            index.MappedIndex(site_id=site_id + 1,
+                              path=index.get_index_path(
+                                  site_id=site_id, directory=self.directory))
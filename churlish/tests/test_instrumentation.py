@@ -0,0 +1,90 @@
+from django.http import HttpResponse
+from django.test.utils import override_settings
+from churlish.instrumentation import (Instrument, NULL_INSTRUMENT,
+                                      get_instrument, format_server_timing)
+from churlish.middleware import ChurlishMiddleware
+from churlish.signals import evaluation_timed
+from churlish.tests.base import ChurlishTestCase, make_url
+from churlish.tests.urls import ok_view
+
+
+class InstrumentationTestCase(ChurlishTestCase):
+    def setUp(self):
+        super(InstrumentationTestCase, self).setUp()
+        make_url('/', published=True)
+
+    def respond(self, path):
+        request = self.get_request(path)
+        middleware = ChurlishMiddleware()
+        response = (middleware.process_request(request) or
+                    middleware.process_view(request, ok_view, (), {}) or
+                    HttpResponse('ok'))
+        return request, middleware.process_response(request, response)
+
+    def test_disabled(self):
+        request, response = self.respond('/')
+        self.assertIs(get_instrument(request=request), NULL_INSTRUMENT)
+        self.assertFalse(hasattr(request, '_churlish_instrument'))
+        self.assertFalse(response.has_header('Server-Timing'))
+
+    def test_phases(self):
+        sent = []
+
+        def receiver(sender, request, timings, **kwargs):
+            sent.append(timings)
+        evaluation_timed.connect(receiver)
+        self.addCleanup(evaluation_timed.disconnect, receiver)
+        with override_settings(CHURLISH_INSTRUMENTATION=True):
+            request, response = self.respond('/')
+        self.assertEqual(len(sent), 1)
+        names = [x.name for x in sent[0]]
+        self.assertEqual(names[:2], ['exclusions', 'ancestry'])
+        self.assertGreater(len(names), 2)
+        self.assertTrue(all(x.calls >= 1 for x in sent[0]))
+        self.assertFalse(response.has_header('Server-Timing'))
+
+    def test_responses_are_their_own_phase(self):
+        make_url('/moved/', redirect='/')
+        sent = []
+
+        def receiver(sender, request, timings, **kwargs):
+            sent.append(timings)
+        evaluation_timed.connect(receiver)
+        self.addCleanup(evaluation_timed.disconnect, receiver)
+        with override_settings(CHURLISH_INSTRUMENTATION=True,
+                               CHURLISH_REDIRECT_FAST_PATH=False):
+            request, response = self.respond('/moved/')
+        self.assertEqual(response.status_code, 302)
+        timings = dict((x.name, x) for x in sent[0])
+        self.assertEqual(timings['RedirectRequired.success'].calls, 1)
+        self.assertEqual(timings['RedirectRequired'].calls, 1)
+        self.assertNotIn('RedirectRequired.error', timings)
+
+    def test_server_timing(self):
+        with override_settings(CHURLISH_INSTRUMENTATION=True,
+                               CHURLISH_SERVER_TIMING=True):
+            request, response = self.respond('/')
+        self.assertIn('churlish-exclusions;dur=', response['Server-Timing'])
+
+
+class InstrumentTestCase(ChurlishTestCase):
+    def test_accumulates(self):
+        instrument = Instrument()
+        instrument.record(name='a', duration=0.5, queries=1)
+        instrument.record(name='b', duration=0.25, queries=0)
+        instrument.record(name='a', duration=0.5, queries=2)
+        timings = instrument.timings()
+        self.assertEqual([(x.name, x.duration, x.queries, x.calls)
+                          for x in timings],
+                         [('a', 1.0, 3, 2), ('b', 0.25, 0, 1)])
+        self.assertEqual(
+            format_server_timing(timings[1:]),
+            'churlish-b;dur=250.000;desc="1 calls, 0 queries"')
+
+    def test_phase_counts_queries(self):
+        instrument = Instrument()
+        with instrument.phase('lookup'):
+            make_url('/counted/')
+        timing, = instrument.timings()
+        self.assertEqual(timing.calls, 1)
+        self.assertGreater(timing.queries, 0)
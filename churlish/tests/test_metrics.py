@@ -0,0 +1,125 @@
+import json
+import threading
+from django.contrib.auth.models import User
+from django.test.utils import override_settings
+from django.core.management import call_command
+from django.http import Http404
+from churlish.metrics import (MetricsRegistry, get_published, get_report,
+                              get_metrics, registry, NULL_REGISTRY)
+from churlish.tests.base import ChurlishTestCase, make_url
+
+try:
+    from StringIO import StringIO
+except ImportError:  # pragma: no cover ... Python 3.
+    from io import StringIO
+
+
+class ProcessRegistry(MetricsRegistry):
+    """
+    Stands in for the registry of another process.
+    """
+    __slots__ = ('name',)
+
+    def __init__(self, name):
+        super(ProcessRegistry, self).__init__()
+        self.name = name
+
+    @property
+    def key(self):
+        return 'churlish:metrics:test:{0!s}'.format(self.name)
+
+
+class MetricsTestCase(ChurlishTestCase):
+    def test_finished_threads_are_folded(self):
+        metrics = ProcessRegistry(name='threads')
+
+        def count():
+            metrics.increment('passed')
+        for _ in range(20):
+            thread = threading.Thread(target=count)
+            thread.start()
+            thread.join()
+        metrics.increment('passed')
+        self.assertEqual(metrics.snapshot(), {'passed': 21})
+        # only this thread's counters are still kept apart.
+        self.assertEqual(len(metrics._shards), 1)
+        metrics.reset()
+        self.assertEqual(metrics.snapshot(), {})
+
+    def test_every_process_is_published(self):
+        processes = [ProcessRegistry(name=x) for x in range(5)]
+        for index, metrics in enumerate(processes):
+            metrics.increment('passed', index + 1)
+            self.assertTrue(metrics.maybe_publish())
+        counters, count = get_published()
+        self.assertEqual((counters, count), ({'passed': 15}, 5))
+        # publishing again reuses each process's slot.
+        for metrics in processes:
+            metrics._published = 0
+            metrics.maybe_publish()
+        self.assertEqual(sorted(x._slot for x in processes), [1, 2, 3, 4, 5])
+        self.assertEqual(get_published(), ({'passed': 15}, 5))
+
+    @override_settings(CHURLISH_METRICS=True)
+    def test_view(self):
+        User.objects.create_superuser(username='metrics', password='metrics',
+                                      email='metrics@example.com')
+        self.client.login(username='metrics', password='metrics')
+        registry.reset()
+        response = self.client.get('/churlish/metrics/')
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.content.decode('utf-8'))
+        self.assertIn('decisions', data['process'])
+        self.assertIn('processes', data['published'])
+
+
+@override_settings(CHURLISH_METRICS=True)
+class DecisionsTestCase(ChurlishTestCase):
+    def setUp(self):
+        super(DecisionsTestCase, self).setUp()
+        registry.reset()
+        self.addCleanup(registry.reset)
+        make_url('/', published=True)
+        make_url('/hidden/', published=False)
+        make_url('/moved/', redirect='/')
+
+    def test_counted(self):
+        self.process('/admin/')
+        self.process('/')
+        self.process('/below/')
+        self.process('/moved/')
+        with self.assertRaises(Http404):
+            self.process('/hidden/')
+        report = get_report(registry.snapshot())
+        self.assertEqual(report['requests'], 5)
+        self.assertEqual(report['decisions']['excluded'], 1)
+        self.assertEqual(report['decisions']['passed'], 2)
+        self.assertEqual(report['decisions']['failed'], 1)
+        self.assertEqual(report['decisions']['responded'] +
+                         report['decisions']['redirected'], 1)
+        self.assertEqual(sum(report['depth'].values()), 4)
+
+    def test_disabled(self):
+        with override_settings(CHURLISH_METRICS=False):
+            self.assertIs(get_metrics(), NULL_REGISTRY)
+            self.process('/')
+        self.assertEqual(registry.snapshot(), {})
+
+    def test_report(self):
+        report = get_report({'passed': 3, 'cache.snapshot.hits': 3,
+                             'cache.snapshot.misses': 1, 'depth.2': 3})
+        self.assertEqual(report['requests'], 3)
+        self.assertEqual(report['caches'],
+                         {'snapshot': {'hits': 3, 'misses': 1,
+                                       'ratio': 0.75}})
+        self.assertEqual(report['depth'], {2: 3})
+        self.assertIsNone(report['shadow']['reference_ms'])
+
+    def test_command(self):
+        self.process('/')
+        self.assertTrue(registry.maybe_publish())
+        output = StringIO()
+        call_command('churlish_metrics', json=True, stdout=output)
+        report = json.loads(output.getvalue())
+        self.assertEqual(report['processes'], 1)
+        self.assertEqual(report['decisions']['passed'], 1)
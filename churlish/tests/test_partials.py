@@ -0,0 +1,67 @@
+import os
+import sys
+import json
+import subprocess
+from django.contrib import admin
+from django.test.utils import override_settings
+from mock import patch
+from churlish import partials
+# registers the URL ModelAdmin, which Django < 1.7 only does on autodiscovery.
+from churlish import admin as churlish_admin  # noqa
+from churlish.middleware import RequestTesters
+from churlish.middleware_filters import (PublishedRequired, RedirectRequired,
+                                         UserRoleRequired, GroupRequired,
+                                         UserRequired)
+from churlish.models import URL
+from churlish.tests.base import ChurlishTestCase
+
+
+DEFAULTS = (PublishedRequired, RedirectRequired, UserRoleRequired,
+            GroupRequired, UserRequired)
+
+
+class PartialDiscoveryTestCase(ChurlishTestCase):
+    def discover(self):
+        return RequestTesters().get_test_classes()
+
+    def test_from_the_admin(self):
+        self.assertEqual(self.discover(), DEFAULTS)
+        self.assertEqual(partials.get_default_partials(), DEFAULTS)
+
+    @override_settings(CHURLISH_PARTIALS=(
+        'churlish.middleware_filters.RedirectRequired',
+        'churlish.middleware_filters.PublishedRequired'))
+    def test_configured(self):
+        with patch.object(partials, 'get_modeladmin') as get_modeladmin:
+            self.assertEqual(self.discover(),
+                             (RedirectRequired, PublishedRequired))
+        self.assertFalse(get_modeladmin.called)
+
+    def test_without_the_admin(self):
+        with patch.object(partials, 'admin_installed', return_value=False):
+            self.assertIsNone(partials.get_modeladmin())
+            self.assertEqual(self.discover(), DEFAULTS)
+
+    def test_without_a_url_modeladmin(self):
+        with patch.dict(admin.site._registry):
+            del admin.site._registry[URL]
+            self.assertIsNone(partials.get_modeladmin())
+            self.assertEqual(self.discover(), DEFAULTS)
+
+    def test_discovered_once(self):
+        self.discover()
+        with patch.object(partials, 'get_modeladmin') as get_modeladmin:
+            self.discover()
+        self.assertFalse(get_modeladmin.called)
+
+    def test_relations(self):
+        self.assertEqual(len(partials.get_relations(DEFAULTS)), 5)
+        self.assertIsNone(partials.get_relations(()))
+
+
+class ImportsTestCase(ChurlishTestCase):
+    def test_runtime_imports_nothing_optional(self):
+        script = os.path.join(os.path.dirname(os.path.dirname(
+            os.path.dirname(os.path.abspath(__file__)))), 'runimportbench.py')
+        output = subprocess.check_output([sys.executable, script, '--child'])
+        self.assertEqual(json.loads(output.decode('utf-8'))['forbidden'], [])
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+from django.core.management import call_command
+from django.test.utils import override_settings
+from churlish import paths
+from churlish.models import URL
+from churlish.paths import (normalise_path, get_request_path, get_ancestry,
+                            BoundedCache, MISSING)
+from churlish.tests.base import ChurlishTestCase, make_url
+
+try:
+    from StringIO import StringIO
+except ImportError:  # pragma: no cover ... Python 3.
+    from io import StringIO
+
+
+class NormalisePathTestCase(ChurlishTestCase):
+    def test_spellings(self):
+        for path in ('//a', '/a', '/a/', 'a//', '/%61/'):
+            self.assertEqual(normalise_path(path), '/a/')
+        self.assertEqual(normalise_path(''), '/')
+        self.assertEqual(normalise_path('/caf%C3%A9/'), '/caf\xe9/')
+
+    @override_settings(CHURLISH_CASE_SENSITIVE_PATHS=False)
+    def test_case_insensitive(self):
+        self.assertEqual(normalise_path('/A/B'), '/a/b/')
+
+    def test_request_path_is_not_decoded_again(self):
+        # Django has already decoded the %25, leaving %41.
+        request = self.get_request('/%2541/')
+        self.assertEqual(request.path, '/%41/')
+        self.assertEqual(get_request_path(request), '/%41/')
+        # the raw spelling of the same path is, once.
+        self.assertEqual(normalise_path('/%2541/'), '/%41/')
+
+    def test_double_encoded_request(self):
+        make_url('/A/', redirect='/elsewhere/')
+        self.assertEqual(self.process('/A/').status_code, 302)
+        self.assertIsNone(self.process('/%2541/'))
+        self.assertEqual(self.process('/%41/').status_code, 302)
+
+
+class AncestryTestCase(ChurlishTestCase):
+    def test_ancestry(self):
+        self.assertEqual(get_ancestry('/a/b/c/'),
+                         ('/', '/a/', '/a/b/', '/a/b/c/'))
+        self.assertEqual(get_ancestry('/'), ('/',))
+        self.assertEqual(get_ancestry('/caf\xe9/'), ('/', '/caf\xe9/'))
+
+    def test_memoised(self):
+        first = get_ancestry('/a/b/')
+        self.assertIs(get_ancestry('/a/b/'), first)
+        self.assertIs(paths.ancestries.get('/a/b/'), first)
+
+    @override_settings(CHURLISH_PATH_CACHE_SIZE=2)
+    def test_bounded(self):
+        cache = BoundedCache()
+        cache.set('a', 1)
+        cache.set('b', 2)
+        # reading it doesn't keep it; 'a' was still the first in.
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertIs(cache.get('a'), MISSING)
+        self.assertEqual((cache.get('b'), cache.get('c')), (2, 3))
+
+
+class NormalisePathsCommandTestCase(ChurlishTestCase):
+    def test_command(self):
+        make_url('/a/')
+        make_url('/b/')
+        make_url('/c/')
+        URL.objects.filter(path='/b/').update(path='//B')
+        URL.objects.filter(path='/c/').update(path='/a')
+        output, errors = StringIO(), StringIO()
+        with override_settings(CHURLISH_CASE_SENSITIVE_PATHS=False):
+            call_command('churlish_normalise_paths', dry_run=True,
+                         stdout=output, stderr=errors)
+            self.assertIn('1 paths normalised', output.getvalue())
+            self.assertIn('already exists', errors.getvalue())
+            self.assertTrue(URL.objects.filter(path='//B').exists())
+            call_command('churlish_normalise_paths', stdout=StringIO(),
+                         stderr=StringIO())
+        self.assertEqual(sorted(URL.objects.values_list('path', flat=True)),
+                         ['/a', '/a/', '/b/'])
@@ -0,0 +1,54 @@
+from django.core.exceptions import ValidationError
+from churlish.models import URL
+from churlish.patterns import (PatternMatcher, PatternError, GLOB, REGEX,
+                               validate_pattern, has_backreference)
+from churlish.tests.base import ChurlishTestCase
+
+
+class PatternMatcherTestCase(ChurlishTestCase):
+    def keys(self, matcher, path):
+        return [(x.key, x.prefix) for x in matcher.match(path)]
+
+    def test_globs(self):
+        matcher = PatternMatcher([(1, GLOB, '/*/private/'),
+                                  (2, GLOB, '/products/**/drafts/'),
+                                  (3, GLOB, '/a?c/')])
+        self.assertEqual(self.keys(matcher, '/a/private/b/'),
+                         [(1, '/a/private/')])
+        self.assertEqual(self.keys(matcher, '/products/x/y/drafts/'),
+                         [(2, '/products/x/y/drafts/')])
+        self.assertEqual(self.keys(matcher, '/abc/'), [(3, '/abc/')])
+        self.assertEqual(self.keys(matcher, '/abbc/'), [])
+
+    def test_regexes_nearest_first(self):
+        matcher = PatternMatcher([(1, REGEX, r'/a/'),
+                                  (2, REGEX, r'/a/\d+/'),
+                                  (3, REGEX, r'/b/')])
+        self.assertEqual(self.keys(matcher, '/a/10/c/'),
+                         [(2, '/a/10/'), (1, '/a/')])
+
+    def test_many_regexes(self):
+        patterns = [(x, REGEX, '/{0:d}/'.format(x)) for x in range(120)]
+        matcher = PatternMatcher(patterns)
+        self.assertEqual(self.keys(matcher, '/119/a/'), [(119, '/119/')])
+
+    def test_backreferences(self):
+        for pattern in (r'/(a)\1/', r'/(?P<x>a)(?P=x)/', r'/(a)?(?(1)b|c)/'):
+            self.assertTrue(has_backreference(pattern))
+            with self.assertRaises(PatternError):
+                validate_pattern(kind=REGEX, pattern=pattern)
+        for pattern in (r'/a\\1/', r'/(\d+)/'):
+            self.assertFalse(has_backreference(pattern))
+
+    def test_saved_backreference_is_kept_apart(self):
+        # one saved before they were rejected, behind another with a group.
+        matcher = PatternMatcher([(1, REGEX, r'/(b)/'),
+                                  (2, REGEX, r'/(a)\1/')])
+        self.assertEqual(self.keys(matcher, '/aa/c/'), [(2, '/aa/')])
+        self.assertEqual(self.keys(matcher, '/ab/c/'), [])
+
+    def test_url_validation(self):
+        url = URL(site_id=1, path=r'/(a)\1/', kind=REGEX)
+        with self.assertRaises(ValidationError):
+            url.full_clean()
+        URL(site_id=1, path=r'/(a)+/', kind=REGEX).full_clean()
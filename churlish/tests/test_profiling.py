@@ -0,0 +1,118 @@
+import shutil
+import tempfile
+import threading
+from collections import deque
+from django.test.utils import override_settings
+from mock import patch
+from churlish import profiling
+from churlish.profiling import list_captures, load_capture
+from churlish.querycount import QueryCounter
+from churlish.tests.base import ChurlishTestCase, make_url
+
+
+class ProfilingTestCase(ChurlishTestCase):
+    def setUp(self):
+        super(ProfilingTestCase, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        profiling.flagged.clear()
+        self.addCleanup(profiling.flagged.clear)
+        make_url('/', published=True)
+
+    def captures(self):
+        return list_captures(directory=self.directory)
+
+    def test_slow_path_is_profiled_next_time(self):
+        with override_settings(CHURLISH_PROFILE_THRESHOLD=0,
+                               CHURLISH_PROFILE_DIR=self.directory):
+            self.process('/')
+            self.assertEqual(self.captures(), [])
+            self.process('/')
+            self.assertEqual(len(self.captures()), 1)
+            # profiling doesn't flag it again, but the next timing does.
+            self.process('/')
+            self.assertEqual(len(self.captures()), 1)
+            self.process('/')
+            self.assertEqual(len(self.captures()), 2)
+        capture = load_capture(self.captures()[0], directory=self.directory)
+        self.assertEqual(capture['path'], '/')
+        self.assertTrue(capture['slow'])
+        self.assertTrue(capture['queries'])
+
+    def test_fast_requests_log_no_queries(self):
+        with override_settings(CHURLISH_PROFILE_THRESHOLD=60000,
+                               CHURLISH_PROFILE_DIR=self.directory):
+            with patch.object(profiling, 'QueryCounter') as counter:
+                for _ in range(3):
+                    self.process('/')
+        self.assertFalse(counter.called)
+        self.assertEqual(self.captures(), [])
+
+    def test_sampled(self):
+        with override_settings(CHURLISH_PROFILE_SAMPLE_RATE=1,
+                               CHURLISH_PROFILE_DIR=self.directory):
+            self.process('/')
+        capture = load_capture(self.captures()[0], directory=self.directory)
+        self.assertFalse(capture['slow'])
+
+    def test_names_are_unique_per_thread(self):
+        profiler = profiling.Profiler(directory=self.directory,
+                                      threshold=None, sample_rate=1, keep=10)
+        request = self.get_request('/')
+
+        captured = []
+        release = threading.Event()
+
+        def capture():
+            with profiler.capture(request=request):
+                pass
+            captured.append(True)
+            # finished threads' ids may be reused, so both stay alive.
+            release.wait(5)
+        # each thread captures at the same moment.
+        with patch.object(profiling, 'time', return_value=1000.0):
+            threads = [threading.Thread(target=capture) for _ in range(2)]
+            for thread in threads:
+                thread.start()
+            while len(captured) < 2 and all(x.is_alive() for x in threads):
+                release.wait(0.01)
+            release.set()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(len(self.captures()), 2)
+
+
+class FakeConnection(object):
+    """
+    Logs queries as Django >= 1.8 does, keeping only the newest few.
+    """
+    def __init__(self, maxlen):
+        self.queries_log = deque(maxlen=maxlen)
+
+    def execute(self, sql):
+        self.queries_log.append({'sql': sql, 'time': '0.000'})
+
+
+class FakeCounter(QueryCounter):
+    __slots__ = ('fake',)
+
+    @property
+    def connection(self):
+        return self.fake
+
+
+class QueryCounterTestCase(ChurlishTestCase):
+    def test_full_log(self):
+        connection = FakeConnection(maxlen=5)
+        for index in range(5):
+            connection.execute('before {0:d}'.format(index))
+        counter = FakeCounter()
+        counter.fake = connection
+        with counter:
+            connection.execute('inside 1')
+            connection.execute('inside 2')
+        self.assertEqual(counter.count, 2)
+        self.assertEqual([x['sql'] for x in counter.queries],
+                         ['inside 1', 'inside 2'])
+        self.assertEqual(len(connection.queries_log), 5)
+        self.assertEqual(connection.queries_log[-1]['sql'], 'inside 2')
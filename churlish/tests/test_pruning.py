@@ -0,0 +1,56 @@
+from django.contrib.auth.models import User, Group
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from churlish.middleware import RequestURL, RequestTesters, Prefetch
+from churlish.models import (URL, GroupAccessRestriction,
+                             UserAccessRestriction)
+from churlish.tests.base import ChurlishTestCase, make_url
+
+
+class PruneQuerySetTestCase(ChurlishTestCase):
+    def setUp(self):
+        super(PruneQuerySetTestCase, self).setUp()
+        user = User.objects.create_user(username='prune', password='prune')
+        group = Group.objects.create(name='prune')
+        make_url('/', redirect='/elsewhere/', published=True)
+        url = make_url('/pruned/')
+        GroupAccessRestriction.objects.create(url=url, group=group)
+        UserAccessRestriction.objects.create(url=url, user=user)
+
+    def get_url_data(self):
+        handler = RequestURL(test_collector=RequestTesters())
+        self.assertIsNotNone(handler.get_needs(request=None))
+        with CaptureQueriesContext(connection) as context:
+            data = handler.get_url_data(request=self.get_request('/pruned/'))
+        return data, [x['sql'] for x in context.captured_queries]
+
+    def test_only_needed_columns(self):
+        data, queries = self.get_url_data()
+        # the other query on churlish_url builds the pattern matcher.
+        urls = [x for x in queries if 'LEFT OUTER JOIN' in x]
+        self.assertEqual(len(urls), 1)
+        self.assertNotIn('"churlish_url"."created"', urls[0])
+        self.assertIn('"churlish_url_redirect"."target"', urls[0])
+        self.assertNotIn('"churlish_url_redirect"."created"', urls[0])
+        for table in ('churlish_url_accessgroup', 'churlish_url_accessuser'):
+            prefetch = [x for x in queries
+                        if x.split('FROM')[1].strip().startswith(
+                            '"{0!s}"'.format(table))]
+            self.assertEqual(len(prefetch), 1)
+            if Prefetch is None:
+                # before Django 1.7, a prefetch can't be given a queryset.
+                continue
+            self.assertNotIn('"{0!s}"."created"'.format(table), prefetch[0])
+
+    def test_prefetches_are_used(self):
+        data, queries = self.get_url_data()
+        self.assertEqual([x.path for x in data.all], ['/pruned/', '/'])
+        with self.assertNumQueries(0):
+            for url in data.all:
+                tuple(url.groupaccessrestriction_set.all())
+                tuple(url.useraccessrestriction_set.all())
+                url.urlredirect if url.path == '/' else None
+        restricted = data.all[0]
+        self.assertEqual(
+            len(restricted.groupaccessrestriction_set.all()), 1)
+        self.assertIsInstance(restricted, URL)
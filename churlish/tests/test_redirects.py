@@ -0,0 +1,84 @@
+from django.http import Http404
+from django.test.utils import override_settings
+from churlish.models import URLRedirect
+from churlish.querycount import QueryCounter
+from churlish.redirects import fast_path_enabled
+from churlish.tests.base import ChurlishTestCase, make_url
+
+LOCMEM = {'default': {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+SHARED = {'default': {
+    'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+    'LOCATION': '/tmp/churlish-tests'}}
+
+
+class FastPathEnabledTestCase(ChurlishTestCase):
+    @override_settings(CACHES=LOCMEM)
+    def test_off_with_a_cache_per_process(self):
+        self.assertFalse(fast_path_enabled())
+
+    @override_settings(CACHES=LOCMEM, CHURLISH_CHANGELOG=True)
+    def test_on_with_the_changelog(self):
+        self.assertTrue(fast_path_enabled())
+
+    @override_settings(CACHES=SHARED)
+    def test_on_with_a_shared_cache(self):
+        self.assertTrue(fast_path_enabled())
+
+    @override_settings(CACHES=LOCMEM, CHURLISH_REDIRECT_FAST_PATH=True)
+    def test_setting_wins(self):
+        self.assertTrue(fast_path_enabled())
+        with override_settings(CACHES=SHARED,
+                               CHURLISH_REDIRECT_FAST_PATH=False):
+            self.assertFalse(fast_path_enabled())
+
+
+class RedirectTestCase(ChurlishTestCase):
+    def setUp(self):
+        super(RedirectTestCase, self).setUp()
+        make_url('/')
+        make_url('/temporary/', redirect='/a/')
+        make_url('/permanent/', redirect='/b/', permanent=True)
+        make_url('/permanent/below/')
+        make_url('/unpublished/', redirect='/c/', published=False)
+
+    def check_redirects(self):
+        response = self.process('/temporary/')
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response['Location'], '/a/')
+        response = self.process('/permanent/')
+        self.assertEqual(response.status_code, 301)
+        self.assertEqual(response['Location'], '/b/')
+        self.assertIn('max-age=86400', response['Cache-Control'])
+        # inherited, so it may differ between users.
+        response = self.process('/permanent/below/')
+        self.assertEqual(response.status_code, 301)
+        self.assertFalse(response.has_header('Cache-Control'))
+        with self.assertRaises(Http404):
+            self.process('/unpublished/')
+
+    def test_without_fast_path(self):
+        with override_settings(CHURLISH_REDIRECT_FAST_PATH=False):
+            self.check_redirects()
+
+    def test_with_fast_path(self):
+        with override_settings(CHURLISH_REDIRECT_FAST_PATH=True):
+            self.check_redirects()
+            self.process('/temporary/')
+            with QueryCounter() as counter:
+                response = self.process('/temporary/')
+            self.assertEqual(response.status_code, 302)
+            self.assertEqual(counter.count, 0)
+
+    @override_settings(CHURLISH_REDIRECT_FAST_PATH=True)
+    def test_fast_path_sees_changes(self):
+        self.assertEqual(self.process('/temporary/')['Location'], '/a/')
+        redirect = URLRedirect.objects.get(url__path='/temporary/')
+        redirect.target = '/elsewhere/'
+        redirect.save()
+        with override_settings(CHURLISH_SNAPSHOT_CHECK_INTERVAL=0):
+            self.assertEqual(self.process('/temporary/')['Location'],
+                             '/elsewhere/')
+        redirect.delete()
+        with override_settings(CHURLISH_SNAPSHOT_CHECK_INTERVAL=0):
+            self.assertIsNone(self.process('/temporary/'))
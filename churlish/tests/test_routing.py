@@ -0,0 +1,82 @@
+import threading
+from time import time
+from django.http import HttpResponse
+from django.test.utils import override_settings
+from mock import patch
+from churlish.middleware import ChurlishMiddleware
+from churlish.models import URL
+from churlish.routing import SESSION_KEY, get_read_alias, using
+from churlish.tests.base import ChurlishTestCase, make_url
+
+
+class ReadAliasTestCase(ChurlishTestCase):
+    def test_without_replica(self):
+        request = self.get_request('/')
+        self.assertIsNone(get_read_alias(request=request))
+        self.assertEqual(using(URL.objects.all(), request=request).db,
+                         'default')
+
+    @override_settings(CHURLISH_READ_DATABASE='replica',
+                       CHURLISH_WRITE_DATABASE='primary',
+                       CHURLISH_READ_STALENESS=10)
+    def test_staleness(self):
+        request = self.get_request('/')
+        self.assertEqual(using(URL.objects.all(), request=request).db,
+                         'replica')
+        request.session[SESSION_KEY] = time() - 5
+        self.assertEqual(get_read_alias(request=request), 'primary')
+        request.session[SESSION_KEY] = time() - 15
+        self.assertEqual(get_read_alias(request=request), 'replica')
+        self.assertEqual(get_read_alias(request=None), 'replica')
+
+    @override_settings(CHURLISH_READ_DATABASE='replica')
+    def test_middleware_reads_from_replica(self):
+        make_url('/')
+        request = self.get_request('/')
+        with patch('churlish.middleware.using',
+                   side_effect=lambda queryset, request=None: queryset) as u:
+            ChurlishMiddleware().process_view(request, None, (), {})
+        self.assertTrue(u.called)
+        self.assertIs(u.call_args[1]['request'], request)
+
+
+@override_settings(CHURLISH_READ_DATABASE='replica')
+class RememberWritesTestCase(ChurlishTestCase):
+    def start(self, path='/'):
+        request = self.get_request(path)
+        ChurlishMiddleware().process_request(request)
+        return request
+
+    def finish(self, request):
+        return ChurlishMiddleware().process_response(request, HttpResponse())
+
+    def test_write_is_remembered(self):
+        request = self.start()
+        self.assertEqual(get_read_alias(request=request), 'replica')
+        make_url('/written/')
+        self.finish(request)
+        self.assertIn(SESSION_KEY, request.session)
+        self.assertEqual(get_read_alias(request=request), 'default')
+
+    def test_reads_are_not_remembered(self):
+        request = self.start()
+        self.finish(request)
+        self.assertNotIn(SESSION_KEY, request.session)
+
+    def test_finished_in_another_thread(self):
+        # eg: a streamed response, finished by another thread.
+        request = self.start()
+        make_url('/written/')
+        finisher = threading.Thread(target=self.finish, args=(request,))
+        finisher.start()
+        finisher.join()
+        self.assertIn(SESSION_KEY, request.session)
+
+    def test_only_the_writing_request(self):
+        reader = self.start()
+        writer = self.start()
+        make_url('/written/')
+        self.finish(reader)
+        self.finish(writer)
+        self.assertNotIn(SESSION_KEY, reader.session)
+        self.assertIn(SESSION_KEY, writer.session)
@@ -0,0 +1,70 @@
+from django.http import Http404
+from django.test.utils import override_settings
+from mock import patch
+from churlish import shadow
+from churlish.middleware import ChurlishMiddleware
+from churlish.models import URLVisible
+from churlish.signals import shadow_compared
+from churlish.snapshot import SnapshotEngine, PASS, REDIRECT, FAIL
+from churlish.tests.base import ChurlishTestCase, make_url
+from churlish.tests.urls import ok_view
+
+
+@override_settings(CHURLISH_SHADOW_ENGINE='snapshot',
+                   CHURLISH_SHADOW_SAMPLE_RATE=1,
+                   CHURLISH_SNAPSHOT_CHECK_INTERVAL=60)
+class ShadowTestCase(ChurlishTestCase):
+    def setUp(self):
+        super(ShadowTestCase, self).setUp()
+        make_url('/', published=True)
+        make_url('/hidden/', published=False)
+        make_url('/moved/', redirect='/', permanent=True)
+        self.compared = []
+        shadow_compared.connect(self.receiver)
+        self.addCleanup(shadow_compared.disconnect, self.receiver)
+
+    def receiver(self, sender, request, reference, alternate, **kwargs):
+        self.compared.append((reference, alternate))
+
+    def test_agree(self):
+        self.assertIsNone(self.process('/'))
+        with self.assertRaises(Http404):
+            self.process('/hidden/')
+        self.assertEqual(self.process('/moved/').status_code, 301)
+        self.assertEqual([x.decision for x, y in self.compared],
+                         [PASS, FAIL, REDIRECT])
+        for reference, alternate in self.compared:
+            self.assertEqual(reference, alternate)
+
+    def test_mismatch_is_logged(self):
+        self.process('/')
+        # without signals, so the snapshot doesn't learn of it.
+        URLVisible.objects.filter(url__path='/').update(
+            unpublish_on=URLVisible.objects.get(url__path='/').publish_on)
+        with patch.object(shadow.logger, 'warning') as warning:
+            with self.assertRaises(Http404):
+                self.process('/')
+        reference, alternate = self.compared[-1]
+        self.assertEqual(reference.decision, FAIL)
+        self.assertEqual(alternate.decision, PASS)
+        self.assertTrue(warning.called)
+
+    def test_alternate_errors_are_contained(self):
+        with patch.object(SnapshotEngine, 'get_ancestry',
+                          side_effect=ValueError('broken')):
+            with patch.object(shadow.logger, 'exception') as exception:
+                self.assertIsNone(self.process('/'))
+        self.assertTrue(exception.called)
+        self.assertEqual(self.compared, [])
+
+    def test_not_sampled(self):
+        with override_settings(CHURLISH_SHADOW_SAMPLE_RATE=0):
+            self.process('/')
+        with override_settings(CHURLISH_SHADOW_ENGINE=None):
+            self.process('/')
+        self.assertEqual(self.compared, [])
+
+    def test_view_sees_the_reference(self):
+        request = self.get_request('/')
+        ChurlishMiddleware().process_view(request, ok_view, (), {})
+        self.assertEqual([x.path for x in request.churlish.all], ['/'])
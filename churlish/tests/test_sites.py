@@ -0,0 +1,52 @@
+from django.contrib.sites.models import Site
+from django.http import Http404
+from django.test.utils import override_settings
+from churlish.sites import get_site_id
+from churlish.tests.base import ChurlishTestCase, make_url
+
+
+@override_settings(CHURLISH_SITE_FROM_HOST=True,
+                   CHURLISH_SNAPSHOT_CHECK_INTERVAL=0)
+class SiteFromHostTestCase(ChurlishTestCase):
+    def setUp(self):
+        super(SiteFromHostTestCase, self).setUp()
+        self.default = Site.objects.get_current()
+        self.other = Site.objects.create(domain='other.example.com',
+                                         name='other')
+
+    def site_id(self, host):
+        return get_site_id(request=self.get_request('/', HTTP_HOST=host))
+
+    def test_from_host(self):
+        self.assertEqual(self.site_id('other.example.com'), self.other.pk)
+        self.assertEqual(self.site_id('OTHER.example.com'), self.other.pk)
+        self.assertEqual(self.site_id('other.example.com:8000'),
+                         self.other.pk)
+        self.assertEqual(self.site_id(self.default.domain), self.default.pk)
+
+    def test_unknown_host(self):
+        self.assertEqual(self.site_id('unknown.example.com'),
+                         self.default.pk)
+        with override_settings(SITE_ID=None):
+            self.assertIsNone(self.site_id('unknown.example.com'))
+
+    def test_disabled(self):
+        with override_settings(CHURLISH_SITE_FROM_HOST=False):
+            self.assertEqual(self.site_id('other.example.com'),
+                             self.default.pk)
+
+    def test_sites_changed(self):
+        self.assertEqual(self.site_id('new.example.com'), self.default.pk)
+        self.other.domain = 'new.example.com'
+        self.other.save()
+        self.assertEqual(self.site_id('new.example.com'), self.other.pk)
+
+    def test_rules_are_per_site(self):
+        make_url('/hidden/', site=self.other, published=False)
+        self.assertIsNone(self.process('/hidden/'))
+        with self.assertRaises(Http404):
+            self.process('/hidden/', HTTP_HOST='other.example.com')
+        with override_settings(CHURLISH_ENGINE='snapshot'):
+            self.assertIsNone(self.process('/hidden/'))
+            with self.assertRaises(Http404):
+                self.process('/hidden/', HTTP_HOST='other.example.com')
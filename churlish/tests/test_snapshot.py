@@ -0,0 +1,50 @@
+from django.contrib.auth.models import User
+from django.test.utils import override_settings
+from churlish.models import URLVisible
+from churlish.querycount import QueryCounter
+from churlish.snapshot import get_store, snapshots
+from churlish.tests.base import ChurlishTestCase, make_url
+
+
+class SnapshotEngineTestCase(ChurlishTestCase):
+    paths = ('/', '/public/', '/private/', '/private/below/', '/hidden/',
+             '/moved/', '/unconfigured/')
+
+    def setUp(self):
+        super(SnapshotEngineTestCase, self).setUp()
+        make_url('/')
+        make_url('/public/', published=True)
+        make_url('/private/', login=True)
+        make_url('/hidden/', published=False)
+        make_url('/moved/', redirect='/public/', permanent=True)
+        self.user = User.objects.create_user(username='snapshot',
+                                             password='snapshot')
+
+    def outcomes(self, user=None):
+        return [self.outcome(x, user=user) for x in self.paths]
+
+    def test_agrees_with_reference(self):
+        for user in (None, self.user):
+            expected = self.outcomes(user=user)
+            with override_settings(CHURLISH_ENGINE='snapshot'):
+                self.assertEqual(self.outcomes(user=user), expected)
+        self.assertIn(404, expected)
+        self.assertIn(301, expected)
+
+    @override_settings(CHURLISH_ENGINE='snapshot')
+    def test_no_queries_once_built(self):
+        self.assertIs(get_store(), snapshots)
+        self.outcomes()
+        with QueryCounter() as counter:
+            self.outcomes()
+        self.assertEqual(counter.count, 0)
+
+    @override_settings(CHURLISH_ENGINE='snapshot',
+                       CHURLISH_SNAPSHOT_CHECK_INTERVAL=0)
+    def test_sees_changes(self):
+        self.assertIsNone(self.outcome('/public/'))
+        visible = URLVisible.objects.get(url__path='/public/')
+        visible.is_published = False
+        visible.save()
+        self.assertEqual(self.outcome('/public/'), 404)
+
@@ -0,0 +1,87 @@
+from django.contrib.auth.models import User, Group
+from django.template import Template, Context
+from django.test.utils import override_settings
+from churlish.models import URL, GroupAccessRestriction
+from churlish.querycount import QueryCounter
+from churlish.visibility import visible_links
+from churlish.tests.base import ChurlishTestCase, make_url, make_tree
+
+
+class Link(object):
+    def __init__(self, path):
+        self.path = path
+
+    def get_absolute_url(self):
+        return self.path
+
+
+class VisibleLinksTestCase(ChurlishTestCase):
+    def setUp(self):
+        super(VisibleLinksTestCase, self).setUp()
+        make_url('/')
+        make_url('/public/')
+        make_url('/private/', login=True)
+        make_url('/hidden/', published=False)
+        make_url('/moved/', redirect='/public/')
+        self.user = User.objects.create_user(username='links',
+                                             password='links')
+
+    def test_hides_what_the_user_would_be_refused(self):
+        links = ['/public/', '/private/a/', '/hidden/', '/moved/', '/none/']
+        self.assertEqual(visible_links(self.get_request('/'), links),
+                         ['/public/', '/moved/', '/none/'])
+        self.assertEqual(
+            visible_links(self.get_request('/', user=self.user), links),
+            ['/public/', '/private/a/', '/moved/', '/none/'])
+
+    def test_links_may_be_objects_or_urls(self):
+        request = self.get_request('/')
+        links = [Link('/private/'), 'http://testserver/hidden/',
+                 'http://elsewhere.example.com/private/', Link('/public/')]
+        self.assertEqual(visible_links(request, links),
+                         [links[2], links[3]])
+
+    def test_snapshot_engine_agrees(self):
+        links = ['/public/', '/private/a/', '/hidden/', '/moved/']
+        expected = visible_links(self.get_request('/'), links)
+        with override_settings(CHURLISH_ENGINE='snapshot'):
+            self.assertEqual(visible_links(self.get_request('/'), links),
+                             expected)
+
+    def test_template_filter(self):
+        template = Template('{% load churlish_tags %}'
+                            '{% for x in links|visible_to:request %}'
+                            '{{ x }},{% endfor %}')
+        context = Context({'links': ['/public/', '/hidden/'],
+                           'request': self.get_request('/')})
+        self.assertEqual(template.render(context), '/public/,')
+
+    def count_queries(self, links):
+        # discovering the partials is done once per process, not per call.
+        visible_links(self.get_request('/'), ['/'])
+        request = self.get_request('/', user=self.user)
+        with QueryCounter() as counter:
+            visible_links(request, links)
+        return counter.count
+
+    def test_queries_are_constant_with_depth(self):
+        group = Group.objects.create(name='links')
+        self.user.groups.add(group)
+        counts = []
+        for depth in (1, 4, 8):
+            deepest = make_tree(depth=depth, prefix='/deep/')
+            for url in URL.objects.filter(path__startswith='/deep/'):
+                GroupAccessRestriction.objects.create(url=url, group=group)
+            links = [deepest[:deepest.index('/', 6) + 1], deepest,
+                     '/public/', '/private/']
+            counts.append(self.count_queries(links))
+            URL.objects.filter(path__startswith='/deep/').delete()
+        self.assertEqual(len(set(counts)), 1, counts)
+
+    def test_queries_are_constant_with_links(self):
+        for index in range(50):
+            make_url('/many/{0:d}/'.format(index), login=True)
+        few = self.count_queries(['/many/0/'])
+        many = self.count_queries(['/many/{0:d}/'.format(x)
+                                   for x in range(50)])
+        self.assertEqual(few, many)
@@ -0,0 +1,71 @@
+from django.test.utils import override_settings
+from mock import patch
+from churlish import warmup
+from churlish.middleware import RequestURL, runtime_state
+from churlish.querycount import QueryCounter
+from churlish.tests.base import ChurlishTestCase, make_url
+from churlish.warmup import compile_exclusions
+
+try:
+    from django.core.urlresolvers import get_script_prefix, set_script_prefix
+except ImportError:  # pragma: no cover ... Django 2.0+
+    from django.urls import get_script_prefix, set_script_prefix
+
+
+class ScriptPrefixTestCase(ChurlishTestCase):
+    def setUp(self):
+        super(ScriptPrefixTestCase, self).setUp()
+        self.addCleanup(set_script_prefix, get_script_prefix())
+
+    def is_excluded(self, path_info, script_name):
+        # as the handler does, before the middleware is called.
+        set_script_prefix(script_name + '/')
+        request = self.get_request(path_info, SCRIPT_NAME=script_name)
+        return RequestURL().request_is_excluded(request=request)
+
+    def test_warmed_up_without_prefix(self):
+        set_script_prefix('/')
+        compile_exclusions()
+        self.assertTrue(self.is_excluded('/admin/', '/mount'))
+        self.assertFalse(self.is_excluded('/page/', '/mount'))
+        self.assertTrue(self.is_excluded('/admin/', ''))
+        self.assertFalse(self.is_excluded('/mount/admin/', ''))
+
+    def test_forced_prefix(self):
+        set_script_prefix('/')
+        with override_settings(FORCE_SCRIPT_NAME='/forced/'):
+            compile_exclusions()
+        self.assertEqual(get_script_prefix(), '/')
+        self.assertIn(('exclusions', '/forced/'), runtime_state)
+
+
+class WarmupTestCase(ChurlishTestCase):
+    def setUp(self):
+        super(WarmupTestCase, self).setUp()
+        make_url('/', published=True)
+
+    def test_steps(self):
+        steps = warmup.warmup()
+        self.assertEqual([x.name for x in steps],
+                         ['exclusions', 'partials', 'relations', 'needs',
+                          'site', 'patterns:1'])
+        self.assertIn('partials', runtime_state)
+
+    @override_settings(CHURLISH_ENGINE='snapshot')
+    def test_snapshot_built(self):
+        steps = warmup.warmup(site_ids=(1,))
+        self.assertEqual(steps[-1].name, 'snapshot:1')
+        self.assertEqual(steps[-1].detail, 1)
+        with QueryCounter() as counter:
+            self.assertIsNone(self.process('/'))
+        self.assertEqual(counter.count, 0)
+
+    def test_on_ready(self):
+        with patch.object(warmup, 'warmup') as warm:
+            self.assertIsNone(warmup.warmup_on_ready())
+        self.assertFalse(warm.called)
+        with override_settings(CHURLISH_WARMUP=True):
+            with patch.object(warmup, 'warmup', side_effect=ValueError):
+                with patch.object(warmup.logger, 'warning') as warning:
+                    self.assertIsNone(warmup.warmup_on_ready())
+        self.assertTrue(warning.called)
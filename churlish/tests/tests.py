@@ -0,0 +1,24 @@
+from churlish.tests.test_budgets import *  # noqa
+from churlish.tests.test_visibility import *  # noqa
+from churlish.tests.test_redirects import *  # noqa
+from churlish.tests.test_routing import *  # noqa
+from churlish.tests.test_caching import *  # noqa
+from churlish.tests.test_pruning import *  # noqa
+from churlish.tests.test_effective import *  # noqa
+from churlish.tests.test_index import *  # noqa
+from churlish.tests.test_paths import *  # noqa
+from churlish.tests.test_patterns import *  # noqa
+from churlish.tests.test_chains import *  # noqa
+from churlish.tests.test_export import *  # noqa
+from churlish.tests.test_metrics import *  # noqa
+from churlish.tests.test_profiling import *  # noqa
+from churlish.tests.test_warmup import *  # noqa
+from churlish.tests.test_benchmarks import *  # noqa
+from churlish.tests.test_instrumentation import *  # noqa
+from churlish.tests.test_snapshot import *  # noqa
+from churlish.tests.test_sites import *  # noqa
+from churlish.tests.test_authorization import *  # noqa
+from churlish.tests.test_changelog import *  # noqa
+from churlish.tests.test_bulk import *  # noqa
+from churlish.tests.test_partials import *  # noqa
+from churlish.tests.test_shadow import *  # noqa
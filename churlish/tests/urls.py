@@ -0,0 +1,21 @@
+from django.conf.urls import patterns, include, url
+from django.contrib import admin
+from django.http import HttpResponse
+from rest_framework.routers import DefaultRouter
+from churlish.views_drf import URLPageViewSet, URLBulkView
+
+
+def ok_view(request, *args, **kwargs):
+    return HttpResponse('ok')
+
+
+router = DefaultRouter()
+router.register(r'urls', URLPageViewSet, base_name='url')
+
+urlpatterns = patterns('',
+    url(r'^admin/', include(admin.site.urls)),
+    url(r'^api/bulk/$', URLBulkView.as_view()),
+    url(r'^api/', include(router.urls)),
+    url(r'^churlish/', include('churlish.urls')),
+    url(r'^', ok_view),
+)
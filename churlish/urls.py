@@ -0,0 +1,12 @@
+"""
+Include these to serve the metrics view, eg:
+
+    url(r'^churlish/', include('churlish.urls'))
+"""
+from django.conf.urls import url
+from .views import metrics
+
+
+urlpatterns = [
+    url(r'^metrics/$', metrics, name='churlish_metrics'),
+]
@@ -1,16 +1,18 @@
 from .models import URL
+from .routing import using
 
 
-def get_perfect_urlmatch(path):
+def get_perfect_urlmatch(path, request=None):
     try:
-        return URL.objects.get(path__iexact=path)
+        return using(URL.objects.all(), request=request).get(
+            path__iexact=path)
     except URL.DoesNotExist:
         return None
 
 
-def get_imperfect_urlmatch(path):
+def get_imperfect_urlmatch(path, request=None):
     url = URL(path=path)
     url.full_clean()
     possibilities = url.get_path_ancestry(include_self=True)
-    urls = URL.objects.filter(path__in=possibilities)
+    urls = using(URL.objects.filter(path__in=possibilities), request=request)
     return urls.first()  # may return None
@@ -0,0 +1,28 @@
+import json
+from django.http import HttpResponse
+from django.views.decorators.http import require_http_methods
+from django.contrib.admin.views.decorators import staff_member_required
+from .metrics import (registry, get_published, get_report, request_reset,
+                      get_publish_interval)
+
+
+@staff_member_required
+@require_http_methods(['GET', 'POST'])
+def metrics(request):
+    """
+    GET reports the counters for this process, and for every process which
+    has published to the cache; POST resets them all.
+    """
+    if request.method == 'POST':
+        registry.reset()
+        request_reset()
+    counters, processes = get_published()
+    published = get_report(counters)
+    published['processes'] = processes
+    data = {
+        'process': get_report(registry.snapshot()),
+        'published': published,
+        'publish_interval': get_publish_interval(),
+    }
+    return HttpResponse(json.dumps(data, sort_keys=True),
+                        content_type='application/json')
@@ -1,18 +1,68 @@
 from rest_framework import viewsets
 from rest_framework import mixins
+from rest_framework import status
+from rest_framework.views import APIView
+from rest_framework.response import Response
 from rest_framework.settings import api_settings
 from .serializers import URLSerializer
+from .budgets import budgets_enforced, query_budget
+from .routing import using
+from .sites import get_site_id
 from .models import URL
+from . import bulk
 
 
-class URLPageViewSet(viewsets.ModelViewSet):
-    queryset = URL.objects.all()
+def get_data(request):
+    if hasattr(request, 'data'):
+        return request.data
+    return request.DATA  # pragma: no cover ... REST framework < 3
+
+
+class QueryBudgetListMixin(object):
+    def list(self, request, *args, **kwargs):
+        parent = super(QueryBudgetListMixin, self).list
+        if not budgets_enforced():
+            return parent(request, *args, **kwargs)
+        with query_budget('drf_list'):
+            return parent(request, *args, **kwargs)
+
+
+class RelativeCountsListMixin(object):
+    """
+    Counts the ancestors & descendants of a page of URLs all at once, rather
+    than the serializer counting them for each.
+    """
+    def paginate_queryset(self, *args, **kwargs):
+        page = super(RelativeCountsListMixin, self).paginate_queryset(
+            *args, **kwargs)
+        if page is not None and hasattr(page, 'object_list'):
+            page.object_list = URL.prefetch_relative_counts(page.object_list)
+        return page
+
+
+class ReadReplicaListMixin(object):
+    """
+    Lists are read from CHURLISH_READ_DATABASE, if set; anything which
+    might be written back isn't.
+    """
+    def get_queryset(self):
+        queryset = super(ReadReplicaListMixin, self).get_queryset()
+        if getattr(self, 'action', None) != 'list':
+            return queryset
+        return using(queryset, request=self.request)
+
+
+class URLPageViewSet(ReadReplicaListMixin, QueryBudgetListMixin,
+                     RelativeCountsListMixin, viewsets.ModelViewSet):
+    queryset = URL.objects.select_related('site')
     serializer_class = URLSerializer
     paginate_by = api_settings.PAGINATE_BY or 10
     paginate_by_param = api_settings.PAGINATE_BY_PARAM or 'page'
 
 
-class SaferURLPageViewSet(mixins.CreateModelMixin,
+class SaferURLPageViewSet(ReadReplicaListMixin, QueryBudgetListMixin,
+                          RelativeCountsListMixin,
+                          mixins.CreateModelMixin,
                           mixins.RetrieveModelMixin,
                           mixins.UpdateModelMixin,
                           mixins.ListModelMixin,
@@ -21,3 +71,44 @@ class SaferURLPageViewSet(mixins.CreateModelMixin,
     serializer_class = URLPageViewSet.serializer_class
     paginate_by = URLPageViewSet.paginate_by
     paginate_by_param = URLPageViewSet.paginate_by_param
+
+
+class URLBulkView(APIView):
+    """
+    POST a list of URLs (with their rules) to create them, PUT or PATCH one
+    to update them, or DELETE a list of paths to remove them, a batch at a
+    time; see churlish.bulk for what each item looks like.
+    """
+    # for DjangoModelPermissions, which looks for the model here.
+    queryset = URLPageViewSet.queryset
+
+    def write(self, request, operation, key, success_status):
+        items = get_data(request)
+        if not isinstance(items, (list, tuple)):
+            return Response({'non_field_errors': ["Expected a list"]},
+                            status=status.HTTP_400_BAD_REQUEST)
+        try:
+            count = operation(items, site_id=get_site_id(request=request))
+        except bulk.BulkValidationError as e:
+            return Response({'errors': e.errors},
+                            status=status.HTTP_400_BAD_REQUEST)
+        return Response({key: count}, status=success_status)
+
+    def post(self, request, *args, **kwargs):
+        return self.write(request=request, operation=bulk.create,
+                          key='created', success_status=status.HTTP_201_CREATED)
+
+    def put(self, request, *args, **kwargs):
+        return self.write(request=request, operation=bulk.update,
+                          key='updated', success_status=status.HTTP_200_OK)
+
+    patch = put
+
+    def delete(self, request, *args, **kwargs):
+        return self.write(request=request, operation=bulk.delete,
+                          key='deleted', success_status=status.HTTP_200_OK)
+
+
+class SaferURLBulkView(URLBulkView):
+    http_method_names = [x for x in URLBulkView.http_method_names
+                         if x != 'delete']
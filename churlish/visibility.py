@@ -0,0 +1,111 @@
+"""
+Which of a list of links the user making a request would be let through
+to, for hiding those they wouldn't (eg: in navigation).
+
+The rules for every URL above every link are fetched at once (or taken
+from the snapshot, with that engine) and the built in partials evaluated
+in memory, so checking 200 links costs no more queries than checking one.
+Partials which aren't built in can't be evaluated this way, and are
+ignored. Links which would be redirected count as visible.
+
+    >>> visible_links(request, ['/a/', '/private/b/'])
+    ['/a/']
+
+or in a template:
+
+    {% load churlish_tags %}
+    {% for link in menu_links|visible_to:request %}
+"""
+from itertools import chain
+from .middleware import RequestURL, RequestTesters
+from .models import URL, LITERAL
+from .patterns import merge_ancestry
+from .routing import using
+from .sites import get_site_id
+from .paths import normalise_path, get_ancestry
+from .snapshot import (SnapshotEngine, FAIL, ENGINES, get_engine_name,
+                       get_store, get_ruleset, get_ancestry_from, patterns)
+
+try:
+    from urllib.parse import urlsplit
+except ImportError:  # pragma: no cover ... Python 2.
+    from urlparse import urlsplit
+
+
+def get_link_path(request, link):
+    """
+    The path to check for a link, which may be a path, a URL, or anything
+    with a `get_absolute_url`; None if it's for another host, as churlish's
+    rules don't apply to it.
+    """
+    if hasattr(link, 'get_absolute_url'):
+        link = link.get_absolute_url()
+    parts = urlsplit(link)
+    if parts.netloc and parts.netloc != request.get_host():
+        return None
+    if not parts.path:
+        return None
+    return normalise_path(parts.path)
+
+
+def get_rules_lookup(request, site_id, paths):
+    """
+    Something with a `get(path)` returning the RuleSet for a literal URL,
+    covering every ancestor of every path.
+    """
+    if get_engine_name() in ENGINES:
+        return get_store().get(site_id=site_id)
+    possibilities = set(chain.from_iterable(
+        get_ancestry(x) for x in paths))
+    if not possibilities:
+        return {}
+    url_handler = RequestURL(test_collector=RequestTesters())
+    urls = using(URL.objects.filter(site=site_id, kind=LITERAL,
+                                    path__in=possibilities), request=request)
+    selects = url_handler.get_select_related(request=request)
+    prefetches = url_handler.get_prefetch_related(request=request)
+    if selects:
+        urls = urls.select_related(*selects)
+    if prefetches:
+        urls = urls.prefetch_related(*prefetches)
+    # not .iterator(), which would skip the prefetches.
+    return dict((x.path, get_ruleset(x)) for x in urls)
+
+
+def get_engine_for(request):
+    partials = tuple(x for x in RequestTesters().get_tests(request=request)
+                     or () if SnapshotEngine.supports((x,)))
+    if not partials:
+        return None
+    return SnapshotEngine(partials=partials)
+
+
+def visible_links(request, links):
+    """
+    The links (in the same order) which the request's user may open.
+    """
+    links = tuple(links)
+    engine = get_engine_for(request=request)
+    if engine is None or not links:
+        return list(links)
+    exclusions = RequestURL().get_compiled_exclusions()
+    paths = tuple(get_link_path(request=request, link=x) for x in links)
+    checkable = frozenset(
+        x for x in paths
+        if x is not None and not any(y.search(x) for y in exclusions))
+
+    site_id = get_site_id(request=request)
+    lookup = get_rules_lookup(request=request, site_id=site_id,
+                              paths=checkable)
+    pattern_set = patterns.get(site_id=site_id).rules
+    ancestries = dict(
+        (x, merge_ancestry(get_ancestry_from(lookup=lookup.get, path=x),
+                           pattern_set.match(x)))
+        for x in checkable)
+    applicable = tuple(chain.from_iterable(ancestries.values()))
+    if engine.needs_preparing(rulesets=applicable):
+        engine.prepare(request=request, rulesets=applicable)
+    hidden = frozenset(
+        path for path, rulesets in ancestries.items()
+        if engine.decide(request=request, rulesets=rulesets).outcome == FAIL)
+    return [link for link, path in zip(links, paths) if path not in hidden]
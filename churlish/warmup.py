@@ -0,0 +1,134 @@
+"""
+Builds everything the middleware would otherwise build lazily on the first
+requests to each worker: the compiled exclusions, the partials & relations
+(see churlish.partials), the current Site, and (with the snapshot engine)
+a snapshot of the rules.
+
+Run before the server forks (eg: gunicorn's --preload, with
+CHURLISH_WARMUP = True so that it happens when Django is set up), the
+workers start warm and share the memory holding that state. Anything
+which can change afterwards is still checked against the shared
+generation, so a snapshot taken before forking is replaced in each worker
+once the rules change.
+"""
+import gc
+import logging
+from collections import namedtuple
+from timeit import default_timer
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.contrib.sites.models import Site
+from .middleware import RequestURL, RequestTesters, clear_runtime_state
+from .snapshot import get_store, ENGINES, get_engine_name, patterns
+from .sites import site_from_host_enabled, get_all_site_ids, hosts
+from .invalidation import HOSTS
+
+try:
+    from django.core.urlresolvers import get_script_prefix, set_script_prefix
+except ImportError:  # pragma: no cover ... Django 2.0+
+    from django.urls import get_script_prefix, set_script_prefix
+
+try:
+    from django.core.cache import caches
+except ImportError:  # pragma: no cover ... Django < 1.7
+    caches = None
+
+
+logger = logging.getLogger(__name__)
+
+WarmupStep = namedtuple('WarmupStep', 'name duration detail')
+
+
+def get_site_ids():
+    site_ids = getattr(settings, 'CHURLISH_WARMUP_SITES', None)
+    if site_ids is not None:
+        return site_ids
+    if site_from_host_enabled():
+        return get_all_site_ids()
+    return (settings.SITE_ID,)
+
+
+def warmup(site_ids=None):
+    """
+    Returns the steps taken, with how long each took, in seconds.
+    """
+    if site_ids is None:
+        site_ids = get_site_ids()
+    clear_runtime_state()
+    steps = []
+
+    def step(name, func):
+        started = default_timer()
+        detail = func()
+        steps.append(WarmupStep(name=name, duration=default_timer() - started,
+                                detail=detail))
+
+    step('exclusions', compile_exclusions)
+    testers = RequestTesters()
+    step('partials', lambda: tuple(x.__name__
+                                   for x in testers.get_test_classes() or ()))
+    step('relations', lambda: testers.get_relations())
+    step('needs', lambda: len(testers.get_needs() or ()))
+    if site_from_host_enabled():
+        step('hosts', lambda: len(hosts.get(site_id=HOSTS)))
+    else:
+        step('site', lambda: Site.objects.get_current().domain)
+    for site_id in site_ids:
+        step('patterns:{0!s}'.format(site_id),
+             lambda: len(patterns.get(site_id=site_id).rules))
+    if get_engine_name() in ENGINES:
+        store = get_store()
+        for site_id in site_ids:
+            step('{0!s}:{1!s}'.format(get_engine_name(), site_id),
+                 lambda: len(store.get(site_id=site_id)))
+    prepare_for_fork()
+    return tuple(steps)
+
+
+def compile_exclusions():
+    """
+    Outside of a request the script prefix is only known if it's forced;
+    otherwise requests beneath another SCRIPT_NAME compile their own
+    exclusions when they first arrive.
+    """
+    forced = getattr(settings, 'FORCE_SCRIPT_NAME', None)
+    if forced is None:
+        return len(RequestURL().get_compiled_exclusions())
+    previous = get_script_prefix()
+    set_script_prefix(forced)
+    try:
+        return len(RequestURL().get_compiled_exclusions())
+    finally:
+        set_script_prefix(previous)
+
+
+def prepare_for_fork():
+    """
+    Sockets mustn't be shared between forked workers, so database & cache
+    connections opened while warming up are closed, for each worker to open
+    its own. Then everything built so far is moved out of the garbage
+    collector's sight, so that collections in the workers don't touch (and
+    thus copy) the shared pages.
+    """
+    for connection in connections.all():
+        connection.close()
+    if caches is not None:
+        for backend in caches.all():
+            backend.close()
+    elif hasattr(cache, 'close'):
+        cache.close()
+    if hasattr(gc, 'freeze'):
+        gc.collect()
+        gc.freeze()
+
+
+def warmup_on_ready():
+    if not getattr(settings, 'CHURLISH_WARMUP', False):
+        return None
+    try:
+        return warmup()
+    except Exception:
+        # eg: the tables don't exist yet because this is `migrate`.
+        logger.warning("Unable to warm up churlish", exc_info=1)
+        return None
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+"""
+Generates a synthetic URL tree and benchmarks the churlish middleware and
+tree API against it, writing the results as JSON.
+
+    python runbenchmarks.py --size=10000 --depth=6 --fanout=8 -o base.json
+    python runbenchmarks.py --size=10000 --depth=6 --fanout=8 -o new.json
+    python runbenchmarks.py --compare base.json new.json
+"""
+import os
+import sys
+import json
+import platform
+import subprocess
+from optparse import OptionParser
+
+import django
+
+from django.conf import settings
+
+
+DEFAULT_SETTINGS = dict(
+    INSTALLED_APPS=[
+        "django.contrib.auth",
+        "django.contrib.contenttypes",
+        "django.contrib.sites",
+        "django.contrib.admin",
+        "churlish",
+    ],
+    DATABASES={
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": ":memory:",
+        }
+    },
+    SITE_ID=1,
+    ROOT_URLCONF="benchmarks.urls",
+    SECRET_KEY="notasecret",
+    DEBUG=False,
+)
+
+
+def get_parser():
+    parser = OptionParser(usage="%prog [options] | --compare OLD NEW")
+    parser.add_option('--size', type='int', default=10000,
+                      help="number of URLs to generate (10k to 1M)")
+    parser.add_option('--depth', type='int', default=6,
+                      help="maximum depth of the generated tree")
+    parser.add_option('--fanout', type='int', default=10,
+                      help="children per URL")
+    parser.add_option('--seed', type='int', default=1,
+                      help="random seed, for repeatable trees")
+    parser.add_option('--per-depth', type='int', default=20,
+                      dest='per_depth',
+                      help="paths sampled for each depth")
+    parser.add_option('--iterations', type='int', default=5,
+                      help="times each sampled path is requested")
+    parser.add_option('--database', default=':memory:',
+                      help="SQLite file to generate the tree into")
+    parser.add_option('-o', '--output', default=None,
+                      help="write JSON here instead of stdout")
+    parser.add_option('--compare', action='store_true', default=False,
+                      help="compare two previously written results")
+    return parser
+
+
+def get_revision():
+    here = os.path.dirname(os.path.abspath(__file__))
+    try:
+        output = subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                         cwd=here)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.decode('ascii').strip()
+
+
+def compare(old_path, new_path):
+    """
+    Prints the relative change in median latency and mean queries per
+    request for every measurement present in both results.
+    """
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    for section in ('process_view', 'tree_api'):
+        for key in sorted(set(old[section]) & set(new[section])):
+            before = old[section][key]
+            after = new[section][key]
+            old_p50 = before['latency_ms'].get('p50')
+            new_p50 = after['latency_ms'].get('p50')
+            if not old_p50 or new_p50 is None:
+                continue
+            change = ((new_p50 - old_p50) / old_p50) * 100.0
+            line = '{section!s} {key!s}: p50 {old:.3f}ms -> {new:.3f}ms ' \
+                   '({change:+.1f}%)'.format(section=section, key=key,
+                                            old=old_p50, new=new_p50,
+                                            change=change)
+            if 'queries' in before and 'queries' in after:
+                line += ', queries {old:.1f} -> {new:.1f}'.format(
+                    old=before['queries']['mean'],
+                    new=after['queries']['mean'])
+            sys.stdout.write(line + '\n')
+    return 0
+
+
+def runbenchmarks(options):
+    if not settings.configured:
+        DEFAULT_SETTINGS['DATABASES']['default']['NAME'] = options.database
+        settings.configure(**DEFAULT_SETTINGS)
+
+    if hasattr(django, "setup"):
+        django.setup()
+
+    parent = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, parent)
+
+    from django.core.management import call_command
+    call_command('syncdb', interactive=False, verbosity=0)
+
+    # Registers the URL ModelAdmin, which the middleware discovers
+    # its partials through.
+    import churlish.admin  # noqa
+    from django.contrib.sites.models import Site
+    from benchmarks.treegen import TreeSpec, populate, sample_by_depth
+    from benchmarks.cases import bench_process_view, bench_tree_api
+
+    spec = TreeSpec(size=options.size, depth=options.depth,
+                    fanout=options.fanout, seed=options.seed)
+    tree = populate(site=Site.objects.get_current(), spec=spec)
+    paths_by_depth = sample_by_depth(tree.paths, per_depth=options.per_depth,
+                                     seed=options.seed)
+    sampled = tuple(path for depth in sorted(paths_by_depth)
+                    for path in paths_by_depth[depth])
+
+    results = {
+        'revision': get_revision(),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'spec': spec._asdict(),
+        'rules': tree.counts,
+        'urls': len(tree.paths),
+        'process_view': bench_process_view(paths_by_depth, users=tree.users,
+                                           iterations=options.iterations),
+        'tree_api': bench_tree_api(sampled, iterations=options.iterations),
+    }
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if options.output:
+        with open(options.output, 'w') as f:
+            f.write(output)
+    else:
+        sys.stdout.write(output + '\n')
+    return 0
+
+
+if __name__ == "__main__":
+    parser = get_parser()
+    options, args = parser.parse_args()
+    if options.compare:
+        if len(args) != 2:
+            parser.error("--compare needs the OLD and NEW result files")
+        sys.exit(compare(*args))
+    sys.exit(runbenchmarks(options))
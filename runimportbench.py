@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+"""
+Times how long setting up Django & importing the runtime modules of
+churlish takes in a fresh interpreter, without the admin or REST
+framework installed, and fails if any of them were imported anyway.
+
+    python runimportbench.py --runs=20 -o imports.json
+    python runimportbench.py --budget=250
+
+Each run is its own process, as a module is only ever imported once.
+"""
+import os
+import sys
+import json
+import platform
+import subprocess
+from optparse import OptionParser
+from timeit import default_timer
+
+
+LEAN_SETTINGS = dict(
+    INSTALLED_APPS=[
+        "django.contrib.auth",
+        "django.contrib.contenttypes",
+        "django.contrib.sites",
+        "churlish",
+    ],
+    MIDDLEWARE_CLASSES=[
+        "churlish.middleware.ChurlishMiddleware",
+    ],
+    DATABASES={
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": ":memory:",
+        }
+    },
+    SITE_ID=1,
+    SECRET_KEY="notasecret",
+    DEBUG=False,
+)
+
+# what serving a request needs, in the order they'd first be imported.
+RUNTIME_MODULES = (
+    'churlish.models',
+    'churlish.partials',
+    'churlish.middleware_filters',
+    'churlish.snapshot',
+    'churlish.redirects',
+    'churlish.middleware',
+    'churlish.effective',
+    'churlish.index',
+    'churlish.visibility',
+)
+# none of which should be imported by the above.
+FORBIDDEN_MODULES = (
+    'django.contrib.admin',
+    'churlish.admin',
+    'churlish.admin_inlines',
+    'churlish.admin_filters',
+    'churlish.serializers',
+    'churlish.views_drf',
+    'rest_framework',
+)
+
+
+def get_parser():
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option('--runs', type='int', default=10,
+                      help="fresh interpreters to time the imports in")
+    parser.add_option('--budget', type='float', default=None,
+                      help="fail if the median total exceeds this many "
+                           "milliseconds")
+    parser.add_option('--child', action='store_true', default=False,
+                      help="time a single run, writing JSON to stdout")
+    parser.add_option('-o', '--output', default=None,
+                      help="write JSON here instead of stdout")
+    return parser
+
+
+def get_revision():
+    here = os.path.dirname(os.path.abspath(__file__))
+    try:
+        output = subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                         cwd=here)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.decode('ascii').strip()
+
+
+def run_child():
+    parent = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, parent)
+    started = default_timer()
+    import django
+    from django.conf import settings
+    settings.configure(**LEAN_SETTINGS)
+    if hasattr(django, "setup"):
+        django.setup()
+    setup = default_timer() - started
+    modules = {}
+    for name in RUNTIME_MODULES:
+        # anything already imported during setup costs nothing here.
+        module_started = default_timer()
+        __import__(name)
+        modules[name] = (default_timer() - module_started) * 1000
+    total = default_timer() - started
+    forbidden = sorted(x for x in sys.modules
+                       if sys.modules[x] is not None and
+                       any(x == y or x.startswith(y + '.')
+                           for y in FORBIDDEN_MODULES))
+    return {
+        'setup_ms': setup * 1000,
+        'total_ms': total * 1000,
+        'modules_ms': modules,
+        'loaded': len(sys.modules),
+        'forbidden': forbidden,
+    }
+
+
+def median(values):
+    ordered = sorted(values)
+    middle = len(ordered) // 2
+    if len(ordered) % 2:
+        return ordered[middle]
+    return (ordered[middle - 1] + ordered[middle]) / 2.0
+
+
+def summarise(values):
+    return {
+        'min': min(values),
+        'median': median(values),
+        'max': max(values),
+    }
+
+
+def runimportbench(options):
+    runs = []
+    for _ in range(options.runs):
+        output = subprocess.check_output(
+            [sys.executable, os.path.abspath(__file__), '--child'])
+        runs.append(json.loads(output.decode('utf-8')))
+    forbidden = sorted(set(x for run in runs for x in run['forbidden']))
+    results = {
+        'revision': get_revision(),
+        'python': platform.python_version(),
+        'runs': len(runs),
+        'setup_ms': summarise([x['setup_ms'] for x in runs]),
+        'total_ms': summarise([x['total_ms'] for x in runs]),
+        'modules_ms': dict(
+            (name, summarise([x['modules_ms'][name] for x in runs]))
+            for name in RUNTIME_MODULES),
+        'loaded': summarise([x['loaded'] for x in runs]),
+        'forbidden': forbidden,
+    }
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if options.output:
+        with open(options.output, 'w') as f:
+            f.write(output)
+    else:
+        sys.stdout.write(output + '\n')
+    if forbidden:
+        sys.stderr.write("Imported without being installed: {0!s}\n".format(
+            ', '.join(forbidden)))
+        return 1
+    budget = options.budget
+    if budget is not None and results['total_ms']['median'] > budget:
+        sys.stderr.write("Median import time of {0:.1f}ms exceeds the budget "
+                         "of {1:.1f}ms\n".format(results['total_ms']['median'],
+                                                 budget))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = get_parser()
+    options, args = parser.parse_args()
+    if options.child:
+        sys.stdout.write(json.dumps(run_child()) + '\n')
+        sys.exit(0)
+    sys.exit(runimportbench(options))
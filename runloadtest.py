@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+"""
+Serves a synthetic URL tree through a local WSGI server and replays a
+Zipf distributed stream of paths against it from many threads at once,
+for each churlish configuration and tree size asked for, writing the
+latency, throughput and queries per request as JSON.
+
+    python runloadtest.py --sizes=1000,100000 --threads=16 -o load.json
+    python runloadtest.py --configs=reference,snapshot --requests=20000
+
+Each tree size is run in its own process, against its own database.
+"""
+import os
+import sys
+import json
+import shutil
+import platform
+import tempfile
+import subprocess
+from optparse import OptionParser
+
+import django
+
+from django.conf import settings
+
+
+DEFAULT_SETTINGS = dict(
+    INSTALLED_APPS=[
+        "django.contrib.auth",
+        "django.contrib.contenttypes",
+        "django.contrib.sessions",
+        "django.contrib.sites",
+        "django.contrib.admin",
+        "churlish",
+    ],
+    MIDDLEWARE_CLASSES=[
+        "django.contrib.sessions.middleware.SessionMiddleware",
+        "django.contrib.auth.middleware.AuthenticationMiddleware",
+        "churlish.middleware.ChurlishMiddleware",
+    ],
+    DATABASES={
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            # every server thread has its own connection, so the tree
+            # can't live in memory.
+            "NAME": None,
+        }
+    },
+    CACHES={
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        }
+    },
+    SITE_ID=1,
+    ROOT_URLCONF="benchmarks.urls",
+    SECRET_KEY="notasecret",
+    ALLOWED_HOSTS=["*"],
+    DEBUG=False,
+)
+
+PASSWORD = 'benchmark'
+
+
+def get_parser():
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option('--sizes', default='1000,10000',
+                      help="comma separated numbers of URLs to generate")
+    parser.add_option('--depth', type='int', default=6,
+                      help="maximum depth of the generated tree")
+    parser.add_option('--fanout', type='int', default=10,
+                      help="children per URL")
+    parser.add_option('--seed', type='int', default=1,
+                      help="random seed, for repeatable trees and streams")
+    parser.add_option('--configs', default=None,
+                      help="comma separated configurations to run (see "
+                           "benchmarks.load.CONFIGURATIONS), default all")
+    parser.add_option('--threads', type='int', default=8,
+                      help="concurrent client threads")
+    parser.add_option('--requests', type='int', default=5000,
+                      help="requests per configuration and identity")
+    parser.add_option('--warmup', type='int', default=200,
+                      help="requests made before measuring each "
+                           "configuration")
+    parser.add_option('--exponent', type='float', default=1.1,
+                      help="skew of the Zipf distribution of paths")
+    parser.add_option('-o', '--output', default=None,
+                      help="write JSON here instead of stdout")
+    return parser
+
+
+def get_revision():
+    here = os.path.dirname(os.path.abspath(__file__))
+    try:
+        output = subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                         cwd=here)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.decode('ascii').strip()
+
+
+def get_sizes(options):
+    return tuple(int(x) for x in options.sizes.split(',') if x.strip())
+
+
+def get_session_cookie(user):
+    from django.test.client import Client
+    user.set_password(PASSWORD)
+    user.save()
+    client = Client()
+    if not client.login(username=user.get_username(), password=PASSWORD):
+        raise RuntimeError("Unable to log in as {0!s}".format(user))
+    name = settings.SESSION_COOKIE_NAME
+    return '{0!s}={1!s}'.format(name, client.cookies[name].value)
+
+
+def clear_caches():
+    """
+    Every configuration starts from nothing, rather than from whatever the
+    previous one left behind.
+    """
+    from django.core.cache import cache
+    from churlish.middleware import clear_runtime_state
+    from churlish.snapshot import STORES
+    from churlish.index import indexes
+    cache.clear()
+    clear_runtime_state()
+    for store in STORES:
+        store.clear()
+    indexes.clear()
+
+
+def run_size(options, size):
+    directory = tempfile.mkdtemp(prefix='churlish-load-')
+    try:
+        database = os.path.join(directory, 'load.sqlite3')
+        DEFAULT_SETTINGS['DATABASES']['default']['NAME'] = database
+        settings.configure(**DEFAULT_SETTINGS)
+        if hasattr(django, "setup"):
+            django.setup()
+
+        parent = os.path.dirname(os.path.abspath(__file__))
+        sys.path.insert(0, parent)
+
+        from django.core.management import call_command
+        call_command('syncdb', interactive=False, verbosity=0)
+
+        # Registers the URL ModelAdmin, which the middleware discovers
+        # its partials through when CHURLISH_PARTIALS isn't set.
+        import churlish.admin  # noqa
+        from django.contrib.sites.models import Site
+        from django.test.utils import override_settings
+        from benchmarks.treegen import TreeSpec, populate
+        from benchmarks.load import (CONFIGURATIONS, LoadServer,
+                                     zipf_streams, replay)
+
+        spec = TreeSpec(size=size, depth=options.depth,
+                        fanout=options.fanout, seed=options.seed)
+        tree = populate(site=Site.objects.get_current(), spec=spec)
+        identities = (('anonymous', None),
+                      ('authenticated', get_session_cookie(tree.users[0])))
+        streams = zipf_streams(paths=tree.paths, count=options.requests,
+                               threads=options.threads,
+                               exponent=options.exponent, seed=options.seed)
+        warmup = zipf_streams(paths=tree.paths, count=options.warmup,
+                              threads=options.threads,
+                              exponent=options.exponent,
+                              seed=options.seed + options.threads)
+        names = sorted(CONFIGURATIONS)
+        if options.configs:
+            names = [x.strip() for x in options.configs.split(',')]
+
+        results = {}
+        with LoadServer() as server:
+            for name in names:
+                with override_settings(**CONFIGURATIONS[name]):
+                    for identity, cookie in identities:
+                        clear_caches()
+                        replay(server=server, streams=warmup, cookie=cookie)
+                        key = '{0!s} {1!s}'.format(name, identity)
+                        results[key] = replay(server=server, streams=streams,
+                                              cookie=cookie)
+        return {
+            'spec': spec._asdict(),
+            'rules': tree.counts,
+            'urls': len(tree.paths),
+            'configurations': results,
+        }
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def runloadtest(options):
+    sizes = get_sizes(options)
+    results = {
+        'revision': get_revision(),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'threads': options.threads,
+        'requests': options.requests,
+        'exponent': options.exponent,
+        'sizes': {},
+    }
+    if len(sizes) == 1:
+        results['sizes'][str(sizes[0])] = run_size(options, sizes[0])
+    else:
+        # settings can only be configured once per process.
+        for size in sizes:
+            arguments = ['--sizes={0:d}'.format(size)]
+            for name in ('depth', 'fanout', 'seed', 'configs', 'threads',
+                         'requests', 'warmup', 'exponent'):
+                value = getattr(options, name)
+                if value is not None:
+                    arguments.append('--{0!s}={1!s}'.format(name, value))
+            output = subprocess.check_output(
+                [sys.executable, os.path.abspath(__file__)] + arguments)
+            child = json.loads(output.decode('utf-8'))
+            results['sizes'].update(child['sizes'])
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if options.output:
+        with open(options.output, 'w') as f:
+            f.write(output)
+    else:
+        sys.stdout.write(output + '\n')
+    return 0
+
+
+if __name__ == "__main__":
+    parser = get_parser()
+    options, args = parser.parse_args()
+    sys.exit(runloadtest(options))
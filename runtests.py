@@ -11,11 +11,17 @@ DEFAULT_SETTINGS = dict(
     INSTALLED_APPS=[
         "django.contrib.auth",
         "django.contrib.contenttypes",
+        "django.contrib.sessions",
         "django.contrib.sites",
         "django.contrib.admin",
         "churlish",
         "churlish.tests"
     ],
+    MIDDLEWARE_CLASSES=[
+        "django.contrib.sessions.middleware.SessionMiddleware",
+        "django.contrib.auth.middleware.AuthenticationMiddleware",
+        "churlish.middleware.ChurlishMiddleware",
+    ],
     DATABASES={
         "default": {
             "ENGINE": "django.db.backends.sqlite3",
@@ -25,6 +31,8 @@ DEFAULT_SETTINGS = dict(
     SITE_ID=1,
     ROOT_URLCONF="churlish.tests.urls",
     SECRET_KEY="notasecret",
+    # fail any test which pushes a hot path over its query budget.
+    CHURLISH_ENFORCE_QUERY_BUDGETS=True,
 )
 
 